@@ -0,0 +1,329 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: exports are only serialized within one process
+    fcntl = None
+
+# Columns exported per ticket; free text stays in the store
+TICKET_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('created', pa.timestamp('s')),
+    ('resolved', pa.timestamp('s')),
+    ('priority', pa.string()),
+    ('category', pa.string()),
+    ('status', pa.string()),
+    ('classifier_version', pa.string()),
+    ('rev', pa.int64()),
+])
+
+ROLLUP_SCHEMA = pa.schema([
+    ('bucket', pa.timestamp('s')),
+    ('category', pa.string()),
+    ('priority', pa.string()),
+    ('status', pa.string()),
+    ('tickets', pa.int64()),
+    ('resolved', pa.int64()),
+    ('resolve_seconds', pa.int64()),
+])
+
+_DIMENSIONS = ('category', 'priority', 'status')
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+_PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+
+def _write_atomic(table, path, writer):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    writer(table, temp_path)
+    os.replace(temp_path, path)
+
+
+def _write_arrow(table, path):
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_arrow(path):
+    """Memory-mapped Arrow file; columns are read from the page cache on use"""
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _to_table(tickets):
+    columns = {name: [] for name in ('id', 'created', 'resolved', 'priority', 'category', 'status',
+                                     'classifier_version', 'rev')}
+    for ticket in tickets:
+        columns['id'].append(ticket['id'])
+        columns['created'].append(ticket.get('date'))
+        columns['resolved'].append(ticket.get('resolved_date') or None)
+        columns['priority'].append(ticket.get('priority'))
+        columns['category'].append(ticket.get('category'))
+        columns['status'].append(ticket.get('status'))
+        columns['classifier_version'].append(ticket.get('classifier_version'))
+        columns['rev'].append(ticket.get('rev'))
+    # Dates are parsed in one vectorized pass rather than per ticket
+    for name in ('created', 'resolved'):
+        columns[name] = pc.strptime(
+            pa.array(columns[name], pa.string()), format=_TIME_FORMAT, unit='s', error_is_null=True
+        )
+    return pa.table(columns, schema=TICKET_SCHEMA)
+
+
+def _rollup(tickets, unit):
+    """Ticket counts per time bucket and dimension, from a TICKET_SCHEMA table"""
+    seconds = pc.cast(pc.subtract(tickets['resolved'], tickets['created']), pa.int64())
+    grouped = pa.table({
+        'bucket': pc.floor_temporal(tickets['created'], unit=unit),
+        **{name: tickets[name] for name in _DIMENSIONS},
+        'id': tickets['id'],
+        'seconds': seconds,
+    }).group_by(['bucket', *_DIMENSIONS]).aggregate([('id', 'count'), ('seconds', 'count'), ('seconds', 'sum')])
+    table = pa.table({
+        'bucket': grouped['bucket'],
+        **{name: grouped[name] for name in _DIMENSIONS},
+        'tickets': grouped['id_count'],
+        'resolved': grouped['seconds_count'],
+        'resolve_seconds': pc.fill_null(grouped['seconds_sum'], 0),
+    }, schema=ROLLUP_SCHEMA)
+    return table.sort_by([('bucket', 'ascending')])
+
+
+class AnalyticsExport:
+    """
+    Columnar copy of the ticket store for trend analysis.
+
+    Tickets are written to one Parquet file per day they were created
+    (tickets/date=YYYY-MM-DD/), so a date range only reads the files of
+    those days, and only the columns asked for. Next to them are
+    precomputed rollups in Arrow files that are memory-mapped on read:
+    hourly per day and one daily file, counting tickets, resolutions and
+    time to resolve by category, priority and status.
+
+    Exports are incremental: only tickets changed since the last export's
+    store revision are written, and only the days they were created on are
+    rewritten. Writes are atomic, so readers never see a half-written file,
+    and a lock file keeps several server processes from exporting at once.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): Directory holding the export
+        """
+        self.root = root
+        self.tickets_dir = os.path.join(root, 'tickets')
+        self.hourly_dir = os.path.join(root, 'rollups', 'hourly')
+        self.daily_path = os.path.join(root, 'rollups', 'daily.arrow')
+        self.state_path = os.path.join(root, 'state.json')
+        # One export at a time per process
+        self._lock = threading.Lock()
+
+    def _day_path(self, day):
+        return os.path.join(self.tickets_dir, f'date={day}', 'tickets.parquet')
+
+    def _hourly_path(self, day):
+        return os.path.join(self.hourly_dir, f'{day}.arrow')
+
+    @contextmanager
+    def _exclusive(self):
+        """Yields False while another process is exporting"""
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    @property
+    def version(self):
+        """Store revision the export is current to"""
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)['version']
+        except FileNotFoundError:
+            return 0
+
+    def _save_version(self, version):
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'exported': time.time()}, f)
+        os.replace(temp_path, self.state_path)
+
+    def _write_days(self, tickets):
+        """Replace the changed tickets in the files of the days they were created on"""
+        by_day = {}
+        for ticket in tickets:
+            day = (ticket.get('date') or '')[:10]
+            if day:
+                by_day.setdefault(day, []).append(ticket)
+        daily = []
+        for day, changed in by_day.items():
+            table = _to_table(changed)
+            path = self._day_path(day)
+            if os.path.exists(path):
+                # Parquet has no second-resolution timestamps; they come back as ms
+                existing = pq.read_table(path, memory_map=True).cast(TICKET_SCHEMA)
+                kept = existing.filter(pc.invert(pc.is_in(existing['id'], value_set=table['id'])))
+                table = pa.concat_tables([kept, table])
+            table = table.sort_by('id')
+            _write_atomic(table, path, lambda table, path: pq.write_table(table, path, compression='zstd'))
+            _write_atomic(_rollup(table, 'hour'), self._hourly_path(day), _write_arrow)
+            daily.append(_rollup(table, 'day'))
+        if daily:
+            self._merge_daily(daily, by_day)
+        return by_day
+
+    def _merge_daily(self, rollups, days):
+        table = pa.concat_tables(rollups)
+        if os.path.exists(self.daily_path):
+            existing = _read_arrow(self.daily_path)
+            replaced = pa.array([date.fromisoformat(day) for day in days], pa.date32())
+            existing = existing.filter(pc.invert(pc.is_in(pc.cast(existing['bucket'], pa.date32()), value_set=replaced)))
+            table = pa.concat_tables([existing, table])
+        _write_atomic(table.sort_by([('bucket', 'ascending')]), self.daily_path, _write_arrow)
+
+    def export(self, store, page_size=100000):
+        """
+        Bring the export up to date with a TicketStore
+
+        Args:
+            store (TicketStore): Source of the tickets
+            page_size (int): Tickets written per step; progress is saved after each
+
+        Returns:
+            int: Number of tickets written
+        """
+        with self._lock, self._exclusive() as exclusive:
+            if not exclusive:
+                return 0
+            written = 0
+            version = self.version
+            if version == 0:
+                # Everything: read in submission order, which keeps each page
+                # to a few days. Changes made meanwhile are picked up next time
+                current = store.version
+                tickets = store.all()
+                for start in range(0, len(tickets), page_size):
+                    page = tickets[start:start + page_size]
+                    self._write_days(page)
+                    written += len(page)
+                if current:
+                    self._save_version(current)
+                return written
+            while True:
+                changed = store.changed_since(version, limit=page_size)
+                if not changed:
+                    return written
+                self._write_days(changed)
+                written += len(changed)
+                version = changed[-1]['rev']
+                self._save_version(version)
+                if len(changed) < page_size:
+                    return written
+
+    def run(self, store, interval, stopping=None):
+        """Export every `interval` seconds until the stopping event is set"""
+        stopping = stopping or threading.Event()
+        while not stopping.is_set():
+            try:
+                self.export(store)
+            except Exception as e:
+                logging.exception(f"Analytics export error: {e}")
+            stopping.wait(interval)
+
+    def read_tickets(self, start=None, end=None, columns=None):
+        """
+        Exported tickets created between two days
+
+        Args:
+            start (str): First day, YYYY-MM-DD; None for the earliest
+            end (str): Last day, inclusive; None for the latest
+            columns (list): Columns to read; None for all
+
+        Returns:
+            pyarrow.Table: The tickets, with the day they were created as 'date'
+        """
+        if not os.path.isdir(self.tickets_dir):
+            return TICKET_SCHEMA.empty_table()
+        dataset = ds.dataset(self.tickets_dir, format='parquet', partitioning=_PARTITIONING)
+        condition = None
+        if start is not None:
+            condition = ds.field('date') >= start
+        if end is not None:
+            condition = ds.field('date') <= end if condition is None else condition & (ds.field('date') <= end)
+        # The condition is on the partition key, so other days are never opened
+        return dataset.to_table(columns=columns, filter=condition)
+
+    def read_rollup(self, granularity='daily', start=None, end=None, columns=None):
+        """
+        Precomputed counts per day or per hour
+
+        Args:
+            granularity (str): 'daily' or 'hourly'
+            start (str): First day, YYYY-MM-DD; None for the earliest
+            end (str): Last day, inclusive; None for the latest
+            columns (list): Columns to return; None for all
+
+        Returns:
+            pyarrow.Table: Rows in ROLLUP_SCHEMA, ordered by bucket
+        """
+        if granularity == 'daily':
+            tables = [_read_arrow(self.daily_path)] if os.path.exists(self.daily_path) else []
+        elif granularity == 'hourly':
+            if not os.path.isdir(self.hourly_dir):
+                return ROLLUP_SCHEMA.empty_table()
+            days = sorted(name[:-len('.arrow')] for name in os.listdir(self.hourly_dir) if name.endswith('.arrow'))
+            days = [day for day in days if (start is None or day >= start) and (end is None or day <= end)]
+            tables = [_read_arrow(self._hourly_path(day)) for day in days]
+        else:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        if not tables:
+            return ROLLUP_SCHEMA.empty_table()
+        table = pa.concat_tables(tables)
+        days = pc.cast(table['bucket'], pa.date32())
+        if start is not None:
+            table = table.filter(pc.greater_equal(days, pa.scalar(date.fromisoformat(start))))
+            days = pc.cast(table['bucket'], pa.date32())
+        if end is not None:
+            table = table.filter(pc.less_equal(days, pa.scalar(date.fromisoformat(end))))
+        return table.select(columns) if columns else table
+
+
+if __name__ == '__main__':
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(description='Export tickets to Parquet and refresh the rollups')
+    parser.add_argument('--backend', default=os.getenv('TICKET_STORE', 'jsonl'), choices=('jsonl', 'sqlite'))
+    parser.add_argument('--output', default=os.getenv('ANALYTICS_DIR', 'analytics'))
+    args = parser.parse_args()
+
+    store = open_store(
+        args.backend,
+        'requests_db.json',
+        os.getenv('REQUESTS_LOG_FILE', 'requests_db.log.jsonl'),
+        os.getenv('TICKET_DB_FILE', 'tickets.db')
+    )
+    started = time.perf_counter()
+    written = AnalyticsExport(args.output).export(store)
+    print(f"Exported {written} tickets to {args.output} in {time.perf_counter() - started:.1f} s")
+    store.close()
@@ -1,9 +1,17 @@
-from flask import Flask, render_template, request, jsonify, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, jsonify, Response, flash, redirect, url_for, g, session, make_response, stream_with_context
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 import os
-from classifier import IssueClassifier
+import threading
+import time
+import metrics
 from mailer import EmailSender
+from notifications import NotificationQueue
+from events import EventLog, TICKET_CREATED, TICKET_RESOLVED
+from scheduling import TeamLimits, parse_rates
+from dedup import Deduplicator
+from storage import open_store
+from startup import LAZY_STARTUP, Deferred, ProcessStart, profile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,36 +19,354 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
-classifier = IssueClassifier()
+
+# Importing this module only wires things up. The classifier and the ticket
+# store are built on first use, or in the background once the process serves
+# its first request; background workers start then too, so each process of a
+# preloading server (gunicorn --preload) runs its own. /api/startup reports
+# readiness and where the startup time went. LAZY_STARTUP=false builds
+# everything at import instead.
+process_start = ProcessStart()
+
+def create_classifier():
+    # models pulls in numpy and the settings; only imported when needed
+    from models import create_classifier
+    return create_classifier()
+
+# Backend chosen by CLASSIFICATION_MODEL, loaded in the background on first use
+classifier = Deferred('classifier', create_classifier)
 email_sender = EmailSender()
 
-# File to store requests
+# Ticket storage: 'jsonl' keeps a snapshot plus an append-only log of changes,
+# 'sqlite' shares one indexed database between worker processes
+TICKET_STORE = os.getenv('TICKET_STORE', 'jsonl')
 REQUESTS_FILE = 'requests_db.json'
+REQUESTS_LOG_FILE = os.getenv('REQUESTS_LOG_FILE', 'requests_db.log.jsonl')
+TICKET_DB_FILE = os.getenv('TICKET_DB_FILE', 'tickets.db')
+
+store = Deferred('store', lambda: open_store(
+    TICKET_STORE,
+    REQUESTS_FILE,
+    REQUESTS_LOG_FILE,
+    TICKET_DB_FILE,
+    compact_every=int(os.getenv('REQUESTS_COMPACT_EVERY', 10000))
+))
+
+@process_start.register
+def warm_up():
+    store.warm_up()
+    classifier.warm_up()
+    # Build the full-text index in the background so the first search is fast
+    threading.Thread(target=lambda: store.build_search_index(), name='search-index', daemon=True).start()
+
+# Ticket emails are queued in a persistent outbox and sent by background
+# workers, so submitting or resolving never waits on the mail server.
+# High priority tickets go out first, and each handler team (category) can be
+# limited to NOTIFICATION_TEAM_RATES emails per minute, e.g. "billing=30"
+notification_queue = NotificationQueue(
+    email_sender,
+    store,
+    os.getenv('OUTBOX_FILE', 'outbox.db'),
+    workers=int(os.getenv('NOTIFICATION_WORKERS', 2)),
+    max_attempts=int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5)),
+    limits=TeamLimits(
+        parse_rates(os.getenv('NOTIFICATION_TEAM_RATES')),
+        default_rate=float(os.getenv('NOTIFICATION_TEAM_RATE', 0))
+    ),
+    aging=float(os.getenv('NOTIFICATION_PRIORITY_AGING', 300))
+)
+
+# Ticket events in a durable log: /api/events streams them to the dashboard,
+# and the notification router turns them into outbox emails. Events reach the
+# router at least once across all server processes; the emails are keyed by
+# event offset, so one handled twice is still queued once
+event_log = EventLog(
+    os.getenv('EVENTS_FILE', 'events.db'),
+    max_attempts=int(os.getenv('EVENTS_MAX_ATTEMPTS', 5)),
+    retention=float(os.getenv('EVENTS_RETENTION', 7 * 86400))
+)
+
+def route_event(event):
+    ticket = event['ticket']
+    if event['type'] == TICKET_CREATED:
+        # Confirmation, admin notice and the handler team for the category
+        notification_queue.notify_new_ticket(ticket, event_id=event['offset'])
+    elif event['type'] == TICKET_RESOLVED:
+        notification_queue.notify_resolved(ticket, ticket.get('resolution_notes', ''), event_id=event['offset'])
+
+@process_start.register
+def start_notifications():
+    notification_queue.start()
+    event_log.consume('notifications', route_event)
+
+# Columnar export with daily and hourly rollups for the dashboard's trend
+# views, brought up to date every ANALYTICS_EXPORT_INTERVAL seconds (0 turns
+# it off); needs pyarrow
+ANALYTICS_EXPORT_INTERVAL = float(os.getenv('ANALYTICS_EXPORT_INTERVAL', 300))
+
+@process_start.register
+def start_analytics_export():
+    if ANALYTICS_EXPORT_INTERVAL <= 0:
+        return
+    try:
+        from analytics import AnalyticsExport
+    except ImportError as e:
+        app.logger.warning(f"Analytics export disabled: {e}")
+        return
+    threading.Thread(
+        target=AnalyticsExport(os.getenv('ANALYTICS_DIR', 'analytics')).run,
+        args=(store, ANALYTICS_EXPORT_INTERVAL),
+        name='analytics-export',
+        daemon=True
+    ).start()
+
+app.before_request(process_start)
+if not LAZY_STARTUP:
+    process_start()
 
-# Initialize requests database from file or create empty if not exists
-def load_requests_db():
-    if os.path.exists(REQUESTS_FILE):
-        with open(REQUESTS_FILE, 'r') as f:
-            return json.load(f)
-    return []
+# Repeat submissions are merged into the open ticket they repeat instead of
+# being classified, stored and emailed again
+deduplicator = Deduplicator(
+    max_entries=int(os.getenv('DEDUP_MAX_ENTRIES', 10000)),
+    ttl=float(os.getenv('DEDUP_TTL', 3600)),
+    near_duplicates=os.getenv('DEDUP_NEAR_DUPLICATES', 'true').lower() != 'false'
+)
 
-def save_requests_db(requests_db):
-    with open(REQUESTS_FILE, 'w') as f:
-        json.dump(requests_db, f, indent=2)
+# Prometheus metrics; with METRICS_ENABLED=false the hooks are not installed
+# and the timers below do nothing
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
 
-# Load initial requests
-requests_db = load_requests_db()
+    @app.after_request
+    def record_request_time(response):
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - g.request_started,
+            app='flask', endpoint=request.endpoint or 'unknown', method=request.method
+        )
+        return response
+
+    metrics.Gauge(
+        'notification_outbox_emails', 'Outbox emails per delivery status',
+        lambda: {(status,): count for status, count in notification_queue.stats().items()}, ('status',)
+    )
+    metrics.Gauge(
+        'classifier_queue_depth', 'Texts waiting to be micro-batched',
+        lambda: classifier.queue_depth if classifier.is_built else 0
+    )
+
+def render(template, **context):
+    with metrics.RENDER_SECONDS.time(template=template):
+        return render_template(template, **context)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.ENABLED:
+        return "Metrics are disabled", 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/startup')
+def api_startup():
+    """Readiness probe with the startup profile; 503 until the store and classifier are loaded"""
+    ready = store.is_built and classifier.is_built
+    return jsonify(dict(profile.report(), ready=ready, pid=os.getpid())), 200 if ready else 503
 
 @app.route('/')
 def index():
-    # Pass the requests_db to the template, showing only the last 5 requests
-    recent_requests = requests_db[-5:][::-1]  # Get last 5 requests, newest first
-    return render_template('index.html', requests_db=recent_requests)
+    # Pass the last 5 requests to the template, newest first
+    recent_requests = store.recent(5)
+    return render('index.html', requests_db=recent_requests)
+
+# Page size limits for the recent requests API
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 # Add API endpoint for Streamlit app
 @app.route('/api/recent-requests', methods=['GET'])
 def api_recent_requests():
-    return jsonify(requests_db)
+    """
+    Most recent requests, newest first, one page at a time
+
+    Query parameters:
+        limit: Page size (default 100, at most 1000)
+        cursor: Only requests older than this id; pass X-Next-Cursor from the
+            previous page to continue
+        since_id: Only requests newer than this id
+        status, category, priority: Exact-match filters
+    """
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        since_id = int(request.args['since_id']) if request.args.get('since_id') else None
+    except ValueError:
+        return jsonify({'error': 'limit, cursor and since_id must be integers'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    page = store.find(
+        status=request.args.get('status') or None,
+        category=request.args.get('category') or None,
+        priority=request.args.get('priority') or None,
+        after_id=since_id,
+        before_id=cursor,
+        newest_first=True,
+        limit=limit
+    )
+    response = jsonify(page)
+    if len(page) == limit:
+        response.headers['X-Next-Cursor'] = str(page[-1]['id'])
+    return response
+
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+    """Pre-aggregated counts and time-to-resolve, kept up to date on submit and resolve"""
+    return jsonify(dict(store.stats(), version=store.version))
+
+@app.route('/api/changes', methods=['GET'])
+def api_changes():
+    """
+    Requests created or changed after a revision, for incremental sync
+
+    Query parameters:
+        since: Revision the client has already seen (default 0, i.e. everything)
+        limit: Page size (default 1000, at most 1000)
+
+    Returns the tickets in revision order plus the revision to pass as since
+    next time; has_more is true while further pages are waiting.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    tickets = store.changed_since(since, limit=limit)
+    return jsonify({
+        'tickets': tickets,
+        # The last rev actually returned, so nothing written meanwhile is skipped
+        'version': tickets[-1]['rev'] if tickets else since,
+        'has_more': len(tickets) == limit
+    })
+
+# Event feed limits; a long poll or an idle stream returns after EVENTS_WAIT
+# seconds, and a stream ends after EVENTS_STREAM_DURATION seconds so it does
+# not hold a server thread forever (EventSource reconnects by itself)
+MAX_EVENTS_PAGE_SIZE = 1000
+EVENTS_WAIT = 25
+EVENTS_STREAM_DURATION = float(os.getenv('EVENTS_STREAM_DURATION', 300))
+
+def _event_stream(after, types):
+    """Server-Sent Events from an offset; each id is the offset to resume from"""
+    deadline = time.monotonic() + EVENTS_STREAM_DURATION
+    while time.monotonic() < deadline:
+        events = event_log.read(after, MAX_EVENTS_PAGE_SIZE, types)
+        for event in events:
+            yield f"id: {event['offset']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            after = event['offset']
+        if not events and not event_log.wait(after, min(EVENTS_WAIT, max(0.0, deadline - time.monotonic()))):
+            # Comment line, so proxies keep the idle connection open
+            yield ': keep-alive\n\n'
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """
+    Ticket events (ticket-created, ticket-resolved) after an offset
+
+    Query parameters:
+        after: Offset already seen; without it only new events are returned
+        type: Only events of this type; may be repeated
+        limit: Page size (default and maximum 1000)
+        timeout: Seconds to wait for an event when there is none yet (long
+            poll, at most 25; default 0)
+
+    With Accept: text/event-stream the events are streamed as Server-Sent
+    Events instead, for up to EVENTS_STREAM_DURATION seconds, and a
+    reconnecting EventSource resumes from its Last-Event-ID. Otherwise returns the events, the offset to pass as
+    after next time and whether more are waiting.
+    """
+    try:
+        after = request.args.get('after', request.headers.get('Last-Event-ID'))
+        after = event_log.latest() if after is None else int(after)
+        limit = min(int(request.args.get('limit', MAX_EVENTS_PAGE_SIZE)), MAX_EVENTS_PAGE_SIZE)
+        timeout = min(float(request.args.get('timeout', 0)), EVENTS_WAIT)
+    except ValueError:
+        return jsonify({'error': 'after, limit and timeout must be numbers'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    types = request.args.getlist('type') or None
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return Response(
+            stream_with_context(_event_stream(after, types)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    events = event_log.read(after, limit, types)
+    if not events and timeout > 0 and event_log.wait(after, timeout):
+        events = event_log.read(after, limit, types)
+    return jsonify({
+        'events': events,
+        'offset': events[-1]['offset'] if events else after,
+        'has_more': len(events) == limit
+    })
+
+# Page size limits for search results
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+def search_tickets():
+    """Run the search described by the query string; returns (query, results)"""
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int), 1), MAX_SEARCH_LIMIT)
+    if not query:
+        return query, []
+    with metrics.SEARCH_SECONDS.time():
+        results = store.search(
+            query,
+            status=request.args.get('status') or None,
+            category=request.args.get('category') or None,
+            priority=request.args.get('priority') or None,
+            limit=limit
+        )
+    return query, results
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """
+    Full-text search over descriptions and resolution notes, best match first
+
+    Query parameters:
+        q: Words that must all occur in the ticket
+        limit: Most results (default 20, at most 100)
+        status, category, priority: Exact-match filters
+    """
+    query, results = search_tickets()
+    return jsonify({'query': query, 'results': results})
+
+@app.route('/search')
+def search():
+    query, results = search_tickets()
+    return render('search.html', query=query, results=results, categories=store.categories())
+
+@app.route('/api/notifications')
+def api_notifications():
+    # Outbox size per delivery status, the backlog by priority and team, and
+    # the emails that gave up retrying
+    return jsonify({
+        'counts': notification_queue.stats(),
+        'backlog': notification_queue.backlog(),
+        'dead_letters': notification_queue.dead_letters(request.args.get('limit', 100, type=int))
+    })
+
+@app.route('/api/notifications/<int:outbox_id>/retry', methods=['POST'])
+def retry_notification(outbox_id):
+    if not notification_queue.requeue(outbox_id):
+        return jsonify({'error': 'No dead-lettered notification with that id'}), 404
+    return jsonify({'requeued': outbox_id})
 
 @app.route('/submit', methods=['GET', 'POST'])
 def submit():
@@ -54,64 +380,139 @@ def submit():
                 flash('Please fill in all required fields', 'error')
                 return redirect(url_for('submit'))
 
-            new_request = {
-                'id': len(requests_db) + 1,
-                'description': description,
-                'priority': priority,
-                'category': classifier.classify_issue(description),
-                'contact_email': contact_email,
-                'status': 'open',
-                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            requests_db.append(new_request)
-            save_requests_db(requests_db)  # Save to file after adding new request
-            
-            # Send email notifications
-            if contact_email:
-                email_sender.send_ticket_confirmation(new_request)
+            fingerprint = deduplicator.fingerprint(description, contact_email)
+            original_id = deduplicator.find(fingerprint)
+            original = store.get(original_id) if original_id else None
+            if original and original['status'] != 'resolved':
+                with metrics.PERSIST_SECONDS.time(operation='update'):
+                    store.update(original['id'], {
+                        'duplicates': original.get('duplicates', 0) + 1,
+                        'last_duplicate_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    })
+                flash(f'This issue is already open as ticket #{original["id"]}', 'success')
+                return redirect(url_for('index'))
+
+            # The version is that of the rules or model that gave this category
+            category, classifier_version = classifier.classify_with_version(description)
+            with metrics.PERSIST_SECONDS.time(operation='create'):
+                new_request = store.create({
+                    'description': description,
+                    'priority': priority,
+                    'category': category,
+                    'classifier_version': classifier_version,
+                    'contact_email': contact_email,
+                    'status': 'open',
+                    'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })  # Appended to the log before returning
+            deduplicator.add(fingerprint, new_request['id'])
             
-            # Notify admin about new ticket
-            email_sender.notify_admin_new_ticket(new_request)
+            # Subscribers are told and the notification emails queued from the event
+            event_log.publish(TICKET_CREATED, new_request)
             
             flash('Issue submitted successfully!', 'success')
             return redirect(url_for('index'))  # Redirect to home page after submission
         except Exception as e:
             flash(f'Error submitting issue: {str(e)}', 'error')
             return redirect(url_for('submit'))
-    return render_template('submit.html')
+    return render('submit.html')
+
+# When this process first saw each store version, for Last-Modified
+_version_seen = {'version': None, 'time': None}
+
+def conditional_response(build):
+    """
+    Answer 304 Not Modified when the client's copy is still current
+
+    The ETag is the store version, which changes on every ticket write, so
+    build() only runs (and the page is only rendered) after something changed.
+    """
+    version = store.version
+    if _version_seen['version'] != version:
+        _version_seen.update(version=version, time=datetime.now(timezone.utc).replace(microsecond=0))
+    etag = str(version)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = request.if_modified_since is not None and _version_seen['time'] <= request.if_modified_since
+    # Pending flash messages are only shown by a fresh render
+    if fresh and '_flashes' not in session:
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag, weak=True)
+    response.last_modified = _version_seen['time']
+    # Browsers revalidate every time instead of showing a stale list
+    response.cache_control.no_cache = True
+    return response
+
+# Page size limits for the ticket list page
+REQUESTS_PAGE_SIZE = 50
+MAX_REQUESTS_PAGE_SIZE = 200
 
 @app.route('/requests')
 def list_requests():
-    return render_template('requests.html', requests=requests_db[::-1])
+    """
+    One page of tickets, newest first
+
+    Query parameters:
+        cursor: Tickets older than this id (the Older link)
+        after: Tickets newer than this id (the Newer link)
+        limit: Page size (default 50, at most 200)
+        status, category, priority: Exact-match filters
+    """
+    def build():
+        filters = {field: request.args.get(field) or None for field in ('status', 'category', 'priority')}
+        limit = min(max(request.args.get('limit', REQUESTS_PAGE_SIZE, type=int), 1), MAX_REQUESTS_PAGE_SIZE)
+        after = request.args.get('after', type=int)
+        # One extra ticket tells whether there is a page beyond this one
+        if after is not None:
+            page = store.find(after_id=after, limit=limit + 1, **filters)
+            has_newer = len(page) > limit
+            page = page[:limit][::-1]
+            has_older = bool(page) and bool(store.find(before_id=page[-1]['id'], limit=1, **filters))
+        else:
+            page = store.find(before_id=request.args.get('cursor', type=int), newest_first=True, limit=limit + 1, **filters)
+            has_older = len(page) > limit
+            page = page[:limit]
+            has_newer = bool(page) and bool(store.find(after_id=page[0]['id'], limit=1, **filters))
+        return render(
+            'requests.html',
+            requests=page,
+            filters=filters,
+            categories=store.categories(),
+            page_size=limit if limit != REQUESTS_PAGE_SIZE else None,
+            has_newer=has_newer,
+            has_older=has_older
+        )
+    return conditional_response(build)
 
 @app.route('/requests/<int:request_id>')
 def view_request(request_id):
-    request_data = next((req for req in requests_db if req['id'] == request_id), None)
+    request_data = store.get(request_id)
     if request_data:
-        return render_template('request.html', request=request_data)
+        return render('request.html', request=request_data)
     return "Request not found", 404
 
 @app.route('/resolve/<int:request_id>', methods=['POST'])
 def resolve_request(request_id):
     try:
-        request_data = next((req for req in requests_db if req['id'] == request_id), None)
+        request_data = store.get(request_id)
         if not request_data:
             flash('Request not found', 'error')
             return redirect(url_for('list_requests'))
         
         resolution_notes = request.form.get('resolution_notes', '')
         
-        # Update request status
-        request_data['status'] = 'resolved'
-        request_data['resolved_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        request_data['resolution_notes'] = resolution_notes
-        
-        # Save the updated request
-        save_requests_db(requests_db)
+        # Update request status and append the change to the log
+        with metrics.PERSIST_SECONDS.time(operation='update'):
+            request_data = store.update(request_id, {
+                'status': 'resolved',
+                'resolved_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'resolution_notes': resolution_notes
+            })
         
-        # Send resolution notification email
-        if request_data.get('contact_email'):
-            email_sender.send_resolution_notification(request_data, resolution_notes)
+        # The resolution email is queued from the event
+        event_log.publish(TICKET_RESOLVED, request_data)
         
         flash('Request resolved successfully', 'success')
         return redirect(url_for('view_request', request_id=request_id))
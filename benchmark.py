@@ -0,0 +1,377 @@
+"""
+Benchmarks for the classify, submit/resolve, recent requests, search and email hot paths.
+
+    python benchmark.py                                  # everything
+    python benchmark.py --suite app --sizes 1000,100000  # store-backed routes only
+    python benchmark.py --output new.json --baseline old.json
+
+Results are printed and, with --output, written as JSON: a flat "metrics" map
+(names ending in _us/_ms/_s/_bytes are lower-is-better, _per_s higher-is-better)
+plus the machine and commit they were measured on. With --baseline the run
+exits non-zero when any metric is worse than the baseline by more than
+--tolerance. The email suite needs aiosmtpd for its local SMTP stand-in.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta
+
+from classifier import DEFAULT_KEYWORDS, IssueClassifier
+
+FILLER_WORDS = (
+    "the request to the upstream service timed out after retrying three times "
+    "traceback most recent call last file line module worker queue handler"
+).split()
+
+
+def legacy_classify(keywords, text):
+    """The original per-keyword substring scan, kept as the baseline"""
+    text = text.lower()
+    matches = {
+        category: sum(1 for keyword in words if keyword in text)
+        for category, words in keywords.items()
+    }
+    if max(matches.values()) == 0:
+        return "General Inquiry"
+    return max(matches.items(), key=lambda x: x[1])[0]
+
+
+def make_description(word_count, seed=0):
+    rng = random.Random(seed)
+    words = [rng.choice(FILLER_WORDS) for _ in range(word_count)]
+    return " ".join(words) + " payment failed on login"
+
+
+def time_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def record(results, name, value):
+    if results is not None:
+        results[name] = round(value, 6)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def make_large_table(keywords, extra_per_category=50, seed=0):
+    """Pad every category with synthetic keywords to model a grown rule table"""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+    return {
+        category: words + [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(5, 10)))
+            for _ in range(extra_per_category)
+        ]
+        for category, words in keywords.items()
+    }
+
+
+def benchmark_classifier(results=None):
+    # Uncached, so every call measures the matcher
+    classifier = IssueClassifier(cache_size=0)
+    tables = {
+        "default": classifier.keywords,
+        "large": make_large_table(classifier.keywords),
+    }
+    print(f"{'table':>8} {'description':>12} {'legacy (us)':>12} {'compiled (us)':>14} {'speedup':>8}")
+    for table_name, keywords in tables.items():
+        classifier.set_rules(keywords)
+        for word_count in (5, 50, 1000, 50000):
+            text = make_description(word_count)
+            assert classifier.classify_issue(text) == legacy_classify(keywords, text)
+            number = max(1, 20000 // word_count)
+            legacy = time_call(lambda: legacy_classify(keywords, text), number)
+            compiled = time_call(lambda: classifier.classify_issue(text), number)
+            label = f"{word_count} words"
+            print(f"{table_name:>8} {label:>12} {legacy * 1e6:>12.1f} {compiled * 1e6:>14.1f} {legacy / compiled:>7.2f}x")
+            record(results, f"classify.{table_name}.{word_count}_words.legacy_us", legacy * 1e6)
+            record(results, f"classify.{table_name}.{word_count}_words.compiled_us", compiled * 1e6)
+
+
+def benchmark_batch(ticket_count=20000, results=None):
+    classifier = IssueClassifier(cache_size=0)
+    texts = [make_description(word_count % 40, seed=word_count) for word_count in range(ticket_count)]
+    assert classifier.classify_batch(texts) == [classifier.classify_issue(text) for text in texts]
+    per_ticket = time_call(lambda: [classifier.classify_issue(text) for text in texts], 1)
+    batch = time_call(lambda: classifier.classify_batch(texts), 1)
+    print(f"{ticket_count} tickets: per-ticket {per_ticket * 1e3:.1f} ms, "
+          f"batch {batch * 1e3:.1f} ms ({per_ticket / batch:.2f}x)")
+    record(results, "classify.batch.per_ticket_ms", per_ticket * 1e3)
+    record(results, "classify.batch.batch_ms", batch * 1e3)
+
+
+def benchmark_cache(ticket_count=20000, distinct=200, results=None):
+    """Repeated short descriptions, as they arrive in practice"""
+    texts = [make_description(index % distinct % 40, seed=index % distinct) for index in range(ticket_count)]
+    uncached = IssueClassifier(cache_size=0)
+    cached = IssueClassifier()
+    assert [cached.classify_issue(text) for text in texts] == [uncached.classify_issue(text) for text in texts]
+    without = time_call(lambda: [uncached.classify_issue(text) for text in texts], 1)
+    with_cache = time_call(lambda: [cached.classify_issue(text) for text in texts], 1)
+    print(f"{ticket_count} tickets, {distinct} distinct: uncached {without * 1e3:.1f} ms, "
+          f"cached {with_cache * 1e3:.1f} ms ({without / with_cache:.2f}x), {cached.cache.stats()}")
+    record(results, "classify.cache.uncached_ms", without * 1e3)
+    record(results, "classify.cache.cached_ms", with_cache * 1e3)
+
+
+def make_tickets(count, seed=0):
+    """Synthetic ticket history, mostly resolved, one ticket per minute"""
+    rng = random.Random(seed)
+    categories = list(DEFAULT_KEYWORDS)
+    start = datetime(2024, 1, 1)
+    tickets = []
+    for ticket_id in range(1, count + 1):
+        opened = start + timedelta(minutes=ticket_id)
+        ticket = {
+            'id': ticket_id,
+            'description': " ".join(rng.choice(FILLER_WORDS) for _ in range(rng.randint(5, 40))),
+            'priority': rng.choice(('low', 'medium', 'high')),
+            'category': rng.choice(categories),
+            'contact_email': '',
+            'status': 'open',
+            'date': opened.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if rng.random() < 0.8:
+            ticket['status'] = 'resolved'
+            ticket['resolved_date'] = (opened + timedelta(hours=rng.randint(1, 72))).strftime('%Y-%m-%d %H:%M:%S')
+            ticket['resolution_notes'] = ''
+        tickets.append(ticket)
+    return tickets
+
+
+def load_app(workdir, backend):
+    """Import a fresh Flask app whose store, outbox and event log live in workdir"""
+    os.environ.update({
+        'TICKET_STORE': backend,
+        'REQUESTS_LOG_FILE': os.path.join(workdir, 'requests_db.log.jsonl'),
+        'TICKET_DB_FILE': os.path.join(workdir, 'tickets.db'),
+        'OUTBOX_FILE': os.path.join(workdir, 'outbox.db'),
+        'EVENTS_FILE': os.path.join(workdir, 'events.db'),
+        'ANALYTICS_EXPORT_INTERVAL': '0',
+        # Measure the request path only; queued emails are never sent
+        'NOTIFICATION_WORKERS': '0',
+    })
+    os.chdir(workdir)  # The snapshot path is relative
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    # The store is otherwise loaded on first use; load time includes it
+    module.store.build()
+    return module
+
+
+def unload_app(module):
+    module.event_log.stop()
+    module.notification_queue.stop()
+    module.store.close()
+    sys.modules.pop('app', None)
+
+
+def benchmark_app(sizes=(1000, 100000, 1000000), backend='jsonl', operations=200, results=None):
+    """Submit, resolve, /api/recent-requests and /api/search against stores of each size"""
+    cwd = os.getcwd()
+    print(f"{'tickets':>9} {'load (s)':>9} {'submit p50/p95 (ms)':>20} {'resolve p50/p95 (ms)':>21} "
+          f"{'recent 100 (ms, KB)':>20} {'recent 1000 (ms, KB)':>21}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            with open(os.path.join(workdir, 'requests_db.json'), 'w', encoding='utf-8') as f:
+                json.dump(make_tickets(size), f)
+            started = time.perf_counter()
+            module = load_app(workdir, backend)
+            load = time.perf_counter() - started
+            client = module.app.test_client()
+            prefix = f"app.{backend}.{size}"
+            try:
+                submit = []
+                for index in range(operations):
+                    started = time.perf_counter()
+                    response = client.post('/submit', data={
+                        'description': f"benchmark ticket {index}: the invoice payment failed",
+                        'priority': 'medium',
+                        'contact_email': ''
+                    })
+                    submit.append(time.perf_counter() - started)
+                    assert response.status_code == 302
+                resolve = []
+                for ticket in module.store.recent(operations):
+                    started = time.perf_counter()
+                    response = client.post(f"/resolve/{ticket['id']}", data={'resolution_notes': 'done'})
+                    resolve.append(time.perf_counter() - started)
+                    assert response.status_code == 302
+                recent = {}
+                for limit in (100, 1000):
+                    latencies = []
+                    for _ in range(20):
+                        started = time.perf_counter()
+                        response = client.get(f'/api/recent-requests?limit={limit}')
+                        latencies.append(time.perf_counter() - started)
+                    recent[limit] = (percentile(latencies, 50), len(response.data))
+                module.store.build_search_index()
+                search = []
+                for word in FILLER_WORDS[:20]:
+                    started = time.perf_counter()
+                    response = client.get(f'/api/search?q={word}&status=open')
+                    search.append(time.perf_counter() - started)
+                    assert response.status_code == 200
+            finally:
+                unload_app(module)
+                os.chdir(cwd)
+
+        print(f"{size:>9} {load:>9.2f} "
+              f"{percentile(submit, 50) * 1e3:>10.2f}/{percentile(submit, 95) * 1e3:<9.2f} "
+              f"{percentile(resolve, 50) * 1e3:>10.2f}/{percentile(resolve, 95) * 1e3:<10.2f} "
+              f"{recent[100][0] * 1e3:>10.2f}, {recent[100][1] / 1024:<8.1f} "
+              f"{recent[1000][0] * 1e3:>10.2f}, {recent[1000][1] / 1024:<8.1f}")
+        print(f"{'':>9} search p50/p95 {percentile(search, 50) * 1e3:.2f}/{percentile(search, 95) * 1e3:.2f} ms")
+        record(results, f"{prefix}.load_s", load)
+        record(results, f"{prefix}.submit_p50_ms", percentile(submit, 50) * 1e3)
+        record(results, f"{prefix}.submit_p95_ms", percentile(submit, 95) * 1e3)
+        record(results, f"{prefix}.submit_per_s", len(submit) / sum(submit))
+        record(results, f"{prefix}.resolve_p50_ms", percentile(resolve, 50) * 1e3)
+        record(results, f"{prefix}.resolve_p95_ms", percentile(resolve, 95) * 1e3)
+        record(results, f"{prefix}.resolve_per_s", len(resolve) / sum(resolve))
+        for limit, (latency, size_bytes) in recent.items():
+            record(results, f"{prefix}.recent_{limit}_p50_ms", latency * 1e3)
+            record(results, f"{prefix}.recent_{limit}_bytes", size_bytes)
+        record(results, f"{prefix}.search_p50_ms", percentile(search, 50) * 1e3)
+        record(results, f"{prefix}.search_p95_ms", percentile(search, 95) * 1e3)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def benchmark_email(count=200, results=None):
+    """EmailSender against a local SMTP server that accepts everything"""
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+    except ImportError:
+        print("email: skipped, aiosmtpd is not installed")
+        return
+
+    class Handler:
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            Handler.received += 1
+            return '250 OK'
+
+    port = free_port()
+    controller = Controller(
+        Handler(), hostname='127.0.0.1', port=port,
+        auth_require_tls=False, authenticator=lambda *args: AuthResult(success=True)
+    )
+    controller.start()
+    os.environ.update({
+        'EMAIL_HOST': '127.0.0.1',
+        'EMAIL_PORT': str(port),
+        'EMAIL_USERNAME': 'benchmark',
+        'EMAIL_PASSWORD': 'benchmark',
+        'EMAIL_USE_TLS': 'false',
+    })
+    from mailer import EmailSender
+    sender = EmailSender()
+    try:
+        started = time.perf_counter()
+        for index in range(count):
+            assert sender.send_email('user@example.com', f'Ticket #{index}', 'Benchmark message')
+        single = (time.perf_counter() - started) / count
+        emails = [('user@example.com', f'Ticket #{index}', 'Benchmark message', False) for index in range(count)]
+        started = time.perf_counter()
+        assert all(sender.send_batch(emails))
+        batch = (time.perf_counter() - started) / count
+    finally:
+        sender.pool.close()
+        controller.stop()
+    print(f"email: send_email {single * 1e3:.2f} ms/email ({1 / single:.0f}/s), "
+          f"send_batch {batch * 1e3:.2f} ms/email ({1 / batch:.0f}/s), {Handler.received} received")
+    record(results, "email.send_email_ms", single * 1e3)
+    record(results, "email.send_email_per_s", 1 / single)
+    record(results, "email.send_batch_ms", batch * 1e3)
+    record(results, "email.send_batch_per_s", 1 / batch)
+
+
+def compare(metrics, baseline, tolerance):
+    """Return the metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, value in metrics.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if name.endswith('_per_s'):
+            worse = value < previous * (1 - tolerance)
+        elif name.endswith(('_us', '_ms', '_s', '_bytes')):
+            worse = value > previous * (1 + tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append((name, previous, value))
+    return regressions
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+SUITES = ('classifier', 'app', 'email')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the performance benchmarks')
+    parser.add_argument('--suite', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--sizes', default='1000,100000,1000000', help='Store sizes for the app suite')
+    parser.add_argument('--backend', choices=('jsonl', 'sqlite'), default='jsonl')
+    parser.add_argument('--operations', type=int, default=200, help='Submits and resolves per store size')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before failing')
+    args = parser.parse_args()
+
+    metrics = {}
+    if 'classifier' in args.suite:
+        benchmark_classifier(results=metrics)
+        benchmark_batch(results=metrics)
+        benchmark_cache(results=metrics)
+    if 'app' in args.suite:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        benchmark_app(sizes, args.backend, args.operations, results=metrics)
+    if 'email' in args.suite:
+        benchmark_email(results=metrics)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'metrics': metrics}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(metrics, json.load(f)['metrics'], args.tolerance)
+        for name, previous, value in regressions:
+            print(f"REGRESSION {name}: {previous} -> {value}")
+        if regressions:
+            sys.exit(1)
\ No newline at end of file
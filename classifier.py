@@ -1,30 +1,509 @@
 from config import settings
+from collections import OrderedDict
+import hashlib
+import itertools
+import json
+import logging
+import os
 import re
+import threading
+import numpy as np
+
+import metrics
+
+try:
+    import ahocorasick  # optional C extension (pyahocorasick)
+except ImportError:
+    ahocorasick = None
+
+# Not a word character, so whole-word matching treats it like the end of a text
+_BATCH_SEPARATOR = '\x00'
+
+
+def _trie_pattern(words):
+    """
+    Build a regex alternation for the given words that shares common prefixes,
+    e.g. ["price", "problem", "profile"] -> "pr(?:ice|o(?:blem|file))"
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional group so the longest keyword at a position wins
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Keyword table compiled once into a single-pass matcher.
+
+    One scan of the text finds every keyword and scores all categories at once,
+    instead of one substring scan per keyword. Uses an Aho-Corasick automaton
+    when pyahocorasick is installed, otherwise a prefix-trie regex.
+    """
+
+    def __init__(self, keywords, word_boundary=False):
+        """
+        Args:
+            keywords (dict): Category name -> list of keywords
+            word_boundary (bool): Only count keywords that appear as whole words
+        """
+        self.categories = list(keywords)
+        self.word_boundary = word_boundary
+
+        # Empty keywords always match, so they only shift the base score
+        self._base_scores = [0] * len(self.categories)
+        # Keyword -> indices of the categories listing it (with repeats)
+        self._targets = {}
+        for index, words in enumerate(keywords.values()):
+            for word in words:
+                if word:
+                    self._targets.setdefault(word, []).append(index)
+                else:
+                    self._base_scores[index] += 1
+
+        # Keyword x category count matrix used to score whole batches at once
+        self._words = list(self._targets)
+        self._keyword_index = {word: column for column, word in enumerate(self._words)}
+        self._weights = np.zeros((len(self._targets), len(self.categories)), dtype=np.int32)
+        for word, indices in self._targets.items():
+            for index in indices:
+                self._weights[self._keyword_index[word], index] += 1
+
+        # score_batch scans all texts joined by this character at once
+        self._batch_separator_safe = not any(_BATCH_SEPARATOR in word for word in self._targets)
+
+        self._automaton = None
+        self._pattern = None
+        if not self._targets:
+            return
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            # Matches report the keyword's column in the weight matrix
+            for word, column in self._keyword_index.items():
+                self._automaton.add_word(word, column)
+            self._automaton.make_automaton()
+        else:
+            # The regex reports only the longest keyword starting at each
+            # position, so also credit the keywords found inside it
+            self._implied = {
+                word: [other for other in self._targets if self._contains(word, other)]
+                for word in self._targets
+            }
+            boundary_before, boundary_after = (r'(?<!\w)', r'(?!\w)') if word_boundary else ('', '')
+            # Zero-width lookahead so overlapping keywords are all reported
+            self._pattern = re.compile(
+                '(?=' + boundary_before + '(' + _trie_pattern(self._targets) + ')' + boundary_after + ')'
+            )
+
+    def _contains(self, text, word):
+        """Whether word occurs in text under this matcher's matching rules"""
+        if not self.word_boundary:
+            return word in text
+        start = text.find(word)
+        while start != -1:
+            end = start + len(word)
+            if self._is_whole_word(text, start, end):
+                return True
+            start = text.find(word, start + 1)
+        return False
+
+    @staticmethod
+    def _is_whole_word(text, start, end):
+        before = text[start - 1] if start > 0 else ''
+        after = text[end] if end < len(text) else ''
+        return not (before.isalnum() or before == '_') and not (after.isalnum() or after == '_')
+
+    def find(self, text):
+        """Return the set of keywords present in text"""
+        if self._automaton is not None:
+            words = self._words
+            if not self.word_boundary:
+                return {words[column] for _, column in self._automaton.iter(text)}
+            return {
+                words[column] for end, column in self._automaton.iter(text)
+                if self._is_whole_word(text, end - len(words[column]) + 1, end + 1)
+            }
+        if self._pattern is None:
+            return set()
+        found = set()
+        for longest in set(self._pattern.findall(text)):
+            found.update(self._implied[longest])
+        return found
+
+    def score(self, text):
+        """Return the number of matching keywords per category, in table order"""
+        scores = list(self._base_scores)
+        for word in self.find(text):
+            for index in self._targets[word]:
+                scores[index] += 1
+        return scores
+
+    def score_batch(self, texts):
+        """
+        Score many texts at once
+
+        Args:
+            texts (list): Texts to score
+
+        Returns:
+            numpy.ndarray: documents x categories matrix of keyword counts
+        """
+        presence = np.zeros((len(texts), len(self._keyword_index)), dtype=np.int32)
+        if texts and self._automaton is not None and self._batch_separator_safe:
+            # One scan over all texts joined by a character no keyword
+            # contains, so no match spans two texts. Hits come out as flat
+            # (end, column) pairs, straight into an array
+            joined = _BATCH_SEPARATOR.join(texts)
+            hits = np.fromiter(
+                itertools.chain.from_iterable(self._automaton.iter(joined)), dtype=np.int64
+            ).reshape(-1, 2)
+            if self.word_boundary and len(hits):
+                whole = [
+                    self._is_whole_word(joined, end - len(self._words[column]) + 1, end + 1)
+                    for end, column in hits.tolist()
+                ]
+                hits = hits[np.array(whole, dtype=bool)]
+            # Each hit belongs to the text whose span contains its end
+            lengths = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            presence[np.searchsorted(offsets, hits[:, 0], side='right') - 1, hits[:, 1]] = 1
+        else:
+            for row, text in enumerate(texts):
+                columns = [self._keyword_index[word] for word in self.find(text)]
+                presence[row, columns] = 1
+        return presence @ self._weights + np.array(self._base_scores, dtype=np.int32)
+
+
+class ClassificationCache:
+    """
+    Bounded LRU of recent classifications.
+
+    Entries are keyed by a hash of the lowercased, stripped text, which every
+    classifier treats the same as the original, so a repeated description
+    skips classification entirely. Results are only valid for the classifier
+    version they were computed with; the cache empties itself as soon as it
+    is asked about a different version.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.strip().lower().encode(), digest_size=16).digest()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, version, key):
+        """Return the cached category, or None"""
+        with self._lock:
+            self._check_version(version)
+            category = self._entries.get(key)
+            if category is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return category
+
+    def put(self, version, key, category):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = category
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def classify_cached(cache, version, texts, classify, store=True, versioned=False):
+    """
+    Classify texts through a cache, running classify once per distinct miss
+
+    Args:
+        cache (ClassificationCache): Cache to consult, or None
+        version (str): Version of the classifier classify runs
+        texts (list): Texts to classify
+        classify (callable): List of texts -> list of categories
+        store (bool): Cache the new results; False when classify does it itself
+        versioned (bool): classify returns (category, version) pairs, and
+            cache hits are returned as pairs with version too
+
+    Returns:
+        list: Category, or (category, version) pair, per text
+    """
+    if cache is None:
+        return classify(texts)
+    results = []
+    missing = {}
+    for index, text in enumerate(texts):
+        key = cache.key(text)
+        category = cache.get(version, key) if key not in missing else None
+        results.append((category, version) if versioned and category is not None else category)
+        if category is None:
+            missing.setdefault(key, []).append(index)
+    misses = sum(len(indexes) for indexes in missing.values())
+    metrics.CLASSIFY_CACHE.inc(len(texts) - misses, result='hit')
+    metrics.CLASSIFY_CACHE.inc(misses, result='miss')
+    if missing:
+        keys = list(missing)
+        for key, result in zip(keys, classify([texts[missing[key][0]] for key in keys])):
+            for index in missing[key]:
+                results[index] = result
+            if store:
+                cache.put(version, key, result[0] if versioned else result)
+    return results
+
+
+DEFAULT_KEYWORDS = {
+    "Technical Support": ["error", "bug", "not working", "broken", "failed", "issue", "problem"],
+    "Billing": ["payment", "invoice", "charge", "bill", "subscription", "price", "cost", "refund"],
+    "Account Management": ["login", "password", "account", "profile", "settings", "access"],
+    "General Inquiry": []  # Default category
+}
+
+
+class Rules:
+    """
+    One version of the routing rules, compiled and ready to match.
+
+    Never modified after construction, so a classifier can switch to new
+    rules with a single attribute assignment while requests are running.
+    """
+
+    def __init__(self, keywords, default_category="General Inquiry", version=0, word_boundary=False):
+        """
+        Args:
+            keywords (dict): Category name -> list of keywords, in tie-break order
+            default_category (str): Category when nothing matches
+            version (int): Version number from the rules file
+            word_boundary (bool): Only count keywords that appear as whole words
+        """
+        if default_category not in keywords:
+            raise ValueError(f"Default category {default_category!r} is not one of the categories")
+        self.keywords = keywords
+        self.default_category = default_category
+        self.matcher = KeywordMatcher(keywords, word_boundary=word_boundary)
+        # The file version alone is not trusted to change with every edit
+        digest = hashlib.sha1(json.dumps(
+            [list(keywords.items()), default_category, word_boundary]
+        ).encode()).hexdigest()[:12]
+        self.version = f"rules-{version}:{digest}"
+
+    @property
+    def categories(self):
+        return self.matcher.categories
+
+
+def load_rules(path, word_boundary=False):
+    """
+    Read and compile a rules file
+
+    The file is JSON: {"version": 3, "default_category": "General Inquiry",
+    "categories": {"Billing": ["invoice", ...], ...}}. Category order is the
+    tie-break order.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    categories = data['categories']
+    if not isinstance(categories, dict) or not all(
+        isinstance(words, list) and all(isinstance(word, str) for word in words)
+        for words in categories.values()
+    ):
+        raise ValueError("'categories' must map each category to a list of keywords")
+    return Rules(
+        {category: [word.lower() for word in words] for category, words in categories.items()},
+        data.get('default_category', "General Inquiry"),
+        data.get('version', 0),
+        word_boundary
+    )
+
 
 class IssueClassifier:
-    def __init__(self):
-        self.keywords = {
-            "Technical Support": ["error", "bug", "not working", "broken", "failed", "issue", "problem"],
-            "Billing": ["payment", "invoice", "charge", "bill", "subscription", "price", "cost", "refund"],
-            "Account Management": ["login", "password", "account", "profile", "settings", "access"],
-            "General Inquiry": []  # Default category
-        }
-        
+    def __init__(self, word_boundary=False, cache_size=10000, rules_path=None):
+        """
+        Args:
+            word_boundary (bool): Only count keywords that appear as whole words
+            cache_size (int): Most cached classifications; 0 disables the cache
+            rules_path (str): Rules file to load and watch; None uses DEFAULT_KEYWORDS
+        """
+        self.word_boundary = word_boundary
+        self.rules_path = rules_path
+        self.rules = load_rules(rules_path, word_boundary) if rules_path else Rules(
+            DEFAULT_KEYWORDS, word_boundary=word_boundary
+        )
+        # Repeated descriptions are answered from here; 0 disables it
+        self.cache = ClassificationCache(cache_size) if cache_size else None
+        self._watcher = None
+        self._stop_watching = threading.Event()
+
+    @property
+    def keywords(self):
+        return self.rules.keywords
+
+    @property
+    def matcher(self):
+        return self.rules.matcher
+
+    @property
+    def version(self):
+        """Identifies the rules the results come from"""
+        return self.rules.version
+
+    @property
+    def service_groups(self):
+        """Every category a ticket can be routed to"""
+        return self.rules.categories
+
+    def set_rules(self, keywords, default_category="General Inquiry", version=0):
+        """Compile and switch to a new keyword table"""
+        self.rules = Rules(keywords, default_category, version, self.word_boundary)
+
+    def reload_rules(self):
+        """
+        Load the rules file again and switch to it
+
+        Compiling happens before the switch, so requests keep using the old
+        rules until the new ones are ready; a broken file keeps the old rules.
+        """
+        try:
+            rules = load_rules(self.rules_path, self.word_boundary)
+        except Exception as e:
+            logging.error(f"Keeping rules {self.rules.version}, could not load {self.rules_path}: {e}")
+            metrics.RULES_RELOADS.inc(result='failed')
+            return False
+        metrics.RULES_RELOADS.inc(result='loaded')
+        if rules.version != self.rules.version:
+            self.rules = rules
+            logging.info(f"Classification rules {rules.version} loaded")
+        return True
+
+    def _file_state(self):
+        try:
+            stat = os.stat(self.rules_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _watch(self, interval):
+        state = self._file_state()
+        while not self._stop_watching.wait(interval):
+            current = self._file_state()
+            if current is not None and current != state:
+                state = current
+                self.reload_rules()
+
+    def watch_rules(self, interval=2.0):
+        """Reload the rules file on a background thread whenever it changes"""
+        if self.rules_path is None or self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name='rules-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        self._watcher = None
+
     def classify_issue(self, text: str) -> str:
         """
         Classify the customer issue into one of the service groups using keyword matching
         """
+        return self.classify_with_version(text)[0]
+
+    def classify_with_version(self, text: str) -> tuple:
+        """
+        Classify the customer issue and return (category, version)
+
+        The version is that of the rules the category came from, which
+        reading self.version separately cannot promise while rules reload.
+        """
+        # One rules object for the whole call, even if they are swapped meanwhile
+        rules = self.rules
+        if self.cache is None:
+            return self._classify(text, rules), rules.version
+        key = ClassificationCache.key(text)
+        category = self.cache.get(rules.version, key)
+        if category is None:
+            metrics.CLASSIFY_CACHE.inc(result='miss')
+            category = self._classify(text, rules)
+            self.cache.put(rules.version, key, category)
+        else:
+            metrics.CLASSIFY_CACHE.inc(result='hit')
+        return category, rules.version
+
+    @staticmethod
+    def _classify(text, rules):
         text = text.lower()
-        
-        # Count matches for each category
-        matches = {
-            category: sum(1 for keyword in keywords if keyword in text)
-            for category, keywords in self.keywords.items()
-        }
-        
-        # Return the category with most matches, or General Inquiry if no matches
+
+        # Count matches for each category in a single pass over the text
+        matches = dict(zip(rules.categories, rules.matcher.score(text)))
+
+        # Return the category with most matches, or the default if no matches
         max_matches = max(matches.values())
         if max_matches == 0:
-            return "General Inquiry"
-            
-        return max(matches.items(), key=lambda x: x[1])[0] 
\ No newline at end of file
+            return rules.default_category
+
+        return max(matches.items(), key=lambda x: x[1])[0]
+
+    def classify_batch(self, texts: list) -> list:
+        """
+        Classify many customer issues in one call, e.g. to re-triage a backlog
+
+        Returns the same categories as calling classify_issue on each text
+        """
+        return [category for category, _ in self.classify_batch_with_version(texts)]
+
+    def classify_batch_with_version(self, texts: list) -> list:
+        """Classify many customer issues; returns a (category, version) pair per text"""
+        if not texts:
+            return []
+        rules = self.rules
+        categories = classify_cached(self.cache, rules.version, texts, lambda batch: self._classify_batch(batch, rules))
+        return [(category, rules.version) for category in categories]
+
+    @staticmethod
+    def _classify_batch(texts, rules):
+        scores = rules.matcher.score_batch([text.lower() for text in texts])
+
+        # argmax picks the first category on ties, like max() over the dict
+        best = scores.argmax(axis=1)
+        no_match = scores.max(axis=1) == 0
+        return [
+            rules.default_category if unmatched else rules.categories[index]
+            for index, unmatched in zip(best.tolist(), no_match.tolist())
+        ]
\ No newline at end of file
@@ -1,28 +1,76 @@
 from pydantic_settings import BaseSettings
 from typing import List
+from functools import lru_cache
+import json
+import logging
+
+
+@lru_cache(maxsize=None)
+def _rules_categories(path):
+    """Categories of a rules file, read once; the built-in table if it cannot be read"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return tuple(json.load(f)['categories'])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Could not read service groups from {path}, using the built-in categories: {e}")
+        # Imported here: classifier imports this module
+        from classifier import DEFAULT_KEYWORDS
+        return tuple(DEFAULT_KEYWORDS)
 
 class Settings(BaseSettings):
     # Email settings
     EMAIL_SERVER: str = "imap.gmail.com"
     EMAIL_USERNAME: str = ""
     EMAIL_PASSWORD: str = ""
+    EMAIL_FOLDER: str = "INBOX"
+    EMAIL_FETCH_BATCH: int = 100  # Messages fetched per round trip
+    EMAIL_IDLE_TIMEOUT: int = 300  # Seconds before IDLE is re-issued
+    EMAIL_POLL_INTERVAL: int = 60  # Used when the server has no IDLE
+    EMAIL_PIPELINE_QUEUE_SIZE: int = 100  # Emails waiting per processing stage
+    EMAIL_PARSE_WORKERS: int = 2
+    EMAIL_CLASSIFY_WORKERS: int = 1
+    EMAIL_CLASSIFY_BATCH: int = 32
+    EMAIL_PERSIST_WORKERS: int = 1
+    EMAIL_PERSIST_TIMEOUT: float = 30.0  # Seconds to wait for a request to be stored before refetching the email
+
+    # Duplicate ticket detection
+    DEDUP_ENABLED: bool = True
+    DEDUP_TTL: int = 3600  # Seconds a ticket keeps absorbing repeats after the last one
+    DEDUP_MAX_ENTRIES: int = 10000
+    DEDUP_NEAR_DUPLICATES: bool = True  # Also merge texts with close SimHashes
     
+    # In-memory request store of the API service
+    SERVICE_MAX_REQUESTS: int = 200000  # Requests kept in memory; older ones move to the archive
+    SERVICE_ARCHIVE_FILE: str = "service_requests.db"  # Empty to drop evicted requests instead
+
     # Flask settings
     FLASK_SECRET_KEY: str = "your-secret-key-here"
     
     # WhatsApp settings (using Telegram Bot API as an example)
     TELEGRAM_BOT_TOKEN: str = ""
     
-    # Service groups
-    SERVICE_GROUPS: List[str] = [
-        "Technical Support",
-        "Billing",
-        "Account Management",
-        "General Inquiry"
-    ]
+    # Routing rules: versioned categories and keywords, reloaded when the file changes
+    RULES_FILE: str = "rules.json"
+    RULES_RELOAD_INTERVAL: float = 2.0  # Seconds between checks of the rules file
+
+    @property
+    def SERVICE_GROUPS(self) -> List[str]:
+        """
+        Service groups are the categories of the rules file as it was at startup
+
+        Code that must follow rules reloads should use the classifier's
+        service_groups instead.
+        """
+        return list(_rules_categories(self.RULES_FILE))
     
     # Model settings
+    # "keywords", "tfidf" (MODEL_DIR/tfidf.npz) or a transformer model directory under MODEL_DIR
+    # A model whose files (or, for transformers, torch) are missing falls back to "keywords"
     CLASSIFICATION_MODEL: str = "distilbert-base-uncased"
+    MODEL_DIR: str = "models"
+    CLASSIFICATION_BATCH_SIZE: int = 32  # Concurrent requests classified together
+    CLASSIFICATION_BATCH_WAIT_MS: float = 2
+    CLASSIFICATION_CACHE_SIZE: int = 10000  # Recent classifications kept for repeated texts; 0 disables
     
     model_config = {
         "env_file": ".env",
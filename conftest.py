@@ -0,0 +1,287 @@
+import re
+import socket
+import socketserver
+import threading
+from email.message import EmailMessage
+
+import pytest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalSMTPServer:
+    """
+    aiosmtpd server on localhost that records what it receives
+
+    Recipients in `reject` are refused with a 550, and restart() drops every
+    open session the way a server restart or idle timeout would.
+    """
+
+    def __init__(self):
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+
+        self.port = free_port()
+        self.messages = []
+        self.sessions = set()
+        self.reject = set()
+
+        server = self
+
+        class Handler:
+            async def handle_RCPT(self, smtp, session, envelope, address, rcpt_options):
+                if address in server.reject:
+                    return '550 No such user'
+                envelope.rcpt_tos.append(address)
+                return '250 OK'
+
+            async def handle_DATA(self, smtp, session, envelope):
+                # Each connection has its own client port
+                server.sessions.add(session.peer)
+                server.messages.append(envelope)
+                return '250 OK'
+
+        self._make_controller = lambda: Controller(
+            Handler(), hostname='127.0.0.1', port=self.port,
+            auth_require_tls=False, authenticator=lambda *args: AuthResult(success=True)
+        )
+        self.controller = None
+
+    @property
+    def recipients(self):
+        return [address for envelope in self.messages for address in envelope.rcpt_tos]
+
+    def start(self):
+        # A stopped controller cannot be started again
+        self.controller = self._make_controller()
+        self.controller.start()
+
+    def stop(self):
+        if self.controller is not None:
+            self.controller.stop()
+            self.controller = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+@pytest.fixture
+def smtp_server():
+    pytest.importorskip('aiosmtpd')
+    server = LocalSMTPServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+class LocalIMAPServer:
+    """
+    Single-folder IMAP4rev1 server on localhost with just the commands the
+    ingestor uses
+
+    Messages are kept in memory with their UID and flags, and every SEARCH,
+    message body FETCH, STORE, IDLE and login is logged. Delivering a message while a
+    client is idling pushes an EXISTS response, as real servers do. Set idle
+    to False to leave IDLE out of the capabilities, and call disconnect() to
+    drop every open connection.
+    """
+
+    def __init__(self, idle=True):
+        self.idle = idle
+        self.messages = []
+        self.next_uid = 1
+        self.logins = 0
+        self.commands = []
+        # UIDs of each FETCH and each STORE, in order
+        self.fetches = []
+        self.stores = []
+        self.on_store = None
+        self._lock = threading.Lock()
+        self._connections = set()
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.write_lock = threading.Lock()
+                self.idling = False
+                with server._lock:
+                    server._connections.add(self)
+
+            def finish(self):
+                with server._lock:
+                    server._connections.discard(self)
+                try:
+                    super().finish()
+                except OSError:
+                    pass
+
+            def send(self, *lines):
+                with self.write_lock:
+                    for line in lines:
+                        self.wfile.write(line if isinstance(line, bytes) else line.encode() + b'\r\n')
+                    self.wfile.flush()
+
+            def handle(self):
+                self.send('* OK IMAP4rev1 test server ready')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    tag, _, rest = line.decode().rstrip('\r\n').partition(' ')
+                    command, _, arguments = rest.partition(' ')
+                    command = command.upper()
+                    if command == 'UID':
+                        command, _, arguments = arguments.partition(' ')
+                        command = 'UID ' + command.upper()
+                    server.commands.append(command)
+                    if server._respond(self, tag, command, arguments) is False:
+                        return
+
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.disconnect()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def disconnect(self):
+        """Drop every client connection, like a server restart"""
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def deliver(self, subject='Printer is broken', body='The printer on floor 2 is jammed', seen=False):
+        """Add a message to the folder; returns its UID"""
+        message = EmailMessage()
+        message['From'] = 'user@example.com'
+        message['To'] = 'support@example.com'
+        message['Subject'] = subject
+        message.set_content(body)
+        with self._lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages.append({'uid': uid, 'flags': {'\\Seen'} if seen else set(), 'raw': message.as_bytes()})
+            exists = len(self.messages)
+            idling = [connection for connection in self._connections if connection.idling]
+        for connection in idling:
+            try:
+                connection.send(f'* {exists} EXISTS')
+            except OSError:
+                # Dropped by disconnect() while idling
+                pass
+        return uid
+
+    def seen(self, uid):
+        with self._lock:
+            return any(message['uid'] == uid and '\\Seen' in message['flags'] for message in self.messages)
+
+    def _search(self, arguments):
+        unseen = 'UNSEEN' in arguments.upper()
+        uid_range = re.search(r'UID (\d+):(\d+|\*)', arguments, re.IGNORECASE)
+        with self._lock:
+            numbers = []
+            highest = self.messages[-1]['uid'] if self.messages else 0
+            for number, message in enumerate(self.messages, 1):
+                if unseen and '\\Seen' in message['flags']:
+                    continue
+                if uid_range:
+                    # '*' is the highest UID, so n:* always includes the
+                    # newest message even when it is below n
+                    low = int(uid_range.group(1))
+                    high = highest if uid_range.group(2) == '*' else int(uid_range.group(2))
+                    if not min(low, high) <= message['uid'] <= max(low, high):
+                        continue
+                numbers.append(str(number))
+        return numbers
+
+    def _respond(self, connection, tag, command, arguments):
+        ok = f'{tag} OK {command} completed'
+        if command == 'CAPABILITY':
+            connection.send('* CAPABILITY IMAP4rev1' + (' IDLE' if self.idle else ''), ok)
+        elif command == 'LOGIN':
+            with self._lock:
+                self.logins += 1
+            connection.send(ok)
+        elif command in ('SELECT', 'EXAMINE'):
+            with self._lock:
+                exists, next_uid = len(self.messages), self.next_uid
+            connection.send(
+                f'* {exists} EXISTS', '* 0 RECENT', '* FLAGS (\\Seen)',
+                '* OK [UIDVALIDITY 1] UIDs valid', f'* OK [UIDNEXT {next_uid}] Predicted next UID',
+                f'{tag} OK [READ-WRITE] SELECT completed'
+            )
+        elif command == 'SEARCH':
+            connection.send(' '.join(['* SEARCH', *self._search(arguments)]), ok)
+        elif command == 'FETCH':
+            numbers = [int(number) for number in arguments.split(' ', 1)[0].split(',')]
+            peek = 'BODY.PEEK[]' in arguments.upper()
+            lines = []
+            with self._lock:
+                messages = [self.messages[number - 1] for number in numbers]
+                if 'BODY' in arguments.upper():
+                    self.fetches.append([message['uid'] for message in messages])
+                for number, message in zip(numbers, messages):
+                    if 'BODY' not in arguments.upper():
+                        lines.append(f"* {number} FETCH (UID {message['uid']})")
+                        continue
+                    if not peek:
+                        message['flags'].add('\\Seen')
+                    raw = message['raw']
+                    lines.append(
+                        f"* {number} FETCH (UID {message['uid']} FLAGS ({' '.join(sorted(message['flags']))}) "
+                        f"RFC822.SIZE {len(raw)} BODY[] {{{len(raw)}}}".encode() + b'\r\n' + raw + b')\r\n'
+                    )
+            connection.send(*lines, ok)
+        elif command == 'UID STORE':
+            uid_set, _, flags = arguments.partition(' ')
+            uids = [int(uid) for uid in uid_set.split(',')]
+            if self.on_store is not None:
+                self.on_store(uids)
+            with self._lock:
+                self.stores.append(uids)
+                for message in self.messages:
+                    if message['uid'] in uids and 'Seen' in flags:
+                        message['flags'].add('\\Seen')
+            connection.send(ok)
+        elif command == 'IDLE':
+            connection.idling = True
+            connection.send('+ idling')
+            done = connection.rfile.readline()
+            connection.idling = False
+            if not done:
+                return False
+            connection.send(f'{tag} OK IDLE terminated')
+        elif command == 'LOGOUT':
+            connection.send('* BYE logging out', ok)
+            return False
+        elif command in ('NOOP', 'EXPUNGE', 'CHECK'):
+            connection.send(ok)
+        else:
+            connection.send(f'{tag} BAD unknown command {command}')
+
+
+@pytest.fixture
+def imap_server(request):
+    # Options such as idle=False come from indirect parametrization
+    server = LocalIMAPServer(**getattr(request, 'param', {}))
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,188 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from startup import lazy_import
+
+# Loaded on the first fingerprint rather than when the app starts
+np = lazy_import('numpy')
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+Fingerprint = namedtuple('Fingerprint', ['sender', 'digest', 'simhash'])
+
+
+def normalize_text(text):
+    """Lowercase words only, so whitespace, punctuation and case do not make a repeat look new"""
+    return ' '.join(_NON_WORD.sub(' ', text.lower()).split())
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def simhash(words):
+    """
+    64-bit SimHash of a list of words
+
+    Texts that differ in a few words get hashes that differ in a few bits.
+    """
+    hashes = np.array([_hash64(word) for word in words], dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    # A bit is set when more than half of the words set it
+    majority = bits.sum(axis=0) * 2 > len(words)
+    return int(sum(1 << index for index in np.flatnonzero(majority).tolist()))
+
+
+class Deduplicator:
+    """
+    Remembers recent tickets by content so repeats can be merged into them.
+
+    An exact repeat is the same sender with the same normalized text. With
+    near_duplicates enabled, texts from the same sender whose SimHashes are
+    within max_distance bits also count, which catches reply storms and
+    auto-replies that only differ in a date or a line. The SimHash is split
+    into max_distance + 1 bands and indexed per band, so a lookup only
+    compares against entries sharing a band instead of every entry.
+
+    Entries expire ttl seconds after they were last matched, and the least
+    recently matched entry is dropped once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600, near_duplicates=True, max_distance=8, min_words=10):
+        """
+        Args:
+            max_entries (int): Most remembered tickets
+            ttl (float): Seconds an entry lives after it was last matched
+            near_duplicates (bool): Also match texts with close SimHashes
+            max_distance (int): Most differing SimHash bits for a near duplicate
+            min_words (int): Shorter texts only match exactly
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.max_distance = max_distance
+        self.min_words = min_words
+        self.band_bits = 64 // (max_distance + 1)
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        # (sender, digest) -> [value, simhash, expires], least recently matched first
+        self._entries = OrderedDict()
+        # (sender, band, band value) -> keys of the entries in that bucket
+        self._bands = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, text, sender=''):
+        """Compute the dedup key of a ticket text and its sender"""
+        normalized = normalize_text(text)
+        words = normalized.split()
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        near = self.near_duplicates and len(words) >= self.min_words
+        return Fingerprint((sender or '').lower(), digest, simhash(words) if near else None)
+
+    def _band_keys(self, sender, simhash_value):
+        mask = (1 << self.band_bits) - 1
+        return [
+            (sender, band, (simhash_value >> (band * self.band_bits)) & mask)
+            for band in range(self.max_distance + 1)
+        ]
+
+    def _remove(self, key):
+        _, simhash_value, _ = self._entries.pop(key)
+        if simhash_value is not None:
+            for band_key in self._band_keys(key[0], simhash_value):
+                bucket = self._bands.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band_key]
+
+    def _expire(self, now):
+        while self._entries:
+            key, (_, _, expires) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            self._remove(key)
+
+    def _match(self, fingerprint):
+        key = (fingerprint.sender, fingerprint.digest)
+        if key in self._entries:
+            self.hits += 1
+            return key
+        if fingerprint.simhash is not None:
+            for band_key in self._band_keys(fingerprint.sender, fingerprint.simhash):
+                for candidate in self._bands.get(band_key, ()):
+                    if bin(self._entries[candidate][1] ^ fingerprint.simhash).count('1') <= self.max_distance:
+                        self.near_hits += 1
+                        return candidate
+        self.misses += 1
+        return None
+
+    def _touch(self, key, now):
+        self._entries[key][2] = now + self.ttl
+        self._entries.move_to_end(key)
+
+    def _store(self, fingerprint, value, now):
+        key = (fingerprint.sender, fingerprint.digest)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = [value, fingerprint.simhash, now + self.ttl]
+        if fingerprint.simhash is not None:
+            for band_key in self._band_keys(fingerprint.sender, fingerprint.simhash):
+                self._bands.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def find(self, fingerprint):
+        """Return the value remembered for a repeat of this fingerprint, or None"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            key = self._match(fingerprint)
+            if key is None:
+                return None
+            self._touch(key, now)
+            return self._entries[key][0]
+
+    def claim(self, fingerprint, value):
+        """
+        Atomically find a repeat or remember this fingerprint
+
+        Returns:
+            The value of the matching entry, or None if value was stored
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            key = self._match(fingerprint)
+            if key is not None:
+                self._touch(key, now)
+                return self._entries[key][0]
+            self._store(fingerprint, value, now)
+            return None
+
+    def add(self, fingerprint, value):
+        """Remember a ticket under its fingerprint, replacing any earlier entry"""
+        with self._lock:
+            self._store(fingerprint, value, time.monotonic())
+
+    def discard(self, fingerprint, value=None):
+        """Forget a fingerprint, only if it still maps to value when one is given"""
+        key = (fingerprint.sender, fingerprint.digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (value is None or entry[0] is value):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses
+            }
\ No newline at end of file
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Event types published by the Flask app
+TICKET_CREATED = 'ticket-created'
+TICKET_RESOLVED = 'ticket-resolved'
+
+
+class EventLog:
+    """
+    Durable, ordered log of ticket events shared by every server process.
+
+    Each event gets the next offset, an integer that only grows, so readers
+    resume from the last offset they saw across reconnects and restarts.
+    Waiting readers in this process wake as soon as an event is published;
+    events written by other processes sharing the file are noticed within
+    poll_interval.
+
+    Consumers are named cursors stored next to the events. One process at a
+    time holds a consumer's lease and the cursor moves past each event once
+    it was handled. Delivery is at least once: an event whose handler ran
+    is handled again if the cursor could not be moved past it (a crash, or
+    the lease lost meanwhile), so handlers must be idempotent. An event
+    that keeps failing is set aside as a dead letter after max_attempts, so
+    it cannot hold up the events behind it.
+
+    Events older than retention are pruned once every consumer has moved
+    past them; the newest event is always kept so offsets keep growing.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            ticket_id INTEGER,
+            data TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS consumers (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            owner TEXT,
+            lease_until REAL
+        );
+        CREATE TABLE IF NOT EXISTS dead_events (
+            consumer TEXT NOT NULL,
+            event_id INTEGER NOT NULL,
+            error TEXT,
+            failed REAL NOT NULL,
+            PRIMARY KEY (consumer, event_id)
+        );
+    """
+    # Seconds between prunes of events past their retention
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, path, poll_interval=1.0, lease=30.0, max_attempts=5, retention=7 * 86400):
+        """
+        Args:
+            path (str): SQLite file holding the events
+            poll_interval (float): Seconds between checks for events from other processes
+            lease (float): Seconds a consumer stays reserved for the process running it
+            max_attempts (int): Failed attempts before a consumer dead-letters an event
+            retention (float): Seconds events are kept; 0 keeps them forever
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._pruned = 0.0
+
+        self._local = threading.local()
+        self._published = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+        self._latest = self.latest()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _seen(self, offset):
+        with self._published:
+            if offset > self._latest:
+                self._latest = offset
+                self._published.notify_all()
+
+    def publish(self, type, ticket):
+        """
+        Append an event about a ticket
+
+        Args:
+            type (str): Event type, e.g. TICKET_CREATED
+            ticket (dict): The ticket as stored after the change
+
+        Returns:
+            int: Offset of the event
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                'INSERT INTO events (type, ticket_id, data, created) VALUES (?, ?, ?, ?)',
+                (type, ticket.get('id'), json.dumps(ticket), time.time())
+            )
+        self._seen(cursor.lastrowid)
+        return cursor.lastrowid
+
+    def latest(self):
+        """Offset of the newest event, 0 while there are none"""
+        return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def read(self, after, limit=100, types=None):
+        """
+        Events after an offset, oldest first
+
+        Args:
+            after (int): Offset already seen
+            limit (int): Most events returned
+            types (list): Only events of these types; None for all
+
+        Returns:
+            list: Dicts with offset, type, ticket and time
+        """
+        sql = 'SELECT id, type, data, created FROM events WHERE id > ?'
+        params = [after]
+        if types:
+            sql += f" AND type IN ({', '.join('?' * len(types))})"
+            params.extend(types)
+        rows = self._connection().execute(sql + ' ORDER BY id LIMIT ?', (*params, limit)).fetchall()
+        return [
+            {'offset': offset, 'type': type, 'ticket': json.loads(data), 'time': created}
+            for offset, type, data, created in rows
+        ]
+
+    def wait(self, after, timeout):
+        """
+        Block until there is an event after an offset
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        deadline = time.monotonic() + timeout
+        while not self._stopping.is_set():
+            with self._published:
+                if self._latest <= after:
+                    self._published.wait(max(0.0, min(deadline - time.monotonic(), self.poll_interval)))
+                if self._latest > after:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            # Published by another process
+            self._seen(self.latest())
+        return False
+
+    def _acquire(self, name, owner):
+        """Take or renew the lease on a consumer; its position, or None if another process holds it"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR IGNORE INTO consumers (name, position) VALUES (?, 0)', (name,))
+            position, holder, lease_until = conn.execute(
+                'SELECT position, owner, lease_until FROM consumers WHERE name = ?', (name,)
+            ).fetchone()
+            if holder not in (None, owner) and lease_until > now:
+                return None
+            conn.execute(
+                'UPDATE consumers SET owner = ?, lease_until = ? WHERE name = ?', (owner, now + self.lease, name)
+            )
+        return position
+
+    def _advance(self, name, owner, position):
+        with self._connection() as conn:
+            conn.execute(
+                'UPDATE consumers SET position = ?, lease_until = ? WHERE name = ? AND owner = ?',
+                (position, time.time() + self.lease, name, owner)
+            )
+
+    def _dead_letter(self, name, event, error):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO dead_events (consumer, event_id, error, failed) VALUES (?, ?, ?, ?)',
+                (name, event['offset'], str(error), time.time())
+            )
+
+    def dead_letters(self, name, limit=100):
+        """Events a consumer gave up on, oldest first, with the last error"""
+        rows = self._connection().execute(
+            'SELECT d.event_id, d.error, d.failed, e.type, e.data FROM dead_events d '
+            'LEFT JOIN events e ON e.id = d.event_id WHERE d.consumer = ? ORDER BY d.event_id LIMIT ?',
+            (name, limit)
+        ).fetchall()
+        return [
+            {'offset': offset, 'type': type, 'ticket': json.loads(data) if data else None,
+             'error': error, 'failed': failed}
+            for offset, error, failed, type, data in rows
+        ]
+
+    def prune(self):
+        """
+        Delete events older than retention that every consumer has moved past
+
+        Returns:
+            int: Number of events deleted
+        """
+        if not self.retention:
+            return 0
+        conn = self._connection()
+        with conn:
+            # The newest event stays, so offsets never start over
+            bound = conn.execute(
+                'SELECT MIN(COALESCE((SELECT MIN(position) FROM consumers), MAX(id)), MAX(id) - 1) FROM events'
+            ).fetchone()[0]
+            if not bound:
+                return 0
+            cursor = conn.execute(
+                'DELETE FROM events WHERE id <= ? AND created < ?', (bound, time.time() - self.retention)
+            )
+        return cursor.rowcount
+
+    def _prune_if_due(self):
+        if time.monotonic() - self._pruned < self.PRUNE_INTERVAL:
+            return
+        self._pruned = time.monotonic()
+        deleted = self.prune()
+        if deleted:
+            logging.info(f"Pruned {deleted} events older than {self.retention} seconds")
+
+    def _consume(self, name, handler, batch_size):
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+        # Failed attempts at the event this consumer is stuck on
+        failures = {}
+        while not self._stopping.is_set():
+            try:
+                position = self._acquire(name, owner)
+                if position is None:
+                    self._stopping.wait(self.lease / 2)
+                    continue
+                events = self.read(position, batch_size)
+                for event in events:
+                    try:
+                        handler(event)
+                    except Exception as e:
+                        attempts = failures.pop(event['offset'], 0) + 1
+                        if attempts < self.max_attempts:
+                            failures[event['offset']] = attempts
+                            raise
+                        logging.error(
+                            f"Event {event['offset']} failed {attempts} times in consumer {name}, "
+                            f"dead-lettered: {e}"
+                        )
+                        self._dead_letter(name, event, e)
+                    else:
+                        failures.pop(event['offset'], None)
+                    # Moved past each event as soon as it is handled, so a
+                    # failure only repeats the event that failed
+                    self._advance(name, owner, event['offset'])
+                if events:
+                    continue
+                self._prune_if_due()
+                # Renew the lease well before it runs out
+                self.wait(position, self.lease / 3)
+            except Exception as e:
+                logging.error(f"Error in event consumer {name}: {e}")
+                self._stopping.wait(self.poll_interval)
+
+    def consume(self, name, handler, batch_size=100):
+        """
+        Call handler with every event, in order, on a background thread
+
+        Args:
+            name (str): Consumer name; its position is kept in the log file
+            handler (callable): Called with each event dict
+            batch_size (int): Events read at a time
+        """
+        self._stopping.clear()
+        thread = threading.Thread(
+            target=self._consume, args=(name, handler, batch_size), name=f'events-{name}', daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the consumer threads"""
+        self._stopping.set()
+        with self._published:
+            self._published.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
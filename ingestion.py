@@ -0,0 +1,147 @@
+import logging
+import threading
+
+from imap_tools import MailBox, MailBoxUnencrypted, AND, U, MailMessageFlags
+
+import metrics
+
+
+class ImapIngestor:
+    """
+    Keeps one IMAP connection open on a background thread, feeds new unread
+    messages into an EmailPipeline and marks them read once they are stored.
+
+    The mailbox is watched with IDLE so new mail arrives within seconds; servers
+    without IDLE are polled instead. Messages are fetched in bulk by UID range
+    without marking them read, only while the pipeline has room, and persisted
+    UIDs are flagged SEEN with one STORE per round. A dropped connection is
+    reopened with backoff and picks up every message that is still unread.
+    """
+
+    def __init__(self, host, username, password, pipeline, folder='INBOX', batch_size=100,
+                 idle_timeout=300, poll_interval=60, ack_interval=0.5, retry_delay=5,
+                 max_reconnect_delay=300, port=None, use_ssl=True):
+        """
+        Args:
+            host (str): IMAP server
+            username (str): Mailbox login
+            password (str): Mailbox password
+            pipeline (EmailPipeline): Turns the fetched messages into tickets
+            folder (str): Folder to watch
+            batch_size (int): Most messages fetched per round trip
+            idle_timeout (float): Seconds before IDLE is re-issued (servers drop it after 30 minutes)
+            poll_interval (float): Seconds between checks when the server has no IDLE
+            ack_interval (float): Most seconds between acknowledgements while emails are in flight
+            retry_delay (float): Seconds before fetching messages that failed a stage again
+            max_reconnect_delay (float): Upper bound on the wait before reconnecting
+            port (int): IMAP port; None for 993, or 143 without TLS
+            use_ssl (bool): Connect over TLS; False for a plain connection such as a local test server
+        """
+        self.host = host
+        self.username = username
+        self.password = password
+        self.pipeline = pipeline
+        self.folder = folder
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.ack_interval = ack_interval
+        self.retry_delay = retry_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.port = port
+        self.use_ssl = use_ssl
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        if self.use_ssl:
+            return MailBox(self.host, self.port or 993)
+        return MailBoxUnencrypted(self.host, self.port or 143)
+
+    def _fetch(self, mailbox, last_uid):
+        """
+        Submit unread messages above last_uid while the pipeline has room
+
+        Returns:
+            tuple: (new last_uid, whether every unread message was submitted)
+        """
+        while not self._stopping.is_set():
+            limit = min(self.batch_size, self.pipeline.capacity)
+            if not limit:
+                return last_uid, False
+            messages = [
+                msg for msg in mailbox.fetch(
+                    AND(seen=False, uid=U(last_uid + 1, '*')),
+                    limit=limit,
+                    mark_seen=False,
+                    bulk=True
+                )
+                # <n>:* always matches the newest message, even below n
+                if int(msg.uid) > last_uid
+            ]
+            if not messages:
+                return last_uid, True
+            metrics.IMAP_MESSAGES.inc(len(messages), event='fetched')
+            for msg in messages:
+                # Still pending from before a reconnect
+                if not self.pipeline.is_pending(msg.uid):
+                    self.pipeline.submit(msg.uid, msg)
+            last_uid = max(int(msg.uid) for msg in messages)
+        return last_uid, False
+
+    def _acknowledge(self, mailbox):
+        uids = self.pipeline.persisted()
+        if uids:
+            mailbox.flag(uids, MailMessageFlags.SEEN, True)
+            self.pipeline.acknowledge(uids)
+            metrics.IMAP_MESSAGES.inc(len(uids), event='acknowledged')
+
+    def _watch(self, mailbox):
+        supports_idle = 'IDLE' in mailbox.client.capabilities
+        last_uid = 0
+        while not self._stopping.is_set():
+            last_uid, caught_up = self._fetch(mailbox, last_uid)
+            self._acknowledge(mailbox)
+            failed = self.pipeline.take_failed()
+            if failed:
+                # Fetch them again after a pause instead of dropping them
+                last_uid = min(last_uid, min(int(uid) for uid in failed) - 1)
+                self._stopping.wait(self.retry_delay)
+            elif self.pipeline.in_flight or self.pipeline.persisted() or not caught_up:
+                # Also emails persisted since the acknowledgement above, which
+                # would otherwise stay unread on the server until IDLE returns
+                self.pipeline.wait(self.ack_interval)
+            elif supports_idle:
+                # Returns as soon as the server reports new mail
+                mailbox.idle.wait(timeout=self.idle_timeout)
+            else:
+                self._stopping.wait(self.poll_interval)
+
+    def _run(self):
+        delay = 1
+        while not self._stopping.is_set():
+            try:
+                with self._connect().login(self.username, self.password, self.folder) as mailbox:
+                    delay = 1
+                    self._watch(mailbox)
+            except Exception as e:
+                logging.error(f"Error processing email: {e}")
+                metrics.IMAP_CONNECTION_ERRORS.inc()
+                self._stopping.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def start(self):
+        """Start watching the mailbox"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='imap-ingestor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop watching; a pending IDLE is abandoned with the daemon thread"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
\ No newline at end of file
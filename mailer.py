@@ -1,12 +1,167 @@
+import logging
 import smtplib
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
 
+import metrics
+
 # Load environment variables
 load_dotenv()
 
+# Team address for each classifier category (matched case-insensitively),
+# overridden by ISSUE_HANDLERS such as
+# "Billing=billing-team@company.com,Technical Support=it-team@company.com"
+DEFAULT_ISSUE_HANDLERS = {
+    "technical support": "support-team@company.com",
+    "billing": "billing-team@company.com",
+    "account management": "accounts-team@company.com",
+    "general inquiry": "info-team@company.com"
+}
+
+def parse_handlers(spec):
+    """Category -> team address from an ISSUE_HANDLERS setting; the defaults when it is empty"""
+    handlers = {}
+    for entry in (spec or '').split(','):
+        category, _, address = entry.partition('=')
+        if category.strip() and address.strip():
+            handlers[category.strip().lower()] = address.strip()
+    return handlers or dict(DEFAULT_ISSUE_HANDLERS)
+
+def is_connection_error(error):
+    """Whether the error means the session itself is unusable, so reconnecting can help"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # SMTPException subclasses OSError; the rest are socket-level failures
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+class SMTPConnectionPool:
+    """
+    Pool of authenticated SMTP sessions that are reused between sends
+
+    Opening a session costs a TCP connect, STARTTLS and AUTH; the pool pays
+    that once per connection instead of once per email, and transparently
+    reconnects when the server has dropped an idle session.
+    """
+
+    def __init__(self, host, port, username='', password='', use_tls=True,
+                 size=4, idle_timeout=60.0, timeout=30.0):
+        """
+        Args:
+            host (str): SMTP server host
+            port (int): SMTP server port
+            username (str): Login user; no AUTH when empty
+            password (str): Login password
+            use_tls (bool): Upgrade the session with STARTTLS
+            size (int): Maximum number of open sessions
+            idle_timeout (float): Seconds after which an unused session is
+                replaced rather than reused
+            timeout (float): Socket timeout in seconds
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        # Most recently used session first, so surplus ones age out
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        with metrics.SMTP_SECONDS.time(step='connect'):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                with metrics.SMTP_SECONDS.time(step='starttls'):
+                    server.starttls()
+            if self.username:
+                with metrics.SMTP_SECONDS.time(step='login'):
+                    server.login(self.username, self.password)
+        except Exception:
+            self._discard(server)
+            raise
+        return server
+
+    @staticmethod
+    def _discard(server):
+        try:
+            with metrics.SMTP_SECONDS.time(step='quit'):
+                server.quit()
+        except Exception:
+            server.close()
+
+    def _checkout(self):
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.idle_timeout:
+                return server
+            self._discard(server)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a session; it goes back to the pool unless it failed"""
+        with self._slots:
+            server = self._checkout()
+            try:
+                yield server
+            except Exception:
+                self._discard(server)
+                raise
+            self._idle.put((server, time.monotonic()))
+
+    def send_batch(self, messages):
+        """
+        Send several messages over one session
+
+        A dropped connection is reopened once and the remaining messages are
+        retried; other per-message errors do not stop the batch.
+
+        Args:
+            messages (list): email.message.Message objects
+
+        Returns:
+            list: For each message, None if sent or the exception raised
+        """
+        results = [None] * len(messages)
+        pending = list(range(len(messages)))
+        for attempt in range(2):
+            try:
+                with self.connection() as server:
+                    while pending:
+                        try:
+                            with metrics.SMTP_SECONDS.time(step='send'):
+                                server.send_message(messages[pending[0]])
+                        except Exception as e:
+                            if is_connection_error(e):
+                                raise
+                            results[pending[0]] = e
+                        pending.pop(0)
+                break
+            except Exception as e:
+                if attempt or not is_connection_error(e):
+                    for index in pending:
+                        results[index] = e
+                    break
+        return results
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(server)
+
 class EmailSender:
     def __init__(self):
         # Load email configuration from environment variables
@@ -16,6 +171,73 @@ class EmailSender:
         self.email_password = os.getenv('EMAIL_PASSWORD', '')
         self.email_from = os.getenv('EMAIL_FROM', self.email_username)
         self.admin_email = os.getenv('ADMIN_EMAIL', 'admin@example.com')
+        self.issue_handlers = parse_handlers(os.getenv('ISSUE_HANDLERS'))
+        self.email_use_tls = os.getenv('EMAIL_USE_TLS', 'true').lower() != 'false'
+
+        # Authenticated sessions are reused across emails
+        self.pool = SMTPConnectionPool(
+            self.email_host,
+            self.email_port,
+            self.email_username,
+            self.email_password,
+            use_tls=self.email_use_tls,
+            size=int(os.getenv('EMAIL_POOL_SIZE', 4)),
+            idle_timeout=float(os.getenv('EMAIL_POOL_IDLE_TIMEOUT', 60))
+        )
+
+    def build_message(self, to_email, subject, message, is_html=False):
+        """Build a MIME message from the sender's address"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.email_from
+        msg['To'] = to_email
+
+        # Attach message
+        content_type = 'html' if is_html else 'plain'
+        msg.attach(MIMEText(message, content_type))
+        return msg
+
+    def deliver(self, emails):
+        """
+        Send several emails over one pooled SMTP session
+
+        Args:
+            emails (list): (to_email, subject, message, is_html) tuples
+
+        Returns:
+            list: For each email, None if sent or the error that stopped it
+        """
+        # Relays that take mail without AUTH need no username or password,
+        # but every message needs a From address
+        if not self.email_host or not self.email_from:
+            return [RuntimeError("Email host or sender address not configured")] * len(emails)
+
+        try:
+            messages = [self.build_message(*email) for email in emails]
+        except Exception as e:
+            return [e] * len(emails)
+        results = self.pool.send_batch(messages)
+        failed = sum(error is not None for error in results)
+        metrics.EMAILS_SENT.inc(len(results) - failed, result='sent')
+        if failed:
+            metrics.EMAILS_SENT.inc(failed, result='failed')
+        return results
+
+    def send_batch(self, emails):
+        """
+        Send several emails over one pooled SMTP session
+
+        Args:
+            emails (list): (to_email, subject, message, is_html) tuples
+
+        Returns:
+            list: True/False per email, in the same order
+        """
+        results = self.deliver(emails)
+        for error in results:
+            if error is not None:
+                logging.error(f"Failed to send email: {error}")
+        return [error is None for error in results]
     
     def send_email(self, to_email, subject, message, is_html=False):
         """
@@ -30,47 +252,22 @@ class EmailSender:
         Returns:
             bool: True if sent successfully, False otherwise
         """
-        if not self.email_username or not self.email_password:
-            print("Email credentials not configured")
-            return False
-            
-        try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.email_from
-            msg['To'] = to_email
-            
-            # Attach message
-            content_type = 'html' if is_html else 'plain'
-            msg.attach(MIMEText(message, content_type))
-            
-            # Connect to SMTP server
-            server = smtplib.SMTP(self.email_host, self.email_port)
-            server.starttls()
-            server.login(self.email_username, self.email_password)
-            
-            # Send email
-            server.send_message(msg)
-            server.quit()
-            
-            return True
-        except Exception as e:
-            print(f"Failed to send email: {str(e)}")
-            return False
+        return self.send_batch([(to_email, subject, message, is_html)])[0]
     
-    def send_ticket_confirmation(self, ticket_data):
+    def ticket_confirmation_email(self, ticket_data):
         """
-        Send confirmation email to the user when a ticket is created
+        Build the confirmation email sent to the user when a ticket is created
         
         Args:
             ticket_data (dict): Ticket information
         
         Returns:
-            bool: True if sent successfully, False otherwise
+            tuple: (to_email, subject, message, is_html), or None if the
+                ticket has no contact email
         """
         # Skip if no email provided
         if not ticket_data.get('contact_email'):
-            return False
+            return None
         
         subject = f"Ticket #{ticket_data['id']} Received - {ticket_data['category']}"
         
@@ -91,17 +288,17 @@ class EmailSender:
         Support Team</p>
         """
         
-        return self.send_email(ticket_data['contact_email'], subject, message, is_html=True)
+        return (ticket_data['contact_email'], subject, message, True)
     
-    def notify_admin_new_ticket(self, ticket_data):
+    def admin_new_ticket_email(self, ticket_data):
         """
-        Notify administrators about a new ticket
+        Build the email notifying administrators about a new ticket
         
         Args:
             ticket_data (dict): Ticket information
         
         Returns:
-            bool: True if sent successfully, False otherwise
+            tuple: (to_email, subject, message, is_html)
         """
         subject = f"New Ticket #{ticket_data['id']} - {ticket_data['category']}"
         
@@ -118,22 +315,56 @@ class EmailSender:
         <p>{ticket_data['description']}</p>
         """
         
-        return self.send_email(self.admin_email, subject, message, is_html=True)
+        return (self.admin_email, subject, message, True)
     
-    def send_resolution_notification(self, ticket_data, resolution_notes=""):
+    def handler_new_ticket_email(self, ticket_data):
         """
-        Send notification to the user when their ticket is resolved
+        Build the email assigning a new ticket to the team handling its category
+        
+        Args:
+            ticket_data (dict): Ticket information
+        
+        Returns:
+            tuple: (to_email, subject, message, is_html), or None if no team
+                handles the category
+        """
+        handler_email = self.issue_handlers.get((ticket_data.get('category') or '').lower())
+        if not handler_email:
+            logging.warning(f"No handler configured for category: {ticket_data.get('category')}")
+            return None
+        
+        subject = f"New {ticket_data['priority'].upper()} Priority Issue: #{ticket_data['id']}"
+        
+        message = f"""
+        New Issue Assigned:
+        
+        ID: {ticket_data['id']}
+        Description: {ticket_data['description']}
+        Priority: {ticket_data['priority']}
+        Category: {ticket_data['category']}
+        Status: {ticket_data['status']}
+        Date: {ticket_data['date']}
+        
+        Please review and take appropriate action.
+        """
+        
+        return (handler_email, subject, message, False)
+    
+    def resolution_email(self, ticket_data, resolution_notes=""):
+        """
+        Build the notification sent to the user when their ticket is resolved
         
         Args:
             ticket_data (dict): Ticket information
             resolution_notes (str): Notes on how the issue was resolved
         
         Returns:
-            bool: True if sent successfully, False otherwise
+            tuple: (to_email, subject, message, is_html), or None if the
+                ticket has no contact email
         """
         # Skip if no email provided
         if not ticket_data.get('contact_email'):
-            return False
+            return None
         
         subject = f"Ticket #{ticket_data['id']} Resolved"
         
@@ -156,4 +387,44 @@ class EmailSender:
         Support Team</p>
         """
         
-        return self.send_email(ticket_data['contact_email'], subject, message, is_html=True) 
\ No newline at end of file
+        return (ticket_data['contact_email'], subject, message, True)
+    
+    def send_ticket_confirmation(self, ticket_data):
+        """
+        Send confirmation email to the user when a ticket is created
+        
+        Returns:
+            bool: True if sent successfully, False otherwise
+        """
+        email = self.ticket_confirmation_email(ticket_data)
+        return self.send_email(*email) if email else False
+    
+    def notify_admin_new_ticket(self, ticket_data):
+        """
+        Notify administrators about a new ticket
+        
+        Returns:
+            bool: True if sent successfully, False otherwise
+        """
+        return self.send_email(*self.admin_new_ticket_email(ticket_data))
+    
+    def send_new_ticket_notifications(self, ticket_data):
+        """
+        Send the user confirmation (if there is a contact email) and the
+        admin notice for a new ticket over a single SMTP session
+        
+        Returns:
+            list: True/False per email sent
+        """
+        emails = [self.ticket_confirmation_email(ticket_data), self.admin_new_ticket_email(ticket_data)]
+        return self.send_batch([email for email in emails if email])
+    
+    def send_resolution_notification(self, ticket_data, resolution_notes=""):
+        """
+        Send notification to the user when their ticket is resolved
+        
+        Returns:
+            bool: True if sent successfully, False otherwise
+        """
+        email = self.resolution_email(ticket_data, resolution_notes)
+        return self.send_email(*email) if email else False 
\ No newline at end of file
@@ -1,25 +1,92 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from typing import Optional, List
 import asyncio
-from imap_tools import MailBox, AND
+import concurrent.futures
 import logging
 import os
+import time
 
-from classifier import IssueClassifier
+import metrics
 from service_handler import ServiceRequestHandler
 from config import settings
+from pipeline import EmailPipeline
+from dedup import Deduplicator
+from startup import Deferred, profile
 
 app = FastAPI()
-classifier = IssueClassifier()
-service_handler = ServiceRequestHandler()
+
+def create_classifier():
+    # models pulls in numpy; only imported when the classifier is built
+    from models import create_classifier
+    return create_classifier()
+
+# Both are built in the background from the startup event, so the app starts
+# serving without waiting for the classifier or the request archive
+classifier = Deferred("classifier", create_classifier)
+# Live requests in memory, the oldest moved to SERVICE_ARCHIVE_FILE beyond the cap
+service_handler = Deferred("service_handler", lambda: ServiceRequestHandler(
+    max_requests=settings.SERVICE_MAX_REQUESTS,
+    archive_path=settings.SERVICE_ARCHIVE_FILE or None
+))
 
 # Set up templates
 templates = Jinja2Templates(directory="templates")
 
+def render(template, context):
+    with metrics.RENDER_SECONDS.time(template=template):
+        return templates.TemplateResponse(template, context)
+
+def create_request(text, classification, source, **fields):
+    # classification is a (category, version) pair from one classifier call,
+    # so the version stored is the one that gave the category
+    category, classifier_version = classification
+    with metrics.PERSIST_SECONDS.time(operation="create"):
+        return service_handler.create_request(
+            text, category, source, classifier_version=classifier_version, **fields
+        )
+
+# Prometheus metrics; with METRICS_ENABLED=false the middleware is not installed
+# and the timers do nothing
+if metrics.ENABLED:
+    @app.middleware("http")
+    async def record_request_time(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            app="fastapi", endpoint=getattr(route, "path", "unknown"), method=request.method
+        )
+        return response
+
+    metrics.Gauge(
+        "classifier_queue_depth", "Texts waiting to be micro-batched",
+        lambda: classifier.queue_depth if classifier.is_built else 0
+    )
+    metrics.Gauge(
+        "service_requests_live", "Requests held in memory",
+        lambda: service_handler.stats()["live"] if service_handler.is_built else 0
+    )
+    metrics.Gauge(
+        "email_pipeline_queue_depth", "Emails waiting for each pipeline stage",
+        lambda: {(stage.name,): stage.queue.qsize() for stage in email_pipeline.stages} if email_pipeline else {},
+        ("stage",)
+    )
+    metrics.Gauge(
+        "email_pipeline_in_flight", "Fetched emails not yet persisted",
+        lambda: email_pipeline.in_flight if email_pipeline else 0
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
 class IssueRequest(BaseModel):
     text: str
     source: str
@@ -29,28 +96,58 @@ class IssueRequest(BaseModel):
 # Web routes
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return render("index.html", {"request": request})
 
 @app.get("/submit", response_class=HTMLResponse)
 async def submit_form(request: Request):
-    return templates.TemplateResponse("submit.html", {"request": request})
+    return render("submit.html", {"request": request})
 
 # API routes
 @app.post("/api/process-issue")
 async def process_issue(issue: IssueRequest):
     try:
-        classification = classifier.classify_issue(issue.text)
-        request = service_handler.create_request(issue.text, classification, issue.source)
+        # Batched with concurrent requests, without blocking the event loop
+        classification = await asyncio.wrap_future(classifier.submit_with_version(issue.text))
+        request = create_request(
+            issue.text, classification, issue.source, priority=issue.priority, contact_email=issue.contact_email
+        )
         return request.to_dict()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/process-issues")
+async def process_issues(issues: List[IssueRequest]):
+    try:
+        classifications = await asyncio.get_running_loop().run_in_executor(
+            None, classifier.classify_batch_with_version, [issue.text for issue in issues]
+        )
+        return [
+            create_request(
+                issue.text, classification, issue.source, priority=issue.priority, contact_email=issue.contact_email
+            ).to_dict()
+            for issue, classification in zip(issues, classifications)
+        ]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/recent-requests")
-async def get_recent_requests():
-    # Get the 10 most recent requests
-    requests = list(service_handler.requests.values())
-    requests.sort(key=lambda x: x.timestamp, reverse=True)
-    return [request.to_dict() for request in requests[:10]]
+async def get_recent_requests(
+    response: Response,
+    limit: int = Query(10, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    since_id: Optional[int] = None,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    priority: Optional[str] = None
+):
+    """Most recent requests, newest first; pass X-Next-Cursor back as cursor for the next page"""
+    # Walks the time index back from the cursor instead of scanning every request
+    page = service_handler.recent(
+        limit, before_id=cursor, after_id=since_id, status=status, category=category, priority=priority
+    )
+    if len(page) == limit:
+        response.headers["X-Next-Cursor"] = str(page[-1].id)
+    return [request.to_dict() for request in page]
 
 @app.get("/api/request/{request_id}")
 async def get_request(request_id: str):
@@ -60,28 +157,107 @@ async def get_request(request_id: str):
     return request.to_dict()
 
 # Email processing
-async def process_email():
-    while True:
-        try:
-            with MailBox(settings.EMAIL_SERVER).login(settings.EMAIL_USERNAME, settings.EMAIL_PASSWORD) as mailbox:
-                for msg in mailbox.fetch(AND(seen=False)):
-                    classification = classifier.classify_issue(msg.text)
-                    service_handler.create_request(msg.text, classification, "email")
-                    # Mark email as read
-                    mailbox.flag(msg.uid, 'SEEN', True)
-        except Exception as e:
-            logging.error(f"Error processing email: {e}")
-        await asyncio.sleep(60)  # Check every minute
+email_pipeline = None
+email_ingestor = None
+
+async def process_email(text, classification, sender=None):
+    return create_request(text, classification, "email", contact_email=sender)
+
+def persist_email(item, loop, timeout):
+    """
+    Create the request for a classified email on the event loop, from a pipeline worker
+
+    The mail is only marked read once this returns. If the loop does not get
+    to it within timeout seconds, TimeoutError fails the email's stage and
+    the ingestor fetches it again, instead of the worker waiting forever.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        process_email(item.text, (item.category, item.classifier_version), item.message.from_), loop
+    )
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"Request for email {item.uid} not created within {timeout}s")
+
+def merge_duplicate(item):
+    # Counted on the original, like repeat submissions in the Flask app
+    service_handler.record_duplicate(item.duplicate_of.id)
+    logging.info(f"Merged repeat email from {item.message.from_} into request {item.duplicate_of.id}")
+
+@app.get("/api/email-pipeline")
+async def get_email_pipeline():
+    """Queue depth, throughput and failures of each email processing stage"""
+    if email_pipeline is None:
+        return {"enabled": False}
+    return {"enabled": True, **email_pipeline.metrics()}
+
+@app.get("/api/startup")
+async def get_startup(response: Response):
+    """Readiness probe with the startup profile; 503 until the classifier and request store are built"""
+    ready = classifier.is_built and service_handler.is_built
+    if not ready:
+        response.status_code = 503
+    return {**profile.report(), "ready": ready, "pid": os.getpid()}
 
 @app.on_event("startup")
 async def startup_event():
+    global email_pipeline, email_ingestor
+    classifier.warm_up()
+    service_handler.warm_up()
     try:
-        # Start email processing in background
-        asyncio.create_task(process_email())
+        if not settings.EMAIL_USERNAME:
+            logging.info("Email credentials not configured, email processing disabled")
+            return
+        # imap_tools is only imported when email processing is configured
+        from ingestion import ImapIngestor
+        loop = asyncio.get_running_loop()
+
+        def persist(item):
+            return persist_email(item, loop, settings.EMAIL_PERSIST_TIMEOUT)
+
+        # Repeats and reply storms are merged before classification and storage
+        dedup = Deduplicator(
+            max_entries=settings.DEDUP_MAX_ENTRIES,
+            ttl=settings.DEDUP_TTL,
+            near_duplicates=settings.DEDUP_NEAR_DUPLICATES
+        ) if settings.DEDUP_ENABLED else None
+
+        # Parse, classify and persist on worker threads, off the event loop
+        email_pipeline = EmailPipeline(
+            classifier.classify_batch_with_version,
+            persist,
+            dedup=dedup,
+            merge=merge_duplicate,
+            parse_workers=settings.EMAIL_PARSE_WORKERS,
+            classify_workers=settings.EMAIL_CLASSIFY_WORKERS,
+            persist_workers=settings.EMAIL_PERSIST_WORKERS,
+            classify_batch=settings.EMAIL_CLASSIFY_BATCH,
+            queue_size=settings.EMAIL_PIPELINE_QUEUE_SIZE
+        )
+        email_pipeline.start()
+        email_ingestor = ImapIngestor(
+            settings.EMAIL_SERVER,
+            settings.EMAIL_USERNAME,
+            settings.EMAIL_PASSWORD,
+            email_pipeline,
+            folder=settings.EMAIL_FOLDER,
+            batch_size=settings.EMAIL_FETCH_BATCH,
+            idle_timeout=settings.EMAIL_IDLE_TIMEOUT,
+            poll_interval=settings.EMAIL_POLL_INTERVAL
+        )
+        email_ingestor.start()
         logging.info("Email processing started successfully")
     except Exception as e:
         logging.error(f"Error during startup: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if email_ingestor is not None:
+        email_ingestor.stop(timeout=5)
+    if service_handler.is_built:
+        service_handler.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
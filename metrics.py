@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# With METRICS_ENABLED=false every timer and counter returns immediately and
+# /metrics answers 404
+ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond classification up to slow SMTP sessions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    # A later registration under the same name replaces the earlier one
+    with _registry_lock:
+        _registry[metric.name] = metric
+    return metric
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        """
+        Args:
+            name (str): Metric name
+            help (str): One line description shown by Prometheus
+            labels (tuple): Label names; every update passes a value for each
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        _register(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        return []
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """A count that only goes up"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, _labels(self.labelnames, key), value) for key, value in values]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, usually durations in seconds"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the seconds spent in its block"""
+        if not ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                samples.append((f'{self.name}_bucket', _labels(self.labelnames, key, le), cumulative))
+            samples.append((f'{self.name}_sum', _labels(self.labelnames, key), total))
+            samples.append((f'{self.name}_count', _labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class Gauge(_Metric):
+    """
+    A value read when metrics are collected, such as a queue depth
+
+    func returns a number, or with labels a dict mapping tuples of label
+    values to numbers.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, func, labels=()):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if not self.labelnames:
+            return [(self.name, '', value)]
+        return [(self.name, _labels(self.labelnames, key), item) for key, item in value.items()]
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    with _registry_lock:
+        registered = list(_registry.values())
+    blocks = []
+    for metric in registered:
+        try:
+            blocks.append(metric.render())
+        except Exception as e:
+            # One broken gauge callback should not hide the other metrics
+            blocks.append(f'# {metric.name} unavailable: {_escape(e)}')
+    return '\n'.join(blocks) + '\n'
+
+
+# Hot path timings
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'Time spent handling HTTP requests', ('app', 'endpoint', 'method')
+)
+CLASSIFY_SECONDS = Histogram(
+    'ticket_classify_seconds', 'Time spent in one classifier backend call', ('backend',)
+)
+CLASSIFY_CACHE = Counter(
+    'ticket_classify_cache_total', 'Classification cache lookups', ('result',)
+)
+PERSIST_SECONDS = Histogram(
+    'ticket_persist_seconds', 'Time spent writing tickets to the store', ('operation',)
+)
+SEARCH_SECONDS = Histogram(
+    'ticket_search_seconds', 'Time spent answering full-text searches'
+)
+RENDER_SECONDS = Histogram(
+    'template_render_seconds', 'Time spent rendering HTML templates', ('template',)
+)
+SMTP_SECONDS = Histogram(
+    'smtp_step_seconds', 'Time spent in each step of an SMTP session', ('step',)
+)
+EMAILS_SENT = Counter(
+    'emails_sent_total', 'Emails handed to the SMTP server', ('result',)
+)
+RULES_RELOADS = Counter(
+    'classifier_rules_reloads_total', 'Classification rules file reloads', ('result',)
+)
+
+# Email ingestion
+IMAP_MESSAGES = Counter(
+    'imap_messages_total', 'Emails fetched over IMAP and what became of them', ('event',)
+)
+IMAP_CONNECTION_ERRORS = Counter(
+    'imap_connection_errors_total', 'IMAP sessions that failed and were reopened'
+)
+EMAIL_STAGE_SECONDS = Histogram(
+    'email_stage_seconds', 'Time spent in one batch of an email pipeline stage', ('stage',)
+)
@@ -0,0 +1,573 @@
+import argparse
+import hashlib
+import importlib.util
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+import metrics
+from classifier import ClassificationCache, IssueClassifier, classify_cached
+from config import settings
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercase words and word pairs of a ticket text"""
+    words = _WORD.findall(text.lower())
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+
+class TfidfModel:
+    """
+    TF-IDF features and a softmax linear model, in plain NumPy.
+
+    Documents are kept sparse (term indices and weights) so training and
+    prediction cost grows with the number of terms in the texts, not with
+    the vocabulary size.
+    """
+
+    def __init__(self, vocabulary, idf, weights, bias, categories):
+        """
+        Args:
+            vocabulary (list): Terms, in feature order
+            idf (numpy.ndarray): Inverse document frequency per term
+            weights (numpy.ndarray): terms x categories weight matrix
+            bias (numpy.ndarray): Bias per category
+            categories (list): Category names, in column order
+        """
+        self.vocabulary = {term: index for index, term in enumerate(vocabulary)}
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.categories = list(categories)
+
+    @staticmethod
+    def _sparse(documents, vocabulary, idf):
+        """Sublinear, L2-normalised TF-IDF rows as (row ids, term ids, values)"""
+        rows, columns, values = [], [], []
+        for row, terms in enumerate(documents):
+            counts = {}
+            for term in terms:
+                index = vocabulary.get(term)
+                if index is not None:
+                    counts[index] = counts.get(index, 0) + 1
+            if not counts:
+                continue
+            indices = np.fromiter(counts, dtype=np.int64, count=len(counts))
+            weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))) * idf[indices]
+            rows.append(np.full(len(indices), row, dtype=np.int64))
+            columns.append(indices)
+            values.append(weights / np.linalg.norm(weights))
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        return np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+
+    @staticmethod
+    def _scores(rows, columns, values, weights, bias, count):
+        scores = np.tile(bias, (count, 1))
+        for column in range(weights.shape[1]):
+            scores[:, column] += np.bincount(rows, weights=values * weights[columns, column], minlength=count)
+        return scores
+
+    def predict(self, texts):
+        """Return the most likely category for each text"""
+        rows, columns, values = self._sparse([tokenize(text) for text in texts], self.vocabulary, self.idf)
+        scores = self._scores(rows, columns, values, self.weights, self.bias, len(texts))
+        return [self.categories[index] for index in scores.argmax(axis=1).tolist()]
+
+    @classmethod
+    def train(cls, texts, labels, max_features=20000, min_df=2, iterations=300, learning_rate=0.1, l2=1e-4):
+        """
+        Fit a model with full-batch Adam on the softmax cross-entropy
+
+        Args:
+            texts (list): Ticket texts
+            labels (list): Category of each text
+            max_features (int): Keep the terms found in the most documents
+            min_df (int): Ignore terms found in fewer documents
+            iterations (int): Gradient steps
+            learning_rate (float): Adam step size
+            l2 (float): Weight decay
+
+        Returns:
+            TfidfModel: The trained model
+        """
+        documents = [tokenize(text) for text in texts]
+        document_frequency = {}
+        for terms in documents:
+            for term in set(terms):
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        terms = [term for term, count in document_frequency.items() if count >= min_df]
+        terms.sort(key=lambda term: (-document_frequency[term], term))
+        terms = terms[:max_features]
+        vocabulary = {term: index for index, term in enumerate(terms)}
+        frequencies = np.array([document_frequency[term] for term in terms], dtype=np.float64)
+        idf = np.log((1 + len(documents)) / (1 + frequencies)) + 1
+
+        categories = sorted(set(labels))
+        category_index = {category: index for index, category in enumerate(categories)}
+        targets = np.zeros((len(labels), len(categories)))
+        targets[np.arange(len(labels)), [category_index[label] for label in labels]] = 1
+
+        rows, columns, values = cls._sparse(documents, vocabulary, idf)
+        weights = np.zeros((len(terms), len(categories)))
+        bias = np.zeros(len(categories))
+        moments = [np.zeros_like(weights), np.zeros_like(bias)]
+        velocities = [np.zeros_like(weights), np.zeros_like(bias)]
+        for step in range(1, iterations + 1):
+            scores = cls._scores(rows, columns, values, weights, bias, len(labels))
+            scores -= scores.max(axis=1, keepdims=True)
+            probabilities = np.exp(scores)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            delta = (probabilities - targets) / len(labels)
+            weight_gradient = np.stack([
+                np.bincount(columns, weights=values * delta[rows, column], minlength=len(terms))
+                for column in range(len(categories))
+            ], axis=1) + l2 * weights
+            gradients = [weight_gradient, delta.sum(axis=0)]
+            for parameter, gradient, moment, velocity in zip((weights, bias), gradients, moments, velocities):
+                moment *= 0.9
+                moment += 0.1 * gradient
+                velocity *= 0.999
+                velocity += 0.001 * gradient ** 2
+                parameter -= learning_rate * (moment / (1 - 0.9 ** step)) / (
+                    np.sqrt(velocity / (1 - 0.999 ** step)) + 1e-8
+                )
+        return cls(terms, idf, weights, bias, categories)
+
+    def save(self, path):
+        """Write the model to an .npz file, replacing it atomically"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                vocabulary=np.array(sorted(self.vocabulary, key=self.vocabulary.get)),
+                idf=self.idf,
+                weights=self.weights,
+                bias=self.bias,
+                categories=np.array(self.categories)
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data['vocabulary'].tolist(),
+                data['idf'],
+                data['weights'],
+                data['bias'],
+                data['categories'].tolist()
+            )
+
+
+class KeywordBackend:
+    """The keyword table classifier behind the backend interface"""
+
+    name = 'keywords'
+
+    def __init__(self, classifier=None):
+        # ModelClassifier caches the results itself
+        self.classifier = classifier or IssueClassifier(cache_size=0)
+
+    @property
+    def version(self):
+        return self.classifier.version
+
+    def load(self):
+        pass
+
+    def classify_batch(self, texts):
+        return self.classifier.classify_batch(texts)
+
+    def classify_batch_with_version(self, texts):
+        # The rules version is read with the rules, as they may be reloaded
+        return self.classifier.classify_batch_with_version(texts)
+
+
+class TfidfBackend:
+    """A TfidfModel saved by train_from_store"""
+
+    name = 'tfidf'
+
+    def __init__(self, path):
+        self.path = path
+        self.model = None
+        self.version = None
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self.model = TfidfModel.load(self.path)
+        self.version = f'tfidf:{digest[:12]}'
+
+    def classify_batch(self, texts):
+        return self.model.predict(texts)
+
+    def classify_batch_with_version(self, texts):
+        return [(category, self.version) for category in self.classify_batch(texts)]
+
+
+class TransformerBackend:
+    """
+    A fine-tuned sequence classification model from a local directory, on CPU
+
+    Needs the optional transformers and torch packages. The model's id2label
+    names must be the service groups. Nothing is ever downloaded.
+    """
+
+    name = 'transformer'
+
+    def __init__(self, path, max_length=256):
+        self.path = path
+        self.max_length = max_length
+        self.tokenizer = None
+        self.model = None
+        self.version = None
+
+    def load(self):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(self.path, local_files_only=True)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.path, local_files_only=True)
+        self.model.to('cpu').eval()
+        self.version = f'transformer:{os.path.basename(os.path.normpath(self.path))}'
+
+    def classify_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, truncation=True, padding=True, max_length=self.max_length, return_tensors='pt'
+        )
+        with self._torch.inference_mode():
+            predictions = self.model(**encoded).logits.argmax(dim=-1).tolist()
+        return [self.model.config.id2label[index] for index in predictions]
+
+    def classify_batch_with_version(self, texts):
+        return [(category, self.version) for category in self.classify_batch(texts)]
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single-text requests into one batch call.
+
+    While a batch runs, new requests queue up and all go into the next call,
+    so batches grow with load without adding latency when idle.
+    """
+
+    def __init__(self, func, max_batch=32, max_wait=0.002):
+        """
+        Args:
+            func (callable): List of texts -> list of results
+            max_batch (int): Most texts per call
+            max_wait (float): Seconds to wait for more texts after the first
+        """
+        self.func = func
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, text):
+        """Queue a text; the returned Future resolves to its result"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='classifier-batcher', daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    @property
+    def queue_depth(self):
+        """Texts waiting for the next batch"""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.func([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class ModelClassifier:
+    """
+    Classifies tickets with a model backend, falling back to keywords.
+
+    The model is loaded on a background thread on first use, so startup
+    stays fast and requests keep being answered by the fallback until it
+    is ready. If loading or inference fails the fallback answers instead;
+    a failed load is tried again on a later request, after a backoff.
+    Repeated texts are answered from a ClassificationCache keyed on the
+    version of the answering backend, and the remaining single texts from
+    concurrent callers are micro-batched.
+
+    Offers the same classify_issue/classify_batch methods as IssueClassifier,
+    and their _with_version forms, which return each category together with
+    the version of the backend that actually answered it.
+    """
+
+    # Longest wait between attempts to load a model that failed to load
+    MAX_RETRY_DELAY = 600.0
+
+    def __init__(self, backend, fallback=None, batch_size=32, batch_wait=0.002, cache_size=10000,
+                 retry_delay=30.0):
+        """
+        Args:
+            backend: Object with load(), classify_batch_with_version(texts)
+                returning (category, version) pairs, and a version
+            fallback: Backend used until the model is ready or when it fails;
+                None means backend is loaded right away and used alone
+            batch_size (int): Most texts per micro-batch; 1 disables batching
+            batch_wait (float): Seconds a micro-batch waits to fill up
+            cache_size (int): Most cached classifications; 0 disables the cache
+            retry_delay (float): Seconds before a failed load is tried again,
+                doubling with each failure up to MAX_RETRY_DELAY
+        """
+        self.backend = backend
+        self.fallback = fallback
+        self.cache = ClassificationCache(cache_size) if cache_size else None
+        self._ready = threading.Event()
+        self._loading = False
+        self.retry_delay = retry_delay
+        self._load_failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        if fallback is None:
+            backend.load()
+            self._ready.set()
+        self._batcher = MicroBatcher(self._classify, batch_size, batch_wait) if batch_size > 1 else None
+
+    @property
+    def active_backend(self):
+        """The backend currently answering"""
+        return self.backend if self._ready.is_set() else self.fallback
+
+    def _answering_backend(self):
+        if not self._ready.is_set():
+            if not self._loading:
+                self._start_loading()
+            return self.fallback
+        return self.backend
+
+    @property
+    def version(self):
+        """Version of the backend currently answering"""
+        return self.active_backend.version
+
+    def _load(self):
+        try:
+            self.backend.load()
+        except Exception:
+            with self._lock:
+                self._load_failures += 1
+                delay = min(self.retry_delay * 2 ** (self._load_failures - 1), self.MAX_RETRY_DELAY)
+                self._retry_at = time.monotonic() + delay
+                self._loading = False
+            logging.exception(f"Classification model unavailable, using keywords; trying again in {delay:g}s")
+            return
+        self._ready.set()
+        self._loading = False
+        logging.info(f"Classification model {self.backend.version} loaded")
+
+    def _start_loading(self):
+        with self._lock:
+            # After a failure the next request starts another attempt once the backoff is over
+            if self._loading or time.monotonic() < self._retry_at:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, name='classifier-loader', daemon=True).start()
+
+    def wait_until_loaded(self, timeout=None):
+        """Start loading the model and wait for it; returns whether it is ready"""
+        if not self._loading and not self._ready.is_set():
+            self._start_loading()
+        return self._ready.wait(timeout)
+
+    def _classify(self, texts):
+        """
+        Classify without consulting the cache, then cache what the backend
+        answered; returns (category, version) pairs
+        """
+        backend = self._answering_backend()
+        try:
+            with metrics.CLASSIFY_SECONDS.time(backend=backend.name):
+                results = backend.classify_batch_with_version(texts)
+        except Exception as e:
+            if backend is self.fallback or self.fallback is None:
+                raise
+            # Not cached: these answers are not the model's
+            logging.error(f"Classification model failed, using keywords: {e}")
+            with metrics.CLASSIFY_SECONDS.time(backend=self.fallback.name):
+                return self.fallback.classify_batch_with_version(texts)
+        if self.cache is not None:
+            for text, (category, version) in zip(texts, results):
+                self.cache.put(version, ClassificationCache.key(text), category)
+        return results
+
+    def classify_batch(self, texts: list) -> list:
+        """Classify many customer issues in one call"""
+        return [category for category, _ in self.classify_batch_with_version(texts)]
+
+    def classify_batch_with_version(self, texts: list) -> list:
+        """Classify many customer issues in one call; returns a (category, version) pair per text"""
+        if not texts:
+            return []
+        version = self._answering_backend().version
+        return classify_cached(self.cache, version, texts, self._classify, store=False, versioned=True)
+
+    def submit_with_version(self, text: str) -> Future:
+        """
+        Classify one issue, batched with concurrent callers; returns a Future
+        resolving to (category, version)
+        """
+        future = Future()
+        if self.cache is not None:
+            version = self._answering_backend().version
+            category = self.cache.get(version, ClassificationCache.key(text))
+            if category is not None:
+                metrics.CLASSIFY_CACHE.inc(result='hit')
+                future.set_result((category, version))
+                return future
+            metrics.CLASSIFY_CACHE.inc(result='miss')
+        if self._batcher is not None:
+            return self._batcher.submit(text)
+        try:
+            future.set_result(self._classify([text])[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def submit(self, text: str) -> Future:
+        """Classify one issue, batched with concurrent callers; returns a Future"""
+        future = Future()
+
+        def done(result):
+            if result.exception() is not None:
+                future.set_exception(result.exception())
+            else:
+                future.set_result(result.result()[0])
+
+        self.submit_with_version(text).add_done_callback(done)
+        return future
+
+    def classify_issue(self, text: str) -> str:
+        """Classify the customer issue into one of the service groups"""
+        return self.classify_with_version(text)[0]
+
+    def classify_with_version(self, text: str) -> tuple:
+        """Classify the customer issue; returns (category, version)"""
+        return self.submit_with_version(text).result()
+
+    @property
+    def queue_depth(self):
+        """Single texts waiting to be micro-batched"""
+        return self._batcher.queue_depth if self._batcher is not None else 0
+
+
+def _unavailable(backend):
+    """Why a backend cannot be loaded, checked without loading it; None if it can be tried"""
+    if not os.path.exists(backend.path):
+        return f"{backend.path} not found"
+    if backend.name == 'transformer':
+        for package in ('torch', 'transformers'):
+            if importlib.util.find_spec(package) is None:
+                return f"{package} is not installed"
+    return None
+
+
+def create_classifier(model=None, model_dir=None, batch_size=None, batch_wait=None):
+    """
+    Build the classifier named by settings.CLASSIFICATION_MODEL
+
+    'keywords' uses the keyword rules alone, 'tfidf' the model trained by
+    train_from_store, and any other name a transformer model directory of
+    that name under model_dir. Only local files are used: a model whose
+    files or packages are missing is never tried, and the keyword rules
+    answer alone. The keyword rules come from settings.RULES_FILE and are
+    reloaded when it changes.
+    """
+    model = model or settings.CLASSIFICATION_MODEL
+    model_dir = model_dir or settings.MODEL_DIR
+    rules_path = settings.RULES_FILE if os.path.exists(settings.RULES_FILE) else None
+    keyword_classifier = IssueClassifier(cache_size=0, rules_path=rules_path)
+    keyword_classifier.watch_rules(settings.RULES_RELOAD_INTERVAL)
+    keywords = KeywordBackend(keyword_classifier)
+    if model == 'keywords':
+        return ModelClassifier(keywords, batch_size=1, cache_size=settings.CLASSIFICATION_CACHE_SIZE)
+    if model == 'tfidf':
+        backend = TfidfBackend(os.path.join(model_dir, 'tfidf.npz'))
+    else:
+        backend = TransformerBackend(os.path.join(model_dir, model))
+    reason = _unavailable(backend)
+    if reason:
+        logging.info(f"Classification model {model} not used ({reason}), classifying with keywords")
+        return ModelClassifier(keywords, batch_size=1, cache_size=settings.CLASSIFICATION_CACHE_SIZE)
+    return ModelClassifier(
+        backend,
+        keywords,
+        batch_size=batch_size or settings.CLASSIFICATION_BATCH_SIZE,
+        batch_wait=settings.CLASSIFICATION_BATCH_WAIT_MS / 1000 if batch_wait is None else batch_wait,
+        cache_size=settings.CLASSIFICATION_CACHE_SIZE
+    )
+
+
+def train_from_store(store, path, **options):
+    """
+    Train a TfidfModel on the resolved tickets in a TicketStore and save it
+
+    Returns:
+        TfidfModel: The trained model
+    """
+    tickets = [ticket for ticket in store.find(status='resolved') if ticket.get('description')]
+    labels = [ticket['category'] for ticket in tickets]
+    if len(set(labels)) < 2:
+        raise ValueError('Need resolved tickets in at least two categories to train')
+    model = TfidfModel.train([ticket['description'] for ticket in tickets], labels, **options)
+    model.save(path)
+    return model
+
+
+if __name__ == '__main__':
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(description='Train the TF-IDF ticket classifier from resolved tickets')
+    parser.add_argument('--backend', default=os.getenv('TICKET_STORE', 'jsonl'), choices=('jsonl', 'sqlite'))
+    parser.add_argument('--output', default=os.path.join(settings.MODEL_DIR, 'tfidf.npz'))
+    args = parser.parse_args()
+
+    store = open_store(
+        args.backend,
+        'requests_db.json',
+        os.getenv('REQUESTS_LOG_FILE', 'requests_db.log.jsonl'),
+        os.getenv('TICKET_DB_FILE', 'tickets.db')
+    )
+    trained = train_from_store(store, args.output)
+    print(f"Trained on {len(trained.categories)} categories, {len(trained.vocabulary)} terms -> {args.output}")
+    store.close()
\ No newline at end of file
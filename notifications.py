@@ -0,0 +1,338 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from scheduling import PRIORITIES, TeamLimits, effective_rank, priority_rank
+
+
+class NotificationQueue:
+    """
+    Persistent outbox of ticket emails delivered by background workers.
+
+    Request handlers only enqueue, which is one local SQLite insert, so
+    response times no longer depend on the mail server. Worker threads claim
+    due emails in batches, send each batch over one pooled SMTP session,
+    retry failures with exponential backoff and move emails that keep
+    failing to a dead-letter state. The outcome of every email is recorded
+    on its ticket under 'notifications'.
+
+    Claims are leases, so several processes can share one outbox file and an
+    email claimed by a process that died is picked up again once its lease
+    runs out.
+
+    Emails carry their ticket's priority and handler team (its category).
+    Workers claim the most urgent due emails first, aged so that each
+    `aging` seconds of waiting counts as one priority level, and stop
+    claiming a team's emails while it is over its rate limit. A flood of
+    low priority tickets therefore cannot hold up an urgent one, and one
+    busy team cannot use up every worker.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER,
+            kind TEXT NOT NULL,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            message TEXT NOT NULL,
+            is_html INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL,
+            lease_until REAL,
+            last_error TEXT,
+            created REAL NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 1,
+            team TEXT,
+            dedup_key TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt);
+    """
+    # Created after outboxes from before priorities have been migrated
+    PRIORITY_INDEX = 'CREATE INDEX IF NOT EXISTS idx_outbox_priority ON outbox (status, priority, id)'
+    DEDUP_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_dedup_key ON outbox (dedup_key)'
+
+    def __init__(self, email_sender, store, path, workers=2, batch_size=20, max_attempts=5,
+                 base_delay=5.0, max_delay=600.0, lease=120.0, poll_interval=5.0, limits=None, aging=300.0):
+        """
+        Args:
+            email_sender (EmailSender): Builds and delivers the emails
+            store (TicketStore): Where delivery status is recorded
+            path (str): SQLite file holding the outbox
+            workers (int): Number of delivery threads
+            batch_size (int): Emails claimed and sent per SMTP session
+            max_attempts (int): Attempts before an email is dead-lettered
+            base_delay (float): Seconds before the first retry; doubles each time
+            max_delay (float): Upper bound on the retry delay
+            lease (float): Seconds a claimed email is reserved for its worker
+            poll_interval (float): Seconds between checks for due retries
+            limits (TeamLimits): Per-team rate limits; None leaves every team unlimited
+            aging (float): Seconds of waiting that raise an email one priority level; 0 for strict priority
+        """
+        self.email_sender = email_sender
+        self.store = store
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.limits = limits or TeamLimits()
+        self.aging = aging
+
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        # Serializes read-modify-write of a ticket's notifications field
+        self._status_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(outbox)')}
+            if 'priority' not in columns:
+                conn.execute('ALTER TABLE outbox ADD COLUMN priority INTEGER NOT NULL DEFAULT 1')
+            if 'team' not in columns:
+                conn.execute('ALTER TABLE outbox ADD COLUMN team TEXT')
+            if 'dedup_key' not in columns:
+                conn.execute('ALTER TABLE outbox ADD COLUMN dedup_key TEXT')
+            conn.execute(self.PRIORITY_INDEX)
+            conn.execute(self.DEDUP_INDEX)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, ticket_id, kind, email, priority=None, team=None, dedup_key=None):
+        """
+        Queue an email for background delivery
+
+        Args:
+            ticket_id (int): Ticket the email is about
+            kind (str): Name the delivery status is recorded under
+            email (tuple): (to_email, subject, message, is_html)
+            priority (str): high, medium or low; defaults to medium
+            team (str): Handler team the email counts against; None is never rate limited
+            dedup_key (str): Identifies the email across repeats, such as an
+                event handled twice; an email already queued under it is kept
+
+        Returns:
+            int: Outbox id of the queued email
+        """
+        to_email, subject, message, is_html = email
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO outbox (ticket_id, kind, to_email, subject, message, is_html, next_attempt, '
+                'created, priority, team, dedup_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (ticket_id, kind, to_email, subject, message, int(is_html), now, now,
+                 priority_rank(priority), team.lower() if team else None, dedup_key)
+            )
+            if not cursor.rowcount:
+                return conn.execute('SELECT id FROM outbox WHERE dedup_key = ?', (dedup_key,)).fetchone()['id']
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def notify_new_ticket(self, ticket, event_id=None):
+        """
+        Queue the user confirmation (if there is a contact email), the admin notice and the team assignment
+
+        An event_id makes this idempotent: the same event queues each email once.
+        """
+        scheduling = {'priority': ticket.get('priority'), 'team': ticket.get('category')}
+
+        def key(kind):
+            return f'event-{event_id}:{kind}' if event_id is not None else None
+
+        confirmation = self.email_sender.ticket_confirmation_email(ticket)
+        if confirmation:
+            self.enqueue(ticket['id'], 'confirmation', confirmation, dedup_key=key('confirmation'), **scheduling)
+        self.enqueue(
+            ticket['id'], 'admin', self.email_sender.admin_new_ticket_email(ticket), dedup_key=key('admin'), **scheduling
+        )
+        assignment = self.email_sender.handler_new_ticket_email(ticket)
+        if assignment:
+            self.enqueue(ticket['id'], 'handler', assignment, dedup_key=key('handler'), **scheduling)
+
+    def notify_resolved(self, ticket, resolution_notes="", event_id=None):
+        """Queue the resolution notice (if there is a contact email); event_id makes it idempotent"""
+        email = self.email_sender.resolution_email(ticket, resolution_notes)
+        if email:
+            self.enqueue(
+                ticket['id'], 'resolution', email, priority=ticket.get('priority'), team=ticket.get('category'),
+                dedup_key=f'event-{event_id}:resolution' if event_id is not None else None
+            )
+
+    def _claim(self):
+        """Reserve up to batch_size due emails for this worker, most urgent first"""
+        now = time.time()
+        # Teams over their limit are left out of the query, so their backlog
+        # does not crowd other teams' emails out of the batch
+        blocked = list(self.limits.blocked())
+        excluded = f" AND COALESCE(team, '') NOT IN ({', '.join('?' * len(blocked))})" if blocked else ''
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Emails whose worker died were already due, so they go first
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'sending' AND lease_until <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size)
+            ).fetchall()
+            # The oldest due emails of each priority are the most aged ones,
+            # so the best batch is among the first batch_size of every level
+            candidates = []
+            for rank in range(len(PRIORITIES)):
+                candidates.extend(conn.execute(
+                    f"SELECT * FROM outbox WHERE status = 'pending' AND priority = ? AND next_attempt <= ?{excluded} "
+                    "ORDER BY id LIMIT ?",
+                    (rank, now, *blocked, self.batch_size)
+                ).fetchall())
+            candidates.sort(key=lambda row: (effective_rank(row['priority'], now - row['created'], self.aging), row['id']))
+            for row in candidates:
+                if len(rows) >= self.batch_size:
+                    break
+                if self.limits.take(row['team']):
+                    rows.append(row)
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + self.lease, row['id']) for row in rows]
+            )
+        return rows
+
+    def _retry_delay(self, attempts):
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        # Jitter so a burst of failures does not retry in lockstep
+        return delay * random.uniform(0.5, 1.0)
+
+    def _deliver(self, rows):
+        errors = self.email_sender.deliver([
+            (row['to_email'], row['subject'], row['message'], bool(row['is_html'])) for row in rows
+        ])
+        now = time.time()
+        outcomes = []
+        with self._connection() as conn:
+            for row, error in zip(rows, errors):
+                attempts = row['attempts'] + 1
+                if error is None:
+                    status = 'sent'
+                    conn.execute("UPDATE outbox SET status = 'sent', last_error = NULL WHERE id = ?", (row['id'],))
+                elif attempts >= self.max_attempts:
+                    status = 'dead'
+                    conn.execute(
+                        "UPDATE outbox SET status = 'dead', last_error = ? WHERE id = ?",
+                        (str(error), row['id'])
+                    )
+                else:
+                    status = 'retrying'
+                    conn.execute(
+                        "UPDATE outbox SET status = 'pending', next_attempt = ?, last_error = ? WHERE id = ?",
+                        (now + self._retry_delay(attempts), str(error), row['id'])
+                    )
+                outcomes.append((row, status, attempts, error))
+        for row, status, attempts, error in outcomes:
+            self._record(row, status, attempts, error)
+
+    def _record(self, row, status, attempts, error):
+        """Store the delivery status on the ticket"""
+        if row['ticket_id'] is None:
+            return
+        with self._status_lock:
+            ticket = self.store.get(row['ticket_id'])
+            if ticket is None:
+                return
+            notifications = dict(ticket.get('notifications') or {})
+            notifications[row['kind']] = {
+                'status': status,
+                'attempts': attempts,
+                'error': None if error is None else str(error)
+            }
+            # Not a change clients need to sync, so the ticket keeps its
+            # revision and list pages stay cached while emails are retried
+            self.store.update(row['ticket_id'], {'notifications': notifications}, touch=False)
+
+    def deliver_due(self):
+        """
+        Claim one batch of due emails and send it, as a worker does
+
+        Returns:
+            int: Number of emails claimed
+        """
+        rows = self._claim()
+        if rows:
+            self._deliver(rows)
+        return len(rows)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.deliver_due():
+                    continue
+            except Exception as e:
+                logging.exception(f"Notification worker error: {e}")
+            # Come back as soon as a rate limited team may send again
+            self._wakeup.wait(min([*self.limits.blocked().values(), self.poll_interval]))
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the delivery threads"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'notification-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the delivery threads; queued emails stay in the outbox"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        """Number of outbox emails per status"""
+        rows = self._connection().execute('SELECT status, COUNT(*) AS count FROM outbox GROUP BY status')
+        return {row['status']: row['count'] for row in rows}
+
+    def backlog(self):
+        """Emails waiting to be sent, per priority and team, plus the rate limiting state"""
+        rows = self._connection().execute(
+            "SELECT priority, COALESCE(team, '') AS team, COUNT(*) AS count FROM outbox "
+            "WHERE status = 'pending' GROUP BY priority, team"
+        )
+        pending = {}
+        for row in rows:
+            priority = PRIORITIES[row['priority']] if 0 <= row['priority'] < len(PRIORITIES) else str(row['priority'])
+            pending.setdefault(priority, {})[row['team'] or 'none'] = row['count']
+        return {'pending': pending, **self.limits.stats()}
+
+    def dead_letters(self, limit=100):
+        """Emails that exhausted their attempts, newest first"""
+        rows = self._connection().execute(
+            "SELECT id, ticket_id, kind, to_email, subject, attempts, last_error FROM outbox "
+            "WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def requeue(self, outbox_id):
+        """Give a dead-lettered email a fresh set of attempts"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt = ? "
+                "WHERE id = ? AND status = 'dead'",
+                (time.time(), outbox_id)
+            )
+        self._wakeup.set()
+        return cursor.rowcount == 1
\ No newline at end of file
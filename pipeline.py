@@ -0,0 +1,368 @@
+import logging
+import queue
+import re
+import threading
+import time
+from html.parser import HTMLParser
+
+import metrics
+
+# Reply attribution lines; everything below them is the quoted thread
+_REPLY_HEADER = re.compile(
+    r'^(?:On\b.{0,200}?\bwrote:|-{2,}\s*Original Message\s*-{2,})\s*$',
+    re.IGNORECASE | re.MULTILINE | re.DOTALL
+)
+_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML body, minus quoted blocks"""
+
+    SKIP = {'script', 'style', 'head', 'blockquote'}
+    BREAKS = {'br', 'p', 'div', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BREAKS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Visible text of an HTML email body, without quoted replies"""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ''.join(extractor.parts)
+
+
+def strip_quoted(text):
+    """Drop the quoted thread of a plain text reply, keeping only the new message"""
+    match = _REPLY_HEADER.search(text)
+    if match:
+        text = text[:match.start()]
+    lines = [line.rstrip() for line in text.splitlines() if not line.lstrip().startswith('>')]
+    return _BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def clean_email_text(text, html=''):
+    """
+    The part of an email worth classifying
+
+    Args:
+        text (str): Plain text body, may be empty
+        html (str): HTML body, used when there is no plain text part
+
+    Returns:
+        str: The new message without quoted replies or markup
+    """
+    if not text.strip() and html:
+        text = html_to_text(html)
+    return strip_quoted(text)
+
+
+class EmailItem:
+    """One email moving through the pipeline"""
+
+    __slots__ = (
+        'uid', 'message', 'text', 'category', 'classifier_version', 'result', 'fingerprint', 'duplicate_of', 'duplicates'
+    )
+
+    def __init__(self, uid, message):
+        self.uid = uid
+        self.message = message
+        self.text = None
+        self.category = None
+        # Rules or model version the category came from
+        self.classifier_version = None
+        self.result = None
+        self.fingerprint = None
+        self.duplicate_of = None
+        # Repeats that arrived while this email was still in flight
+        self.duplicates = []
+
+
+class Stage:
+    """
+    A pool of workers reading from one bounded queue
+
+    A full queue blocks the stage before it, so a slow stage throttles the
+    whole pipeline instead of letting work pile up in memory.
+    """
+
+    def __init__(self, name, func, workers=1, batch_size=1, queue_size=100):
+        """
+        Args:
+            name (str): Name used in metrics
+            func (callable): Called with a list of at most batch_size items; may
+                return the subset to pass on, otherwise all of them move on
+            workers (int): Number of threads running func
+            batch_size (int): Most queued items handed to func at once
+            queue_size (int): Most items waiting for this stage
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Block for the next item, then take whatever else is already waiting"""
+        items = [self.queue.get()]
+        while len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def record(self, count, failed, seconds):
+        metrics.EMAIL_STAGE_SECONDS.observe(seconds, stage=self.name)
+        with self._lock:
+            self.processed += count
+            self.failed += failed
+            self.busy_seconds += seconds
+
+    def metrics(self, uptime):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'processed': self.processed,
+                'failed': self.failed,
+                'per_second': round(self.processed / uptime, 2) if uptime else 0.0,
+                'busy_seconds': round(self.busy_seconds, 3)
+            }
+
+
+class EmailPipeline:
+    """
+    Turns fetched emails into tickets in stages: parse, dedup, classify, persist.
+
+    Stages run on their own worker threads with bounded queues in between.
+    With a Deduplicator, repeats of a recent ticket are merged into it right
+    after parsing and never reach the classifier or the store; a repeat of an
+    email that is still in flight waits for it and shares its outcome.
+    Each email stays pending from submit until the fetcher has acknowledged
+    it on the server, which only happens after it was persisted; pending
+    UIDs are never submitted twice, so a reconnect does not create a
+    second ticket for a message that was stored but not yet marked read.
+    """
+
+    def __init__(self, classify, persist, dedup=None, merge=None, parse_workers=2, classify_workers=1,
+                 persist_workers=1, classify_batch=32, queue_size=100, max_in_flight=None):
+        """
+        Args:
+            classify (callable): List of texts -> list of (category, version) pairs
+            persist (callable): Stores one classified EmailItem, returns the stored record
+            dedup (Deduplicator): Merges repeats into recent tickets; None disables it
+            merge (callable): Called with each repeat EmailItem, whose duplicate_of
+                is the stored record it was merged into
+            parse_workers (int): Threads cleaning up message bodies
+            classify_workers (int): Threads classifying
+            persist_workers (int): Threads persisting
+            classify_batch (int): Most texts classified in one call
+            queue_size (int): Capacity of each queue between stages
+            max_in_flight (int): Most unacknowledged emails; defaults to queue_size
+        """
+        self.classify = classify
+        self.persist = persist
+        self.dedup = dedup
+        self.merge = merge
+        self.max_in_flight = max_in_flight or queue_size
+        self.duplicates = 0
+        self.stages = [
+            Stage('parse', self._parse, parse_workers, queue_size=queue_size),
+            Stage('dedup', self._dedup, queue_size=queue_size),
+            Stage('classify', self._classify, classify_workers, classify_batch, queue_size),
+            Stage('persist', self._persist, persist_workers, queue_size=queue_size),
+        ]
+
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._persisted = set()
+        self._failed = set()
+        self._progress = threading.Event()
+        self._threads = []
+        self._started = None
+
+    def _parse(self, items):
+        for item in items:
+            item.text = clean_email_text(item.message.text or '', item.message.html or '')
+
+    def _dedup(self, items):
+        if self.dedup is None:
+            return None
+        fresh = []
+        for item in items:
+            item.fingerprint = self.dedup.fingerprint(item.text, item.message.from_)
+            with self._lock:
+                original = self.dedup.claim(item.fingerprint, item)
+                if isinstance(original, EmailItem):
+                    original.duplicates.append(item)
+                    continue
+            if original is None:
+                fresh.append(item)
+            else:
+                self._merge(item, original)
+        return fresh
+
+    def _merge(self, item, original):
+        item.duplicate_of = original
+        if self.merge is not None:
+            self.merge(item)
+        with self._lock:
+            self.duplicates += 1
+            self._persisted.add(item.uid)
+        metrics.IMAP_MESSAGES.inc(event='merged')
+        self._progress.set()
+
+    def _classify(self, items):
+        for item, (category, version) in zip(items, self.classify([item.text for item in items])):
+            item.category, item.classifier_version = category, version
+
+    def _persist(self, items):
+        for item in items:
+            item.result = self.persist(item)
+            with self._lock:
+                self._persisted.add(item.uid)
+                if item.fingerprint is not None:
+                    # Later repeats now merge into the stored record
+                    self.dedup.add(item.fingerprint, item.result)
+                duplicates, item.duplicates = item.duplicates, []
+            metrics.IMAP_MESSAGES.inc(event='processed')
+            for duplicate in duplicates:
+                self._merge(duplicate, item.result)
+            self._progress.set()
+
+    def _fail(self, items):
+        items = list(items)
+        with self._lock:
+            failed = []
+            while items:
+                item = items.pop()
+                failed.append(item)
+                if item.fingerprint is not None:
+                    self.dedup.discard(item.fingerprint, item)
+                # Repeats waiting on a failed email are fetched again with it
+                items.extend(item.duplicates)
+                item.duplicates = []
+            for item in failed:
+                self._pending.discard(item.uid)
+                self._failed.add(item.uid)
+        metrics.IMAP_MESSAGES.inc(len(failed), event='failed')
+        self._progress.set()
+
+    def _work(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            items = stage.take()
+            started = time.perf_counter()
+            try:
+                forward = stage.func(items)
+            except Exception as e:
+                logging.error(f"Error in email {stage.name} stage: {e}")
+                with self._lock:
+                    done = [item for item in items if item.uid in self._persisted]
+                self._fail([item for item in items if item not in done])
+                stage.record(len(done), len(items) - len(done), time.perf_counter() - started)
+                continue
+            stage.record(len(items), 0, time.perf_counter() - started)
+            if following is not None:
+                for item in items if forward is None else forward:
+                    following.queue.put(item)
+
+    def start(self):
+        """Start the stage workers"""
+        if self._threads:
+            return
+        self._started = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(index,), name=f'email-{stage.name}-{worker}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def capacity(self):
+        """How many more emails can be submitted without exceeding max_in_flight"""
+        with self._lock:
+            return max(0, self.max_in_flight - len(self._pending))
+
+    def is_pending(self, uid):
+        with self._lock:
+            return uid in self._pending
+
+    def submit(self, uid, message):
+        """Queue one fetched email; blocks while the parse stage is full"""
+        with self._lock:
+            if uid in self._pending:
+                return
+            self._pending.add(uid)
+        self.stages[0].queue.put(EmailItem(uid, message))
+
+    def persisted(self):
+        """UIDs stored as tickets but not yet acknowledged on the server"""
+        with self._lock:
+            return sorted(self._persisted, key=int)
+
+    def acknowledge(self, uids):
+        """Forget UIDs the fetcher has marked read on the server"""
+        with self._lock:
+            for uid in uids:
+                self._persisted.discard(uid)
+                self._pending.discard(uid)
+
+    def take_failed(self):
+        """UIDs that failed a stage since the last call; they need fetching again"""
+        with self._lock:
+            failed, self._failed = self._failed, set()
+        return failed
+
+    @property
+    def in_flight(self):
+        """Number of submitted emails not yet persisted or failed"""
+        with self._lock:
+            return len(self._pending) - len(self._persisted)
+
+    def wait(self, timeout):
+        """Block until an email is persisted or fails, or the timeout expires"""
+        self._progress.wait(timeout)
+        self._progress.clear()
+
+    def metrics(self):
+        """Per-stage queue depth, throughput and failures"""
+        uptime = time.monotonic() - self._started if self._started else 0.0
+        with self._lock:
+            pending, persisted = len(self._pending), len(self._persisted)
+            duplicates = self.duplicates
+        metrics = {
+            'in_flight': pending - persisted,
+            'awaiting_ack': persisted,
+            'duplicates': duplicates,
+            'stages': {stage.name: stage.metrics(uptime) for stage in self.stages}
+        }
+        if self.dedup is not None:
+            metrics['dedup'] = self.dedup.stats()
+        return metrics
\ No newline at end of file
@@ -0,0 +1,136 @@
+import threading
+import time
+
+# Ticket priorities, most urgent first
+PRIORITIES = ('high', 'medium', 'low')
+_RANKS = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+
+def priority_rank(priority):
+    """0 for high, 1 for medium, 2 for low; unknown priorities count as medium"""
+    return _RANKS.get((priority or '').lower(), _RANKS['medium'])
+
+
+def effective_rank(rank, waited, aging):
+    """
+    Rank after aging: every `aging` seconds of waiting is worth one priority
+    level, so a flood of urgent work delays the rest but never starves it
+
+    Args:
+        rank (int): priority_rank of the item
+        waited (float): Seconds since the item was queued
+        aging (float): Seconds of waiting per level; 0 means strict priority
+    """
+    return rank - waited / aging if aging else rank
+
+
+def parse_rates(spec):
+    """
+    Per-team rates from a setting like "security=120,billing=30"
+
+    Returns:
+        dict: team -> rate
+    """
+    rates = {}
+    for entry in (spec or '').split(','):
+        team, _, rate = entry.partition('=')
+        if team.strip() and rate.strip():
+            rates[team.strip().lower()] = float(rate)
+    return rates
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, in bursts of up to `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """Use up one token if there is one"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now=None):
+        """Seconds until the next token is available"""
+        self._refill(time.monotonic() if now is None else now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class TeamLimits:
+    """
+    Token buckets limiting how fast work is dispatched to each handler team
+
+    Rates are per minute. Teams without a rate of their own use the default
+    rate; a rate of 0 leaves a team unlimited. Buckets live in this process,
+    so with several processes each one applies the limits on its own.
+    """
+
+    def __init__(self, rates=None, default_rate=0, burst=None):
+        """
+        Args:
+            rates (dict): team -> dispatches per minute
+            default_rate (float): Dispatches per minute for other teams
+            burst (int): Dispatches allowed back to back; defaults to a second's worth, at least 1
+        """
+        self.rates = {team.lower(): rate for team, rate in (rates or {}).items()}
+        self.default_rate = default_rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def _bucket(self, team):
+        team = (team or '').lower()
+        if team not in self._buckets:
+            rate = self.rates.get(team, self.default_rate)
+            self._buckets[team] = TokenBucket(rate / 60.0, self.burst) if rate else None
+        return self._buckets[team]
+
+    def take(self, team):
+        """Use up one of the team's dispatches; False if it is over its limit"""
+        with self._lock:
+            bucket = self._bucket(team)
+            if bucket is None or bucket.take():
+                return True
+            self.throttled += 1
+            return False
+
+    def blocked(self, teams=None):
+        """
+        Teams currently out of dispatches, with the seconds until each may go again
+
+        Args:
+            teams (iterable): Teams to check; defaults to every team seen so far
+        """
+        now = time.monotonic()
+        with self._lock:
+            names = self._buckets if teams is None else {(team or '').lower() for team in teams}
+            delays = {}
+            for team in names:
+                bucket = self._bucket(team)
+                if bucket is not None:
+                    delay = bucket.delay(now)
+                    if delay:
+                        delays[team] = delay
+            return delays
+
+    def stats(self):
+        with self._lock:
+            return {
+                'throttled': self.throttled,
+                'tokens': {
+                    team: round(bucket.tokens, 2) for team, bucket in self._buckets.items() if bucket is not None
+                }
+            }
@@ -0,0 +1,153 @@
+import bisect
+import math
+import re
+from array import array
+from collections import Counter
+
+from startup import lazy_import
+
+# Loaded on the first search rather than when the app starts
+np = lazy_import('numpy')
+
+_TERM = re.compile(r'\w+')
+
+# Fields searched, in both store backends
+SEARCH_FIELDS = ('description', 'resolution_notes')
+
+
+def search_terms(text):
+    """Lowercase words of a text, as they are indexed and queried"""
+    return _TERM.findall(text.lower()) if text else []
+
+
+def ticket_text(ticket):
+    """The searchable text of a ticket"""
+    return '\n'.join(ticket.get(field) or '' for field in SEARCH_FIELDS)
+
+
+class TextIndex:
+    """
+    In-memory inverted index ranking documents with BM25.
+
+    Each term maps to the ascending ids of the documents containing it and
+    how often it occurs there, in compact arrays (6 bytes per posting), so a
+    million tickets fit in a few hundred megabytes. A query intersects the
+    posting lists of its terms starting from the rarest and scores the
+    survivors with NumPy, so its cost follows the rarest term rather than
+    the number of documents.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        # term -> (document ids, term frequencies), both ascending by id
+        self.postings = {}
+        # Indexed length of each document, by id
+        self.lengths = array('I')
+        self.documents = 0
+        self.total_length = 0
+
+    def add(self, doc_id, text):
+        """Index a document that is not in the index yet"""
+        terms = Counter(search_terms(text))
+        if not terms:
+            return
+        if len(self.lengths) <= doc_id:
+            self.lengths.extend([0] * (doc_id + 1 - len(self.lengths)))
+        length = sum(terms.values())
+        self.lengths[doc_id] = length
+        self.documents += 1
+        self.total_length += length
+        for term, count in terms.items():
+            ids, frequencies = self.postings.setdefault(term, (array('I'), array('H')))
+            if not ids or ids[-1] < doc_id:
+                ids.append(doc_id)
+                frequencies.append(min(count, 0xFFFF))
+            else:
+                position = bisect.bisect_left(ids, doc_id)
+                ids.insert(position, doc_id)
+                frequencies.insert(position, min(count, 0xFFFF))
+
+    def remove(self, doc_id, text):
+        """Drop a document, given the text it was indexed with"""
+        terms = set(search_terms(text))
+        if not terms:
+            return
+        for term in terms:
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            ids, frequencies = entry
+            position = bisect.bisect_left(ids, doc_id)
+            if position < len(ids) and ids[position] == doc_id:
+                del ids[position]
+                del frequencies[position]
+                if not ids:
+                    del self.postings[term]
+        self.documents -= 1
+        self.total_length -= self.lengths[doc_id]
+        self.lengths[doc_id] = 0
+
+    def snapshot(self, query):
+        """
+        Copy what ranking the query needs, so documents can be added and
+        removed while it is ranked
+
+        Only the posting lists of the query's terms are copied, plus the
+        lengths of the documents containing the rarest term, so the cost
+        follows the rarest term like the ranking itself.
+
+        Returns:
+            tuple: (documents, total length, [(ids, frequencies)] rarest term
+                first, lengths of the rarest term's documents), or None when
+                no document contains every term
+        """
+        terms = list(dict.fromkeys(search_terms(query)))
+        entries = [self.postings.get(term) for term in terms]
+        if not terms or any(entry is None for entry in entries):
+            return None
+        entries.sort(key=lambda entry: len(entry[0]))
+        entries = [
+            (np.frombuffer(ids, dtype=np.uint32).copy(), np.frombuffer(frequencies, dtype=np.uint16).astype(np.float64))
+            for ids, frequencies in entries
+        ]
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)[entries[0][0]]
+        return self.documents, self.total_length, entries, lengths
+
+    def rank(self, snapshot):
+        """
+        Score the documents of a snapshot() with BM25
+
+        Returns:
+            tuple: (ids, scores) NumPy arrays in id order
+        """
+        if snapshot is None:
+            return np.empty(0, dtype=np.uint32), np.empty(0)
+        documents, total_length, entries, lengths = snapshot
+        average_length = total_length / documents
+        ids = None
+        scores = None
+        for term_ids, frequencies in entries:
+            idf = math.log(1 + (documents - len(term_ids) + 0.5) / (len(term_ids) + 0.5))
+            if ids is None:
+                ids, scores = term_ids, np.zeros(len(term_ids))
+            else:
+                ids, kept, matched = np.intersect1d(ids, term_ids, assume_unique=True, return_indices=True)
+                scores = scores[kept]
+                lengths = lengths[kept]
+                frequencies = frequencies[matched]
+                if not len(ids):
+                    break
+            norm = self.K1 * (1 - self.B + self.B * lengths / average_length)
+            scores += idf * frequencies * (self.K1 + 1) / (frequencies + norm)
+        return ids, scores
+
+    def search(self, query):
+        """
+        Documents containing every term of the query
+
+        Returns:
+            tuple: (ids, scores) NumPy arrays in id order
+        """
+        return self.rank(self.snapshot(query))
@@ -0,0 +1,350 @@
+import bisect
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from operator import attrgetter
+from types import MappingProxyType
+
+
+class ServiceRequest:
+    """One request handled by the API; slots keep each one to a fixed, small size"""
+
+    __slots__ = ('id', 'timestamp', 'text', 'source', 'category', 'priority', 'status',
+                 'contact_email', 'classifier_version', 'duplicates', 'last_duplicate')
+
+    FIELDS = __slots__
+
+    def __init__(self, id, timestamp, text, source, category, priority='medium', status='open',
+                 contact_email=None, classifier_version=None, duplicates=0, last_duplicate=None):
+        self.id = id
+        self.timestamp = timestamp
+        self.text = text
+        # Few distinct values, so every request shares the same string objects
+        self.source = sys.intern(source)
+        self.category = sys.intern(category)
+        self.priority = sys.intern(priority or 'medium')
+        self.status = sys.intern(status)
+        self.contact_email = contact_email
+        self.classifier_version = sys.intern(classifier_version) if classifier_version else None
+        # Repeats merged into this request, and when the last one arrived
+        self.duplicates = duplicates or 0
+        self.last_duplicate = last_duplicate
+
+    def to_row(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'text': self.text,
+            'source': self.source,
+            'category': self.category,
+            'priority': self.priority,
+            'status': self.status,
+            'contact_email': self.contact_email,
+            'classifier_version': self.classifier_version,
+            'duplicates': self.duplicates,
+            'last_duplicate': datetime.fromtimestamp(self.last_duplicate).isoformat() if self.last_duplicate else None
+        }
+
+
+class RequestArchive:
+    """SQLite table holding requests evicted from memory"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            text TEXT NOT NULL,
+            source TEXT,
+            category TEXT,
+            priority TEXT,
+            status TEXT,
+            contact_email TEXT,
+            classifier_version TEXT,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            last_duplicate REAL
+        );
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): SQLite database file
+        """
+        self.path = path
+        # One connection per thread; sqlite3 connections are not thread-safe
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(requests)')]
+            if 'duplicates' not in columns:
+                # Archives written before repeats were counted
+                conn.execute('ALTER TABLE requests ADD COLUMN duplicates INTEGER NOT NULL DEFAULT 0')
+                conn.execute('ALTER TABLE requests ADD COLUMN last_duplicate REAL')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def save(self, requests):
+        with self._connection() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO requests ({', '.join(ServiceRequest.FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(ServiceRequest.FIELDS))})",
+                [request.to_row() for request in requests]
+            )
+
+    def get(self, request_id):
+        row = self._connection().execute(
+            f"SELECT {', '.join(ServiceRequest.FIELDS)} FROM requests WHERE id = ?", (request_id,)
+        ).fetchone()
+        return ServiceRequest(*row) if row else None
+
+    def newest(self, limit):
+        """The newest archived requests, oldest first"""
+        rows = self._connection().execute(
+            f"SELECT {', '.join(ServiceRequest.FIELDS)} FROM requests ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [ServiceRequest(*row) for row in reversed(rows)]
+
+    def record_duplicate(self, request_id, timestamp, duplicates=None):
+        """Count a repeat of an archived request, or set the count when given"""
+        with self._connection() as conn:
+            conn.execute(
+                'UPDATE requests SET duplicates = COALESCE(?, duplicates + 1), last_duplicate = ? WHERE id = ?',
+                (duplicates, timestamp, request_id)
+            )
+
+    def last_id(self):
+        return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM requests').fetchone()[0]
+
+
+class ServiceRequestHandler:
+    """
+    In-memory store of the requests handled by the API.
+
+    Ids are allocated from a counter under a lock together with the
+    timestamp, so id order is creation order and a list of the live requests
+    in id order doubles as the time index: recent() bisects into it and
+    walks backwards instead of sorting. Per-field lists of the same shape
+    answer filtered queries without visiting non-matching requests.
+    Creation never awaits and holds the lock only briefly, so it is safe
+    from the event loop and from worker threads alike.
+
+    At most max_requests stay in memory. Beyond that the oldest are moved to
+    a SQLite archive in batches by a background thread, where get_request
+    still finds them. On close the live requests are archived too, and the
+    newest of them are loaded back on the next start.
+    """
+
+    INDEXED_FIELDS = ('status', 'category', 'priority', 'source')
+    # Requests examined per lock acquisition in recent()
+    SCAN_CHUNK = 1000
+
+    def __init__(self, max_requests=200000, archive_path=None, evict_batch=None):
+        """
+        Args:
+            max_requests (int): Most requests kept in memory
+            archive_path (str): SQLite file for evicted requests; None drops them
+            evict_batch (int): Requests moved out per eviction; defaults to 5% of max_requests
+        """
+        self.max_requests = max_requests
+        self.evict_batch = evict_batch or max(1, max_requests // 20)
+        self.archive = RequestArchive(archive_path) if archive_path else None
+
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._timeline = []  # Live requests in id (= creation) order
+        # field -> value -> live requests with that value, in id order
+        self._by_field = {field: {} for field in self.INDEXED_FIELDS}
+        self._next_id = 1
+        # Highest id the evictor has started copying to the archive, and a
+        # lock so repeat counts of those requests are not overwritten by the copy
+        self._evicting_upto = 0
+        self._archive_lock = threading.Lock()
+        self._evict_needed = threading.Event()
+        self._evictor = None
+        self.evicted = 0
+
+        if self.archive is not None:
+            self._next_id = self.archive.last_id() + 1
+            for request in self.archive.newest(max_requests // 2):
+                self._add(request)
+
+    def _add(self, request):
+        self._by_id[request.id] = request
+        self._timeline.append(request)
+        for field, index in self._by_field.items():
+            index.setdefault(getattr(request, field), []).append(request)
+
+    @property
+    def requests(self):
+        """Read-only view of the live requests by id; use recent() to query them"""
+        return MappingProxyType(self._by_id)
+
+    def __len__(self):
+        return len(self._timeline)
+
+    def create_request(self, text, category, source, priority='medium', contact_email=None,
+                       classifier_version=None):
+        """
+        Store a new request
+
+        Args:
+            text (str): The issue as submitted
+            category (str): Service group it was classified into
+            source (str): Where it came from, e.g. web or email
+            priority (str): low, medium or high
+            contact_email (str): Address for updates, if any
+            classifier_version (str): Rules or model version the category came from
+
+        Returns:
+            ServiceRequest: The stored request
+        """
+        with self._lock:
+            request = ServiceRequest(
+                self._next_id, time.time(), text, source, category, priority,
+                contact_email=contact_email, classifier_version=classifier_version
+            )
+            self._next_id += 1
+            self._add(request)
+            full = len(self._timeline) > self.max_requests
+        if full:
+            self._start_eviction()
+        return request
+
+    def get_request(self, request_id):
+        """Return the request with this id from memory or the archive, or None"""
+        try:
+            request_id = int(request_id)
+        except (TypeError, ValueError):
+            return None
+        request = self._by_id.get(request_id)
+        if request is None and self.archive is not None:
+            request = self.archive.get(request_id)
+        return request
+
+    def record_duplicate(self, request_id):
+        """
+        Count a repeat that was merged into a request instead of stored
+
+        Args:
+            request_id (int): The original request
+
+        Returns:
+            ServiceRequest: The updated request, or None if there is none with that id
+        """
+        now = time.time()
+        with self._lock:
+            request = self._by_id.get(request_id)
+            if request is not None:
+                request.duplicates += 1
+                request.last_duplicate = now
+                duplicates = request.duplicates
+                # The evictor may already have copied the old count
+                archived = request_id <= self._evicting_upto
+        if self.archive is None:
+            return request
+        if request is None:
+            self.archive.record_duplicate(request_id, now)
+            return self.archive.get(request_id)
+        if archived:
+            with self._archive_lock:
+                self.archive.record_duplicate(request_id, now, duplicates)
+        return request
+
+    def recent(self, limit, before_id=None, after_id=None, status=None, category=None, priority=None):
+        """
+        Newest live requests first, matching every given filter
+
+        Args:
+            limit (int): Return at most this many requests
+            before_id (int): Only requests with a smaller id
+            after_id (int): Only requests with a greater id
+            status, category, priority (str): Exact-match filters
+        """
+        filters = {'status': status, 'category': category, 'priority': priority}
+        filters = [(field, value) for field, value in filters.items() if value is not None]
+        key = attrgetter('id')
+        page = []
+        while len(page) < limit:
+            # A chunk at a time, so a long scan never holds up creation
+            with self._lock:
+                sequence = min(
+                    (self._by_field[field].get(value, []) for field, value in filters),
+                    key=len,
+                    default=self._timeline
+                )
+                stop = bisect.bisect_left(sequence, before_id, key=key) if before_id is not None else len(sequence)
+                start = bisect.bisect_right(sequence, after_id, key=key) if after_id is not None else 0
+                chunk = sequence[max(start, stop - self.SCAN_CHUNK):stop]
+            if not chunk:
+                break
+            for request in reversed(chunk):
+                if all(getattr(request, field) == value for field, value in filters):
+                    page.append(request)
+                    if len(page) == limit:
+                        break
+            before_id = chunk[0].id
+        return page
+
+    def _start_eviction(self):
+        self._evict_needed.set()
+        if self._evictor is None:
+            with self._lock:
+                if self._evictor is None:
+                    self._evictor = threading.Thread(target=self._run_evictor, name='request-evictor', daemon=True)
+                    self._evictor.start()
+
+    def _run_evictor(self):
+        while True:
+            self._evict_needed.wait()
+            self._evict_needed.clear()
+            try:
+                self._evict()
+            except Exception as e:
+                logging.error(f"Error archiving service requests: {e}")
+                time.sleep(1)
+                self._evict_needed.set()
+
+    def _evict(self):
+        """Move the oldest requests to the archive until back under max_requests"""
+        while len(self._timeline) > self.max_requests:
+            with self._lock:
+                count = max(len(self._timeline) - self.max_requests, self.evict_batch)
+                oldest = self._timeline[:count]
+                self._evicting_upto = oldest[-1].id
+            # Written before they leave memory, so get_request always finds them
+            if self.archive is not None:
+                with self._archive_lock:
+                    self.archive.save(oldest)
+            key = attrgetter('id')
+            with self._lock:
+                del self._timeline[:count]
+                for request in oldest:
+                    del self._by_id[request.id]
+                for index in self._by_field.values():
+                    for value, requests in list(index.items()):
+                        del requests[:bisect.bisect_right(requests, oldest[-1].id, key=key)]
+                        if not requests:
+                            del index[value]
+                self.evicted += count
+
+    def stats(self):
+        return {'live': len(self._timeline), 'evicted': self.evicted, 'next_id': self._next_id}
+
+    def close(self):
+        """Archive every live request so the next start picks up where this one left off"""
+        if self.archive is not None:
+            with self._lock:
+                self.archive.save(self._timeline)
@@ -0,0 +1,208 @@
+"""
+Fast cold start: lazy imports, objects built on first use, and a profile of
+where startup time goes.
+
+    python startup.py app        # import-time profile of the Flask app
+    python startup.py main --top 30
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Set to false to build everything at import, as before
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'true').lower() != 'false'
+
+
+def lazy_import(name):
+    """
+    A module whose code runs on first attribute access instead of now
+
+    Falls back to a normal import when the module is already loaded or
+    LAZY_STARTUP is off.
+    """
+    if name in sys.modules or not LAZY_STARTUP:
+        return importlib.import_module(name)
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+class StartupProfile:
+    """Wall time of each startup phase, in the order they finished"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self.phases[name] = {
+                    'seconds': round(seconds, 4),
+                    # Since the profile was created, usually at import
+                    'finished_at': round(time.perf_counter() - self.started, 4),
+                    'thread': threading.current_thread().name
+                }
+            logging.info(f"Startup: {name} took {seconds * 1000:.1f} ms")
+
+    def report(self):
+        with self._lock:
+            return {'uptime_seconds': round(time.perf_counter() - self.started, 4), 'phases': dict(self.phases)}
+
+
+profile = StartupProfile()
+
+
+class Deferred:
+    """
+    An object built on first use rather than at import
+
+    Attribute access is forwarded to the built object, so a Deferred stands
+    in for it wherever only attributes and methods are used. warm_up() builds
+    it on a background thread ahead of the first request that needs it;
+    that request then waits for the build instead of starting another.
+    """
+
+    def __init__(self, name, factory):
+        """
+        Args:
+            name (str): Phase name in the startup profile
+            factory (callable): Builds the object, called once
+        """
+        self._name = name
+        self._factory = factory
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        if not LAZY_STARTUP:
+            self.build()
+
+    def _reset(self):
+        # A forked child rebuilds its own copy: threads the object started
+        # and connections it opened belong to the parent
+        self._value = None
+        self._built = threading.Event()
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Build the object now, or wait for the build in progress, and return it"""
+        if self._built.is_set():
+            return self._value
+        with self._lock:
+            if not self._built.is_set():
+                with profile.phase(self._name):
+                    self._value = self._factory()
+                self._built.set()
+        return self._value
+
+    @property
+    def is_built(self):
+        return self._built.is_set()
+
+    def warm_up(self):
+        """Start building on a background thread"""
+        if not self._built.is_set():
+            threading.Thread(target=self.build, name=f'warm-up-{self._name}', daemon=True).start()
+
+    def __getattr__(self, attribute):
+        # Only called for attributes Deferred itself does not have
+        return getattr(self.build(), attribute)
+
+
+class ProcessStart:
+    """
+    Runs start-up work once in each process, on its first request
+
+    Threads do not survive fork, so background workers started while a
+    module is imported are lost in the workers of a preloading server such
+    as `gunicorn --preload`. Registering them here instead starts them in
+    whichever process actually serves requests.
+    """
+
+    def __init__(self):
+        self._hooks = []
+        self._pid = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def register(self, func):
+        """Decorator adding a start-up hook; hooks run in registration order"""
+        self._hooks.append(func)
+        return func
+
+    def __call__(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for hook in self._hooks:
+                with profile.phase(hook.__name__):
+                    hook()
+
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_profile(module):
+    """
+    Import a module in a fresh interpreter and time every import
+
+    Returns:
+        tuple: (total seconds, list of (self seconds, cumulative seconds, depth, module))
+    """
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, env=dict(os.environ, NOTIFICATION_WORKERS='0')
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            imports.append((int(own) / 1e6, int(cumulative) / 1e6, (len(indent) - 1) // 2, name))
+    return float(result.stdout.strip().splitlines()[-1]), imports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report where the import time of an entry point goes')
+    parser.add_argument('module', nargs='?', default='app', help='Module to import, e.g. app or main')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to list')
+    args = parser.parse_args()
+
+    total, imports = import_profile(args.module)
+    print(f"import {args.module}: {total * 1000:.1f} ms")
+    print(f"\n{'cumulative (ms)':>16} {'self (ms)':>10}  module (top-level imports of {args.module})")
+    for own, cumulative, depth, name in imports:
+        if depth == 1:
+            print(f"{cumulative * 1000:>16.1f} {own * 1000:>10.1f}  {name}")
+    print(f"\n{'self (ms)':>10}  slowest modules")
+    for own, cumulative, depth, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"{own * 1000:>10.1f}  {name}")
@@ -0,0 +1,949 @@
+import bisect
+import itertools
+import json
+import math
+import operator
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime
+
+from search import SEARCH_FIELDS, TextIndex, search_terms, ticket_text
+from startup import lazy_import
+
+# Only needed for ranking search results; loaded on the first search
+np = lazy_import('numpy')
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Running counters kept per ticket field, plus tickets per submission day
+STAT_DIMENSIONS = ('status', 'category', 'priority', 'day')
+RESOLVE_PERCENTILES = (50, 90, 95)
+
+
+def _stat_keys(ticket):
+    """The (dimension, value) pairs a ticket adds to the running counters"""
+    keys = [(field, ticket.get(field)) for field in STAT_DIMENSIONS[:-1]]
+    keys.append(('day', (ticket.get('date') or '')[:10]))
+    return [(dimension, 'unknown' if not value else str(value)) for dimension, value in keys]
+
+
+def resolve_seconds(ticket):
+    """Seconds from submission to resolution, or None if the ticket is not resolved"""
+    if ticket.get('status') != 'resolved' or not ticket.get('resolved_date'):
+        return None
+    try:
+        submitted = datetime.strptime(ticket['date'], DATE_FORMAT)
+        resolved = datetime.strptime(ticket['resolved_date'], DATE_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return int((resolved - submitted).total_seconds())
+
+
+def _summarize(counts, resolve_count, resolve_total, resolve_at):
+    """
+    Build the stats dict returned by TicketStore.stats
+
+    Args:
+        counts (dict): Dimension -> {value: count}
+        resolve_count (int): Number of resolved tickets with a resolve time
+        resolve_total (int): Sum of their resolve times in seconds
+        resolve_at (callable): Returns the n-th smallest resolve time
+    """
+    time_to_resolve = {'count': resolve_count}
+    if resolve_count:
+        time_to_resolve['avg_hours'] = round(resolve_total / resolve_count / 3600, 2)
+        for percentile in RESOLVE_PERCENTILES:
+            # Nearest-rank percentile
+            rank = max(math.ceil(percentile / 100 * resolve_count) - 1, 0)
+            time_to_resolve[f'p{percentile}_hours'] = round(resolve_at(rank) / 3600, 2)
+    return {
+        'total': sum(counts['status'].values()),
+        'by_status': dict(counts['status']),
+        'by_category': dict(counts['category']),
+        'by_priority': dict(counts['priority']),
+        'daily': dict(sorted(counts['day'].items())),
+        'time_to_resolve': time_to_resolve
+    }
+
+
+class TicketStore(ABC):
+    """
+    Interface the web app uses to read and write tickets.
+
+    Tickets are plain dicts with at least id, description, priority,
+    category, contact_email, status and date. Every create or update also
+    stamps the ticket with rev, the next value of a store-wide revision
+    counter, so clients can ask for just what changed since they last synced.
+    """
+
+    @abstractmethod
+    def create(self, ticket):
+        """
+        Add a new ticket, assigning it the next id
+
+        Args:
+            ticket (dict): Ticket fields without an id
+
+        Returns:
+            dict: The stored ticket
+        """
+
+    @abstractmethod
+    def update(self, ticket_id, changes, touch=True):
+        """
+        Change fields of an existing ticket
+
+        Args:
+            ticket_id (int): Ticket to change
+            changes (dict): Fields to set
+            touch (bool): Give the ticket the next revision; False for
+                bookkeeping that clients do not sync, such as email
+                delivery status, so the store version stays put
+
+        Returns:
+            dict: The updated ticket, or None if no ticket has that id
+        """
+
+    @abstractmethod
+    def get(self, ticket_id):
+        """Return the ticket with the given id, or None"""
+
+    @abstractmethod
+    def recent(self, limit):
+        """Return the newest tickets, newest first"""
+
+    @abstractmethod
+    def all(self, newest_first=False):
+        """Return every ticket in submission order"""
+
+    @abstractmethod
+    def find(self, status=None, category=None, priority=None, after_id=None, before_id=None,
+             newest_first=False, limit=None):
+        """
+        Return tickets matching every given filter, in submission order
+
+        Args:
+            status (str): Only tickets with this status
+            category (str): Only tickets in this category
+            priority (str): Only tickets with this priority
+            after_id (int): Only tickets with a greater id
+            before_id (int): Only tickets with a smaller id
+            newest_first (bool): Reverse the order
+            limit (int): Return at most this many tickets
+        """
+
+    @property
+    @abstractmethod
+    def version(self):
+        """The highest revision in the store (0 when empty)"""
+
+    @abstractmethod
+    def stats(self):
+        """
+        Return running aggregates over all tickets
+
+        Returns:
+            dict: total, by_status, by_category, by_priority, daily counts
+                and time_to_resolve (count, avg and percentile hours)
+        """
+
+    @abstractmethod
+    def categories(self):
+        """Return the categories tickets are filed under, sorted"""
+
+    @abstractmethod
+    def changed_since(self, version, limit=None):
+        """
+        Return tickets created or updated after the given revision
+
+        Args:
+            version (int): Revision the caller has already seen
+            limit (int): Return at most this many tickets
+
+        Returns:
+            list: Tickets in revision order; continue from the last one's rev
+        """
+
+    @abstractmethod
+    def search(self, query, status=None, category=None, priority=None, limit=20):
+        """
+        Full-text search over descriptions and resolution notes
+
+        Every word of the query must occur in the ticket. Results are ranked
+        by BM25 relevance, newest first among equally relevant tickets.
+
+        Args:
+            query (str): Words to look for
+            status (str): Only tickets with this status
+            category (str): Only tickets in this category
+            priority (str): Only tickets with this priority
+            limit (int): Return at most this many tickets
+
+        Returns:
+            list: Matching tickets, best match first
+        """
+
+    def build_search_index(self):
+        """Prepare the search index ahead of the first search"""
+        pass
+
+    def close(self):
+        pass
+
+
+class TicketIndex:
+    """
+    In-memory tickets with an id index and secondary indexes.
+
+    Each indexed field maps a value to the ascending ids of the tickets that
+    have it, so lookups and filtered views never scan every ticket.
+    """
+
+    INDEXED_FIELDS = ('status', 'category', 'priority')
+
+    def __init__(self):
+        self.tickets = []  # Submission (= id) order
+        self.by_id = {}
+        self.by_field = {field: {} for field in self.INDEXED_FIELDS}
+        # Ticket ids in revision order (dicts keep insertion order)
+        self.by_rev = {}
+        self.next_id = 1
+        self.version = 0
+        # Running counters and sorted resolve times for stats()
+        self.counts = {dimension: Counter() for dimension in STAT_DIMENSIONS}
+        self.resolve_times = []
+        self.resolve_total = 0
+        # Full-text index, built on demand over the first text_indexed tickets
+        # and kept current for those afterwards
+        self.text = None
+        self.text_indexed = 0
+
+    def _index(self, ticket):
+        for field, index in self.by_field.items():
+            ids = index.setdefault(ticket.get(field), [])
+            if not ids or ids[-1] < ticket['id']:
+                ids.append(ticket['id'])
+            else:
+                bisect.insort(ids, ticket['id'])
+
+    def _unindex(self, ticket, fields):
+        for field in fields:
+            ids = self.by_field[field].get(ticket.get(field))
+            position = bisect.bisect_left(ids, ticket['id'])
+            del ids[position]
+
+    def _count(self, ticket, sign):
+        """Add (sign=1) or remove (sign=-1) a ticket's share of the stats"""
+        for dimension, key in _stat_keys(ticket):
+            counter = self.counts[dimension]
+            counter[key] += sign
+            if counter[key] <= 0:
+                del counter[key]
+        seconds = resolve_seconds(ticket)
+        if seconds is None:
+            return
+        if sign > 0:
+            bisect.insort(self.resolve_times, seconds)
+        else:
+            del self.resolve_times[bisect.bisect_left(self.resolve_times, seconds)]
+        self.resolve_total += sign * seconds
+
+    def stats(self):
+        return _summarize(
+            self.counts,
+            len(self.resolve_times),
+            self.resolve_total,
+            self.resolve_times.__getitem__
+        )
+
+    def _touch(self, ticket):
+        if 'rev' not in ticket:
+            # Tickets written before revisions existed get one on load
+            ticket['rev'] = self.version + 1
+        self.version = max(self.version, ticket['rev'])
+        self.by_rev.pop(ticket['id'], None)
+        self.by_rev[ticket['id']] = None
+
+    def _has_text(self, ticket):
+        """Whether the ticket is already in the full-text index"""
+        return bool(self.text_indexed) and ticket['id'] <= self.tickets[self.text_indexed - 1]['id']
+
+    def index_text(self, count=None):
+        """
+        Add up to count more tickets to the full-text index (all when None)
+
+        Returns:
+            bool: Whether every ticket is indexed now
+        """
+        if self.text is None:
+            self.text = TextIndex()
+        stop = len(self.tickets) if count is None else min(len(self.tickets), self.text_indexed + count)
+        for position in range(self.text_indexed, stop):
+            ticket = self.tickets[position]
+            self.text.add(ticket['id'], ticket_text(ticket))
+        self.text_indexed = stop
+        return stop == len(self.tickets)
+
+    def sort_revisions(self):
+        """Restore revision order after loading a snapshot (stored in id order)"""
+        ordered = sorted(self.by_rev, key=lambda ticket_id: self.by_id[ticket_id]['rev'])
+        self.by_rev = dict.fromkeys(ordered)
+
+    def apply(self, record):
+        """Apply one log record (idempotent, so replaying it twice is safe)"""
+        if record['op'] == 'create':
+            ticket = record['ticket']
+            existing = self.by_id.get(ticket['id'])
+            if existing is not None:
+                self._unindex(existing, self.INDEXED_FIELDS)
+                self._count(existing, -1)
+                has_text = self._has_text(existing)
+                if has_text:
+                    self.text.remove(existing['id'], ticket_text(existing))
+                existing.clear()
+                existing.update(ticket)
+                self._index(existing)
+                self._count(existing, 1)
+                if has_text:
+                    self.text.add(existing['id'], ticket_text(existing))
+                self._touch(existing)
+                return existing
+            if self.text is not None and self.text_indexed == len(self.tickets):
+                self.text.add(ticket['id'], ticket_text(ticket))
+                self.text_indexed += 1
+            self.tickets.append(ticket)
+            self.by_id[ticket['id']] = ticket
+            self._index(ticket)
+            self._count(ticket, 1)
+            self._touch(ticket)
+            self.next_id = max(self.next_id, ticket['id'] + 1)
+            return ticket
+        if record['op'] == 'update':
+            ticket = self.by_id.get(record['id'])
+            if ticket is None:
+                return None
+            changes = record['changes']
+            moved = [
+                field for field in self.INDEXED_FIELDS
+                if field in changes and changes[field] != ticket.get(field)
+            ]
+            self._unindex(ticket, moved)
+            self._count(ticket, -1)
+            reindex = any(field in changes for field in SEARCH_FIELDS) and self._has_text(ticket)
+            if reindex:
+                self.text.remove(ticket['id'], ticket_text(ticket))
+            ticket.update(changes)
+            if reindex:
+                self.text.add(ticket['id'], ticket_text(ticket))
+            self._count(ticket, 1)
+            for field in moved:
+                ids = self.by_field[field].setdefault(ticket.get(field), [])
+                bisect.insort(ids, ticket['id'])
+            if record.get('touch', True):
+                self._touch(ticket)
+            return ticket
+        raise ValueError(f"Unknown log record: {record['op']}")
+
+    def find(self, newest_first=False, limit=None, after_id=None, before_id=None, **filters):
+        """
+        Return tickets whose fields equal the given values, in id order
+
+        Filters set to None are ignored. The smallest matching index is
+        walked, starting from the id bounds found by bisection, and the
+        remaining filters are checked per ticket. A newest-first read with a
+        limit therefore only touches the tail it returns.
+        """
+        filters = {field: value for field, value in filters.items() if value is not None}
+        indexed = [field for field in filters if field in self.by_field]
+        if indexed:
+            sequence = min((self.by_field[field].get(filters[field], []) for field in indexed), key=len)
+            key = None
+        else:
+            sequence = self.tickets
+            key = operator.itemgetter('id')
+
+        start = bisect.bisect_right(sequence, after_id, key=key) if after_id is not None else 0
+        stop = bisect.bisect_left(sequence, before_id, key=key) if before_id is not None else len(sequence)
+        positions = range(stop - 1, start - 1, -1) if newest_first else range(start, stop)
+        candidates = (
+            (self.by_id[sequence[position]] if key is None else sequence[position])
+            for position in positions
+        )
+        matches = (
+            ticket for ticket in candidates
+            if all(ticket.get(field) == value for field, value in filters.items())
+        )
+        return list(itertools.islice(matches, limit))
+
+    def search(self, query, limit=None, **filters):
+        """Rank the tickets matching the query; every ticket must be text-indexed"""
+        return self.rank(self.text.snapshot(query), limit, **filters)
+
+    def rank(self, snapshot, limit=None, **filters):
+        """
+        Rank the tickets of a TextIndex snapshot, without touching the index
+
+        With a limit only the best few candidates are sorted, and more are
+        taken only when the filters rejected too many of them.
+        """
+        ids, scores = self.text.rank(snapshot)
+        filters = {field: value for field, value in filters.items() if value is not None}
+        wanted = len(ids) if limit is None else limit * (2 if filters else 1)
+        while True:
+            if wanted < len(ids):
+                # Everything scoring at least the wanted-th best score, ties included
+                threshold = np.partition(scores, len(scores) - wanted)[len(scores) - wanted]
+                candidates = np.flatnonzero(scores >= threshold)
+            else:
+                candidates = np.arange(len(ids))
+            # Best score first, newest first among equal scores
+            candidates = candidates[np.lexsort((-ids[candidates].astype(np.int64), -scores[candidates]))]
+            matches = (self.by_id[ticket_id] for ticket_id in ids[candidates].tolist())
+            matches = [
+                ticket for ticket in matches
+                if all(ticket.get(field) == value for field, value in filters.items())
+            ][:limit]
+            if limit is None or len(matches) == limit or len(candidates) == len(ids):
+                return matches
+            wanted *= 4
+
+    def changed_since(self, version, limit=None):
+        """Walk back from the newest revision until reaching the given one"""
+        changed = []
+        for ticket_id in reversed(self.by_rev):
+            ticket = self.by_id[ticket_id]
+            if ticket['rev'] <= version:
+                break
+            changed.append(ticket)
+        changed.reverse()
+        return changed[:limit]
+
+
+class JsonlTicketStore(TicketStore):
+    """
+    Append-only ticket store.
+
+    Tickets live in memory. Every create and update is appended as one JSON
+    line to a log file, so a write costs the same whether the store holds a
+    hundred tickets or a million. Once the log grows past compact_every
+    records it is folded into the JSON snapshot by a background thread.
+    On startup the snapshot is loaded and the log is replayed on top of it.
+    """
+
+    def __init__(self, snapshot_path, log_path, compact_every=10000, fsync=True):
+        """
+        Args:
+            snapshot_path (str): JSON file holding the list of all tickets
+            log_path (str): JSON Lines file of changes since the snapshot
+            compact_every (int): Log records to collect before compacting
+            fsync (bool): Flush every record to disk before returning
+        """
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compacting_path = log_path + '.compacting'
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._log_records = 0
+        self._compaction = None
+
+        self._state = self._replay([self.compacting_path])
+        # A leftover .compacting log means a compaction was interrupted
+        for record in self._read_log(self.log_path):
+            self._state.apply(record)
+            self._log_records += 1
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        if os.path.exists(self.compacting_path):
+            # Finish the compaction that was interrupted
+            self._compaction = threading.Thread(target=self._compact, daemon=True)
+            self._compaction.start()
+
+    def _replay(self, log_paths):
+        """Load the snapshot and apply the given logs on top of it"""
+        state = TicketIndex()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                for ticket in json.load(f):
+                    state.apply({'op': 'create', 'ticket': ticket})
+            state.sort_revisions()
+        for path in log_paths:
+            for record in self._read_log(path):
+                state.apply(record)
+        return state
+
+    @staticmethod
+    def _read_log(path):
+        """Return the records in a log file, cutting off a torn final line"""
+        records = []
+        if not os.path.exists(path):
+            return records
+        with open(path, 'rb+') as f:
+            valid_bytes = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('unterminated line')
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Crash mid-append; drop the partial record so new
+                    # appends start on a clean line
+                    f.truncate(valid_bytes)
+                    break
+                valid_bytes += len(line)
+        return records
+
+    def _append(self, record):
+        self._log.write(json.dumps(record) + '\n')
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_records += 1
+        if self._log_records >= self.compact_every:
+            self._start_compaction()
+
+    def create(self, ticket):
+        with self._lock:
+            ticket = dict(ticket, id=self._state.next_id, rev=self._state.version + 1)
+            self._append({'op': 'create', 'ticket': ticket})
+            return self._state.apply({'op': 'create', 'ticket': ticket})
+
+    def update(self, ticket_id, changes, touch=True):
+        with self._lock:
+            if ticket_id not in self._state.by_id:
+                return None
+            if touch:
+                record = {'op': 'update', 'id': ticket_id, 'changes': dict(changes, rev=self._state.version + 1)}
+            else:
+                record = {'op': 'update', 'id': ticket_id, 'changes': dict(changes), 'touch': False}
+            self._append(record)
+            return self._state.apply(record)
+
+    def get(self, ticket_id):
+        return self._state.by_id.get(ticket_id)
+
+    def recent(self, limit):
+        if limit <= 0:
+            return []
+        return self._state.tickets[-limit:][::-1]
+
+    def all(self, newest_first=False):
+        tickets = self._state.tickets
+        return tickets[::-1] if newest_first else list(tickets)
+
+    def find(self, status=None, category=None, priority=None, after_id=None, before_id=None,
+             newest_first=False, limit=None):
+        return self._state.find(
+            newest_first, limit, after_id, before_id,
+            status=status, category=category, priority=priority
+        )
+
+    @property
+    def version(self):
+        return self._state.version
+
+    def stats(self):
+        with self._lock:
+            return self._state.stats()
+
+    def categories(self):
+        with self._lock:
+            return sorted(self._state.counts['category'])
+
+    def changed_since(self, version, limit=None):
+        with self._lock:
+            return self._state.changed_since(version, limit)
+
+    def search(self, query, status=None, category=None, priority=None, limit=20):
+        self.build_search_index()
+        with self._lock:
+            # Only copying the query's posting lists holds up writes; the
+            # ranking works on the copies
+            self._state.index_text()
+            snapshot = self._state.text.snapshot(query)
+        return self._state.rank(snapshot, limit, status=status, category=category, priority=priority)
+
+    def build_search_index(self, chunk=5000):
+        """Index every ticket, chunk tickets per lock so writes are not held up for long"""
+        while True:
+            with self._lock:
+                if self._state.index_text(chunk):
+                    return
+
+    def _start_compaction(self):
+        # Only one compaction at a time; the live log keeps growing meanwhile
+        if os.path.exists(self.compacting_path):
+            return
+        self._log.close()
+        os.replace(self.log_path, self.compacting_path)
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log_records = 0
+        self._compaction = threading.Thread(target=self._compact, daemon=True)
+        self._compaction.start()
+
+    def _compact(self):
+        """Fold the rotated log into a new snapshot, off the request path"""
+        state = self._replay([self.compacting_path])
+
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state.tickets, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        os.remove(self.compacting_path)
+
+    def compact(self):
+        """Compact now and wait for it to finish"""
+        with self._lock:
+            self._start_compaction()
+            compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def close(self):
+        with self._lock:
+            self._log.close()
+
+class SqliteTicketStore(TicketStore):
+    """
+    Ticket store backed by a SQLite database in WAL mode.
+
+    Several processes (e.g. gunicorn workers) can share one database file,
+    and queries go through indexes instead of a list held in every worker.
+    Fields without a dedicated column are kept as JSON in the extra column.
+    """
+
+    COLUMNS = ('id', 'description', 'priority', 'category', 'contact_email',
+               'status', 'date', 'resolved_date', 'resolution_notes', 'rev')
+    # Left out of the ticket dict while they are still NULL
+    OPTIONAL_COLUMNS = ('resolved_date', 'resolution_notes')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            priority TEXT,
+            category TEXT,
+            contact_email TEXT,
+            status TEXT NOT NULL DEFAULT 'open',
+            date TEXT NOT NULL,
+            resolved_date TEXT,
+            resolution_notes TEXT,
+            extra TEXT,
+            rev INTEGER,
+            resolve_seconds INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS ticket_counts (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets (status);
+        CREATE INDEX IF NOT EXISTS idx_tickets_category ON tickets (category);
+        CREATE INDEX IF NOT EXISTS idx_tickets_priority ON tickets (priority);
+        CREATE INDEX IF NOT EXISTS idx_tickets_date ON tickets (date);
+        CREATE INDEX IF NOT EXISTS idx_tickets_rev ON tickets (rev);
+        CREATE INDEX IF NOT EXISTS idx_tickets_resolve_seconds ON tickets (resolve_seconds)
+            WHERE resolve_seconds IS NOT NULL;
+    """
+
+    # Full-text index over the tickets table, kept in sync by triggers
+    SEARCH_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5(
+            description, resolution_notes, content='tickets', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS tickets_fts_insert AFTER INSERT ON tickets BEGIN
+            INSERT INTO tickets_fts (rowid, description, resolution_notes)
+            VALUES (new.id, new.description, new.resolution_notes);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tickets_fts_delete AFTER DELETE ON tickets BEGIN
+            INSERT INTO tickets_fts (tickets_fts, rowid, description, resolution_notes)
+            VALUES ('delete', old.id, old.description, old.resolution_notes);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tickets_fts_update AFTER UPDATE OF description, resolution_notes ON tickets
+        WHEN old.description IS NOT new.description OR old.resolution_notes IS NOT new.resolution_notes BEGIN
+            INSERT INTO tickets_fts (tickets_fts, rowid, description, resolution_notes)
+            VALUES ('delete', old.id, old.description, old.resolution_notes);
+            INSERT INTO tickets_fts (rowid, description, resolution_notes)
+            VALUES (new.id, new.description, new.resolution_notes);
+        END;
+    """
+
+    def __init__(self, path, timeout=30.0):
+        """
+        Args:
+            path (str): SQLite database file
+            timeout (float): Seconds to wait for another writer's lock
+        """
+        self.path = path
+        self.timeout = timeout
+        # One connection per thread; sqlite3 connections are not thread-safe
+        self._local = threading.local()
+        # (version, resolve count, resolve total) -> {rank: seconds}
+        self._percentiles = (None, {})
+        with self._connection() as conn:
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(tickets)')]
+            if columns and 'rev' not in columns:
+                # Databases created before revisions existed
+                conn.execute('ALTER TABLE tickets ADD COLUMN rev INTEGER')
+                conn.execute('UPDATE tickets SET rev = id')
+            if columns and 'resolve_seconds' not in columns:
+                # Databases created before running stats existed
+                conn.execute('ALTER TABLE tickets ADD COLUMN resolve_seconds INTEGER')
+            conn.executescript(self.SCHEMA)
+            if columns and 'resolve_seconds' not in columns:
+                self._rebuild_counts(conn)
+            has_search = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'tickets_fts'").fetchone()
+            conn.executescript(self.SEARCH_SCHEMA)
+            if columns and not has_search:
+                # Databases created before search existed
+                conn.execute("INSERT INTO tickets_fts (tickets_fts) VALUES ('rebuild')")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _to_row(self, ticket):
+        row = {column: ticket.get(column) for column in self.COLUMNS}
+        extra = {key: value for key, value in ticket.items() if key not in self.COLUMNS}
+        row['extra'] = json.dumps(extra) if extra else None
+        row['resolve_seconds'] = resolve_seconds(ticket)
+        return row
+
+    @staticmethod
+    def _adjust_counts(conn, ticket, sign):
+        """Add (sign=1) or remove (sign=-1) a ticket's share of ticket_counts"""
+        changes = [(dimension, key, sign) for dimension, key in _stat_keys(ticket)]
+        seconds = resolve_seconds(ticket)
+        if seconds is not None:
+            changes += [('resolve', 'count', sign), ('resolve', 'seconds', sign * seconds)]
+        conn.executemany(
+            'INSERT INTO ticket_counts (dimension, key, count) VALUES (?, ?, ?) '
+            'ON CONFLICT (dimension, key) DO UPDATE SET count = count + excluded.count',
+            changes
+        )
+        if sign < 0:
+            conn.execute("DELETE FROM ticket_counts WHERE count = 0 AND dimension != 'resolve'")
+
+    def _rebuild_counts(self, conn):
+        """Recompute ticket_counts and resolve_seconds from the tickets table"""
+        conn.execute('DELETE FROM ticket_counts')
+        for row in conn.execute('SELECT * FROM tickets').fetchall():
+            ticket = self._to_ticket(row)
+            conn.execute(
+                'UPDATE tickets SET resolve_seconds = ? WHERE id = ?',
+                (resolve_seconds(ticket), ticket['id'])
+            )
+            self._adjust_counts(conn, ticket, 1)
+
+    def _to_ticket(self, row):
+        if row is None:
+            return None
+        ticket = {
+            column: row[column] for column in self.COLUMNS
+            if not (column in self.OPTIONAL_COLUMNS and row[column] is None)
+        }
+        if row['extra']:
+            ticket.update(json.loads(row['extra']))
+        return ticket
+
+    def _query(self, sql, params=()):
+        return [self._to_ticket(row) for row in self._connection().execute(sql, params)]
+
+    @staticmethod
+    def _next_rev(conn):
+        return conn.execute('SELECT COALESCE(MAX(rev), 0) + 1 FROM tickets').fetchone()[0]
+
+    def create(self, ticket):
+        conn = self._connection()
+        with conn:
+            # BEGIN IMMEDIATE so concurrent writers never share a revision
+            conn.execute('BEGIN IMMEDIATE')
+            ticket = dict(ticket, rev=self._next_rev(conn))
+            row = self._to_row(ticket)
+            del row['id']
+            cursor = conn.execute(
+                f"INSERT INTO tickets ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values())
+            )
+            ticket['id'] = cursor.lastrowid
+            self._adjust_counts(conn, ticket, 1)
+        return ticket
+
+    def import_tickets(self, tickets):
+        """Bulk-insert existing tickets, keeping their ids"""
+        rows = [self._to_row(ticket) for ticket in tickets]
+        if not rows:
+            return
+        columns = list(rows[0])
+        with self._connection() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO tickets ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [tuple(row[column] for column in columns) for row in rows]
+            )
+            self._rebuild_counts(conn)
+
+    def update(self, ticket_id, changes, touch=True):
+        conn = self._connection()
+        with conn:
+            # BEGIN IMMEDIATE so the read-modify-write of extra is atomic
+            conn.execute('BEGIN IMMEDIATE')
+            ticket = self._to_ticket(
+                conn.execute('SELECT * FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+            )
+            if ticket is None:
+                return None
+            self._adjust_counts(conn, ticket, -1)
+            ticket.update(changes)
+            if touch:
+                ticket['rev'] = self._next_rev(conn)
+            self._adjust_counts(conn, ticket, 1)
+            row = self._to_row(ticket)
+            del row['id']
+            conn.execute(
+                f"UPDATE tickets SET {', '.join(f'{column} = ?' for column in row)} WHERE id = ?",
+                (*row.values(), ticket_id)
+            )
+        return ticket
+
+    def get(self, ticket_id):
+        rows = self._query('SELECT * FROM tickets WHERE id = ?', (ticket_id,))
+        return rows[0] if rows else None
+
+    def recent(self, limit):
+        # A negative LIMIT means no limit to SQLite
+        return self._query('SELECT * FROM tickets ORDER BY id DESC LIMIT ?', (max(limit, 0),))
+
+    def all(self, newest_first=False):
+        order = 'DESC' if newest_first else 'ASC'
+        return self._query(f'SELECT * FROM tickets ORDER BY id {order}')
+
+    def find(self, status=None, category=None, priority=None, after_id=None, before_id=None,
+             newest_first=False, limit=None):
+        filters = {'status = ?': status, 'category = ?': category, 'priority = ?': priority,
+                   'id > ?': after_id, 'id < ?': before_id}
+        conditions = [condition for condition, value in filters.items() if value is not None]
+        params = [value for value in filters.values() if value is not None]
+        sql = 'SELECT * FROM tickets'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id ' + ('DESC' if newest_first else 'ASC')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return self._query(sql, params)
+
+    @property
+    def version(self):
+        return self._connection().execute('SELECT COALESCE(MAX(rev), 0) FROM tickets').fetchone()[0]
+
+    def stats(self):
+        conn = self._connection()
+
+        def resolve_at(rank):
+            if rank not in percentiles:
+                percentiles[rank] = conn.execute(
+                    'SELECT resolve_seconds FROM tickets WHERE resolve_seconds IS NOT NULL '
+                    'ORDER BY resolve_seconds LIMIT 1 OFFSET ?',
+                    (rank,)
+                ).fetchone()[0]
+            return percentiles[rank]
+
+        with conn:
+            # One read transaction so counters and percentiles agree
+            conn.execute('BEGIN')
+            counts = {dimension: {} for dimension in STAT_DIMENSIONS + ('resolve',)}
+            for row in conn.execute('SELECT dimension, key, count FROM ticket_counts'):
+                counts[row['dimension']][row['key']] = row['count']
+            resolved = counts.pop('resolve')
+            resolve_count, resolve_total = resolved.get('count', 0), resolved.get('seconds', 0)
+            # The percentile lookups are the only part that reads the tickets
+            # table; reuse them until a write changes the resolve times
+            key = (self.version, resolve_count, resolve_total)
+            cached_key, percentiles = self._percentiles
+            if cached_key != key:
+                percentiles = {}
+            summary = _summarize(counts, resolve_count, resolve_total, resolve_at)
+            self._percentiles = (key, percentiles)
+            return summary
+
+    def categories(self):
+        # Read from the running counters, so no scan of the tickets table
+        return [row['key'] for row in self._connection().execute(
+            "SELECT key FROM ticket_counts WHERE dimension = 'category' ORDER BY key"
+        )]
+
+    def changed_since(self, version, limit=None):
+        sql = 'SELECT * FROM tickets WHERE rev > ? ORDER BY rev'
+        params = [version]
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return self._query(sql, params)
+
+    def search(self, query, status=None, category=None, priority=None, limit=20):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        # Each word quoted, so query text is never read as FTS5 syntax
+        params = [' '.join(f'"{term}"' for term in terms)]
+        sql = ('SELECT tickets.* FROM tickets_fts JOIN tickets ON tickets.id = tickets_fts.rowid '
+               'WHERE tickets_fts MATCH ?')
+        filters = {'tickets.status = ?': status, 'tickets.category = ?': category, 'tickets.priority = ?': priority}
+        for condition, value in filters.items():
+            if value is not None:
+                sql += ' AND ' + condition
+                params.append(value)
+        sql += ' ORDER BY bm25(tickets_fts), tickets.id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return self._query(sql, params)
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM tickets').fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_store(backend, snapshot_path, log_path, db_path, compact_every=10000):
+    """
+    Open the configured ticket store
+
+    Args:
+        backend (str): 'jsonl' or 'sqlite'
+        snapshot_path (str): JSON snapshot of tickets; a new SQLite database
+            is seeded from it and log_path so switching backends keeps
+            existing tickets
+        log_path (str): Change log for the jsonl backend
+        db_path (str): Database file for the sqlite backend
+        compact_every (int): Log records between compactions (jsonl only)
+
+    Returns:
+        TicketStore: The opened store
+    """
+    if backend == 'jsonl':
+        return JsonlTicketStore(snapshot_path, log_path, compact_every=compact_every)
+    if backend == 'sqlite':
+        store = SqliteTicketStore(db_path)
+        if store.count() == 0 and os.path.exists(snapshot_path):
+            existing = JsonlTicketStore(snapshot_path, log_path)
+            store.import_tickets(existing.all())
+            existing.close()
+        return store
+    raise ValueError(f"Unknown ticket store backend: {backend}")
@@ -1,70 +1,71 @@
+import os
 import streamlit as st
 import requests
-import pandas as pd
-import plotly.express as px
-from datetime import datetime
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-# Email Configuration
-EMAIL_HOST = "smtp.gmail.com"
-EMAIL_PORT = 587
-EMAIL_USERNAME = st.secrets["email"]["username"]
-EMAIL_PASSWORD = st.secrets["email"]["password"]
-
-# Issue Handler Configuration
-ISSUE_HANDLERS = {
-    "bug": "bug-team@company.com",
-    "feature": "feature-team@company.com",
-    "documentation": "docs-team@company.com",
-    "security": "security-team@company.com",
-    "performance": "performance-team@company.com"
-}
-
-def send_email_notification(issue_data):
-    """Send email notification to appropriate handler based on issue category."""
-    try:
-        handler_email = ISSUE_HANDLERS.get(issue_data['category'].lower())
-        if not handler_email:
-            st.warning(f"No handler configured for category: {issue_data['category']}")
-            return
-
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USERNAME
-        msg['To'] = handler_email
-        msg['Subject'] = f"New {issue_data['priority'].upper()} Priority Issue: #{issue_data['id']}"
-
-        # Email body
-        body = f"""
-        New Issue Assigned:
-        
-        ID: {issue_data['id']}
-        Description: {issue_data['description']}
-        Priority: {issue_data['priority']}
-        Category: {issue_data['category']}
-        Status: {issue_data['status']}
-        Date: {issue_data['date']}
-        
-        Please review and take appropriate action.
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Send email
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USERNAME, EMAIL_PASSWORD)
-            server.send_message(msg)
-            
-        st.success(f"Email notification sent to {handler_email}")
-    except Exception as e:
-        st.error(f"Failed to send email notification: {str(e)}")
+from datetime import datetime, timedelta
+from startup import lazy_import
+
+# Loaded on first use, so the page starts rendering before these finish importing
+pd = lazy_import("pandas")
+px = lazy_import("plotly.express")
 
 # Flask API endpoint
 FLASK_API_URL = "http://localhost:5000"
 
+# Number of newest issues kept for the "Recent Issues" table
+RECENT_ISSUES_LIMIT = 100
+
+# Columnar export written by the Flask app (analytics.py), read directly for
+# trend views when the dashboard runs next to it
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+
+def load_export():
+    """The analytics export, or None if there is none yet or pyarrow is missing."""
+    try:
+        from analytics import AnalyticsExport
+    except ImportError:
+        return None
+    export = AnalyticsExport(ANALYTICS_DIR)
+    return export if os.path.exists(export.daily_path) else None
+
+def fetch_events(after, timeout=0, page_size=1000):
+    """Fetch ticket events after offset `after`, waiting up to `timeout`
+    seconds for the first one.
+
+    Returns (issues, offset) with the latest state of each issue the events
+    are about, or None if a request fails.
+    """
+    issues = {}
+    while True:
+        page = fetch_json("/api/events", after=after, timeout=timeout, limit=page_size)
+        if page is None:
+            return None
+        for event in page["events"]:
+            issues[event["ticket"]["id"]] = event["ticket"]
+        after = page["offset"]
+        timeout = 0
+        if not page["has_more"]:
+            return list(issues.values()), after
+
+def fetch_json(path, **params):
+    """GET a Flask API endpoint; returns None if the request fails."""
+    response = requests.get(f"{FLASK_API_URL}{path}", params=params)
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+def merge_recent(changed):
+    """Upsert changed issues into the session's table of newest issues."""
+    if not changed:
+        return
+    changed_df = pd.DataFrame(changed)
+    recent = st.session_state.recent_df
+    if recent is not None and not recent.empty:
+        recent = recent[~recent["id"].isin(changed_df["id"])]
+    st.session_state.recent_df = pd.concat([recent, changed_df], ignore_index=True).nlargest(RECENT_ISSUES_LIMIT, "id")
+
+def format_hours(hours):
+    return "N/A" if hours is None else f"{hours:.1f}h"
+
 # Configure Streamlit page
 st.set_page_config(
     page_title="Issue Analytics",
@@ -76,58 +77,73 @@ st.set_page_config(
 st.markdown("[← Back to Main Interface](http://localhost:5000)")
 st.title("Issue Analytics Dashboard")
 
-# Manual Refresh Button
-if "issues_data" not in st.session_state:
-    st.session_state.issues_data = None
-
-if "previous_issues" not in st.session_state:
-    st.session_state.previous_issues = set()
-
-if st.button("🔄 Refresh Data"):
-    st.session_state.issues_data = None
+# Synced state: server-side stats, the newest issues for the table and the
+# event offset they are current to (None until the first sync)
+if "offset" not in st.session_state:
+    st.session_state.offset = None
+    st.session_state.stats = None
+    st.session_state.recent_df = None
+
+def sync(timeout=0):
+    """Bring the synced state up to date.
+
+    Returns whether anything changed, or None if a request failed.
+    """
+    if st.session_state.offset is None:
+        # Offset first, so nothing created while the table loads is missed
+        events = fetch_json("/api/events")
+        stats = fetch_json("/api/stats")
+        recent = fetch_json("/api/recent-requests", limit=RECENT_ISSUES_LIMIT)
+        if events is None or stats is None or recent is None:
+            st.error("Failed to fetch data from the server.")
+            return None
+        merge_recent(recent)
+        st.session_state.offset = events["offset"]
+        st.session_state.stats = stats
+        return True
+    result = fetch_events(st.session_state.offset, timeout)
+    if result is None:
+        st.error("Failed to fetch data from the server.")
+        return None
+    changed, st.session_state.offset = result
+    if not changed:
+        return False
+    merge_recent(changed)
+    stats = fetch_json("/api/stats")
+    if stats is not None:
+        st.session_state.stats = stats
+    return True
 
-# Fetching and caching the data (only when session_state is None)
-if st.session_state.issues_data is None:
+# Manual Refresh Button
+col_refresh, col_live = st.columns([1, 4])
+refresh = col_refresh.button("🔄 Refresh Data")
+live = col_live.toggle("Live updates", help="Follow new and resolved issues as they happen")
+
+# Aggregates come pre-computed from the server; issues are fetched only for
+# the table, and after the first sync only those in new ticket events.
+# Handler notifications are routed by the server, not by this page
+if refresh or st.session_state.offset is None:
     try:
         with st.spinner("Fetching data from server..."):
-            response = requests.get(f"{FLASK_API_URL}/api/recent-requests")
-            if response.status_code == 200:
-                new_issues = response.json()
-                
-                # Check for new issues and send notifications
-                current_issue_ids = {issue['id'] for issue in new_issues}
-                new_issue_ids = current_issue_ids - st.session_state.previous_issues
-                
-                # Send notifications for new issues only
-                for issue in new_issues:
-                    if issue['id'] in new_issue_ids:
-                        send_email_notification(issue)
-                
-                # Update previous issues set with current issues
-                st.session_state.previous_issues = current_issue_ids
-                st.session_state.issues_data = new_issues
-            else:
-                st.error("Failed to fetch data from the server.")
+            sync()
     except Exception as e:
         st.error(f"Error connecting to server: {str(e)}")
         st.info("Please make sure the Flask server is running on port 5000")
 
 # Proceed if we have data
-issues = st.session_state.issues_data
+stats = st.session_state.stats
 
-if issues is None:
+if stats is None:
     st.info("No issues found. Submit some issues to see analytics.")
-elif not issues:
+elif not stats["total"]:
     st.warning("No issues available at the moment.")
 else:
-    df = pd.DataFrame(issues)
-
     # Create two columns for layout
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader("Priority Distribution")
-        priority_counts = df['priority'].value_counts()
+        priority_counts = pd.Series(stats['by_priority']).sort_values(ascending=False)
         fig_priority = px.pie(
             values=priority_counts.values,
             names=priority_counts.index,
@@ -141,7 +157,7 @@ else:
         st.plotly_chart(fig_priority, use_container_width=True)
 
         st.subheader("Category Distribution")
-        category_counts = df['category'].value_counts()
+        category_counts = pd.Series(stats['by_category']).sort_values(ascending=False)
         fig_category = px.bar(
             x=category_counts.index,
             y=category_counts.values,
@@ -151,18 +167,36 @@ else:
 
     with col2:
         st.subheader("Issues Over Time")
-        df['date'] = pd.to_datetime(df['date'])
-        daily_counts = df.groupby(df['date'].dt.date).size().reset_index(name='count')
-        fig_timeline = px.line(
-            daily_counts,
-            x='date',
-            y='count',
-            labels={'date': 'Date', 'count': 'Number of Issues'}
-        )
-        st.plotly_chart(fig_timeline, use_container_width=True)
+        export = load_export()
+        if export is not None:
+            # Memory-mapped daily rollup: only the range and columns shown are read
+            today = datetime.now().date()
+            date_range = st.date_input("Date range", (today - timedelta(days=30), today))
+            if len(date_range) == 2:
+                start, end = (day.isoformat() for day in date_range)
+                rollup = export.read_rollup('daily', start, end, columns=['bucket', 'category', 'tickets']).to_pandas()
+                daily_counts = rollup.groupby(['bucket', 'category'], as_index=False)['tickets'].sum()
+                fig_timeline = px.line(
+                    daily_counts,
+                    x='bucket',
+                    y='tickets',
+                    color='category',
+                    labels={'bucket': 'Date', 'tickets': 'Number of Issues', 'category': 'Category'}
+                )
+                st.plotly_chart(fig_timeline, use_container_width=True)
+        else:
+            daily_counts = pd.Series(stats['daily']).sort_index().rename_axis('date').reset_index(name='count')
+            daily_counts['date'] = pd.to_datetime(daily_counts['date'])
+            fig_timeline = px.line(
+                daily_counts,
+                x='date',
+                y='count',
+                labels={'date': 'Date', 'count': 'Number of Issues'}
+            )
+            st.plotly_chart(fig_timeline, use_container_width=True)
 
         st.subheader("Status Overview")
-        status_counts = df['status'].value_counts()
+        status_counts = pd.Series(stats['by_status']).sort_values(ascending=False)
         fig_status = px.pie(
             values=status_counts.values,
             names=status_counts.index,
@@ -173,16 +207,36 @@ else:
     st.subheader("Key Metrics")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total Issues", len(df))
+        st.metric("Total Issues", stats['total'])
     with col2:
-        st.metric("High Priority", len(df[df['priority'] == 'high']))
+        st.metric("High Priority", stats['by_priority'].get('high', 0))
     with col3:
-        st.metric("Open Issues", len(df[df['status'] == 'open']))
+        st.metric("Open Issues", stats['by_status'].get('open', 0))
     with col4:
-        st.metric("Avg Response Time", "24h")
+        time_to_resolve = stats['time_to_resolve']
+        st.metric(
+            "Avg Time to Resolve",
+            format_hours(time_to_resolve.get('avg_hours')),
+            help=(f"Median {format_hours(time_to_resolve.get('p50_hours'))}, "
+                  f"p90 {format_hours(time_to_resolve.get('p90_hours'))} "
+                  f"over {time_to_resolve['count']} resolved issues")
+        )
 
     st.subheader("Recent Issues")
+    df = st.session_state.recent_df
     st.dataframe(
         df[['id', 'description', 'priority', 'category', 'status', 'date']].sort_values('date', ascending=False),
         use_container_width=True
     )
+
+# Subscribed to the event feed: long-poll until something happens, then
+# rerun with the new state
+if live and st.session_state.offset is not None:
+    try:
+        synced = sync(timeout=25)
+    except requests.RequestException as e:
+        st.error(f"Lost connection to server: {str(e)}")
+    else:
+        # Stays on the error instead of retrying in a tight loop
+        if synced is not None:
+            st.rerun()
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from analytics import AnalyticsExport
+from storage import JsonlTicketStore, SqliteTicketStore
+
+DAYS = ['2026-01-01', '2026-01-02', '2026-01-03']
+
+
+def open_backend(backend, tmp_path):
+    if backend == 'jsonl':
+        return JsonlTicketStore(str(tmp_path / 'tickets.json'), str(tmp_path / 'tickets.log.jsonl'), fsync=False)
+    return SqliteTicketStore(str(tmp_path / 'tickets.db'))
+
+
+def ticket(description, date):
+    return {'description': description, 'category': 'Technical Support', 'priority': 'high', 'status': 'open',
+            'date': date, 'contact_email': 'user@example.com'}
+
+
+def file_ids(export):
+    """Inode of every day's files; a rewrite replaces the file, so its inode changes"""
+    paths = {day: (export._day_path(day), export._hourly_path(day)) for day in DAYS}
+    return {day: tuple(os.stat(path).st_ino for path in day_paths) for day, day_paths in paths.items()}
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_export_only_rewrites_days_with_changes(tmp_path, backend):
+    store = open_backend(backend, tmp_path)
+    try:
+        for index in range(6):
+            store.create(ticket(f'Request {index}', f'{DAYS[index % 3]} 0{index}:00:00'))
+        export = AnalyticsExport(str(tmp_path / 'analytics'))
+        assert export.export(store) == 6
+        assert export.export(store) == 0
+        before = file_ids(export)
+
+        # Ticket 2 was created on the second day, ticket 7 on the third
+        store.update(2, {'status': 'resolved', 'resolved_date': '2026-01-02 03:00:00'})
+        store.create(ticket('Request 6', '2026-01-03 09:00:00'))
+        assert export.export(store, page_size=1) == 2
+        assert export.version == store.version
+
+        after = file_ids(export)
+        assert after[DAYS[0]] == before[DAYS[0]]
+        assert all(after[day][0] != before[day][0] and after[day][1] != before[day][1] for day in DAYS[1:])
+
+        tickets = export.read_tickets(columns=['id', 'status', 'date']).sort_by('id').to_pylist()
+        assert [(item['id'], item['status'], item['date']) for item in tickets] == [
+            (item['id'], item['status'], item['date'][:10]) for item in store.all()
+        ]
+        daily = export.read_rollup(columns=['tickets', 'resolved', 'resolve_seconds'])
+        assert sum(daily['tickets'].to_pylist()) == 7
+        assert sum(daily['resolved'].to_pylist()) == 1
+        assert sum(daily['resolve_seconds'].to_pylist()) == 2 * 3600
+    finally:
+        store.close()
@@ -0,0 +1,75 @@
+import importlib
+import shutil
+import sys
+
+import pytest
+
+RULES_FILE = 'rules.json'
+
+
+@pytest.fixture(params=['jsonl', 'sqlite'])
+def app_module(request, tmp_path, monkeypatch):
+    """The Flask app imported afresh, with every file it writes under tmp_path"""
+    shutil.copy(RULES_FILE, tmp_path / RULES_FILE)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TICKET_STORE', request.param)
+    monkeypatch.setenv('NOTIFICATION_WORKERS', '0')
+    monkeypatch.setenv('ANALYTICS_EXPORT_INTERVAL', '0')
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    module = importlib.import_module('app')
+    yield module
+    module.event_log.stop(timeout=5)
+    if module.store.is_built:
+        module.store.close()
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def create(app_module, description='Printer is broken', category='Technical Support', priority='high'):
+    return app_module.store.create({
+        'description': description, 'priority': priority, 'category': category,
+        'contact_email': 'user@example.com', 'status': 'open', 'date': '2026-01-01 09:00:00'
+    })
+
+
+@pytest.mark.parametrize('query', ['limit=abc', 'cursor=abc', 'since_id=1.5'])
+def test_recent_requests_rejects_non_integer_parameters(client, query):
+    response = client.get(f'/api/recent-requests?{query}')
+
+    assert response.status_code == 400
+    assert 'must be integers' in response.get_json()['error']
+
+
+def test_recent_requests_pages_with_cursor(app_module, client):
+    tickets = [create(app_module, f'Request {index}') for index in range(3)]
+
+    response = client.get('/api/recent-requests?limit=2')
+    assert [ticket['id'] for ticket in response.get_json()] == [tickets[2]['id'], tickets[1]['id']]
+
+    cursor = response.headers['X-Next-Cursor']
+    response = client.get(f'/api/recent-requests?limit=2&cursor={cursor}')
+    assert [ticket['id'] for ticket in response.get_json()] == [tickets[0]['id']]
+
+
+def test_requests_page_is_not_rebuilt_until_a_ticket_changes(app_module, client):
+    ticket = create(app_module)
+
+    response = client.get('/requests')
+    assert response.status_code == 200
+    assert b'issue-status open' in response.data
+    etag, _ = response.get_etag()
+
+    response = client.get('/requests', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    client.post(f'/resolve/{ticket["id"]}', data={'resolution_notes': 'Replaced the toner'})
+
+    response = client.get('/requests', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+    assert b'issue-status resolved' in response.data
@@ -0,0 +1,166 @@
+import json
+import random
+import time
+
+import pytest
+
+import classifier as classifier_module
+from classifier import DEFAULT_KEYWORDS, ClassificationCache, IssueClassifier, KeywordMatcher
+from config import Settings
+
+# Overlapping and nested keywords, repeated across categories
+OVERLAPPING_KEYWORDS = {
+    'Billing': ['bill', 'billing', 'in', 'invoice', 'voice'],
+    'Technical Support': ['not working', 'work', 'working', 'in'],
+    'Other': [],
+}
+
+
+def legacy_scores(keywords, text):
+    """The per-keyword substring scan the matcher replaced"""
+    return [sum(1 for keyword in words if keyword in text) for words in keywords.values()]
+
+
+def sample_texts(keywords, count=200, seed=7):
+    rng = random.Random(seed)
+    vocabulary = [word for words in keywords.values() for word in words] + ['the', 'my', 'printer', 'x', '']
+    return [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(0, 12))) for _ in range(count)]
+
+
+@pytest.fixture(params=['automaton', 'regex'])
+def backend(request, monkeypatch):
+    if request.param == 'automaton':
+        if classifier_module.ahocorasick is None:
+            pytest.skip('pyahocorasick is not installed')
+    else:
+        monkeypatch.setattr(classifier_module, 'ahocorasick', None)
+    return request.param
+
+
+@pytest.mark.parametrize('keywords', [DEFAULT_KEYWORDS, OVERLAPPING_KEYWORDS])
+def test_matcher_scores_match_legacy_scan(backend, keywords):
+    matcher = KeywordMatcher(keywords)
+    assert (matcher._automaton is None) == (backend == 'regex')
+    texts = sample_texts(keywords)
+
+    expected = [legacy_scores(keywords, text) for text in texts]
+    assert [matcher.score(text) for text in texts] == expected
+    assert matcher.score_batch(texts).tolist() == expected
+
+
+def test_classification_matches_legacy_scan(backend):
+    issue_classifier = IssueClassifier(cache_size=0)
+
+    for text in sample_texts(DEFAULT_KEYWORDS):
+        scores = dict(zip(DEFAULT_KEYWORDS, legacy_scores(DEFAULT_KEYWORDS, text)))
+        best = max(scores.items(), key=lambda item: item[1])
+        expected = best[0] if best[1] else 'General Inquiry'
+        assert issue_classifier.classify_issue(text) == expected
+
+
+def test_word_boundary_counts_whole_words_only(backend):
+    matcher = KeywordMatcher(OVERLAPPING_KEYWORDS, word_boundary=True)
+
+    assert matcher.find('billing for invoice, not working') == {'billing', 'invoice', 'not working', 'working'}
+
+
+def test_service_groups_are_the_rules_file_categories(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'version': 1, 'default_category': 'Other', 'categories': {'Other': [], 'Billing': ['invoice']}}))
+
+    assert Settings(RULES_FILE=str(path)).SERVICE_GROUPS == ['Other', 'Billing']
+
+
+def test_service_groups_fall_back_to_built_in_categories(tmp_path):
+    assert Settings(RULES_FILE=str(tmp_path / 'missing.json')).SERVICE_GROUPS == list(DEFAULT_KEYWORDS)
+
+    broken = tmp_path / 'broken.json'
+    broken.write_text('{"categories": ')
+    assert Settings(RULES_FILE=str(broken)).SERVICE_GROUPS == list(DEFAULT_KEYWORDS)
+
+
+def test_cache_empties_when_the_version_changes():
+    cache = ClassificationCache(max_entries=2)
+    cache.put('v1', cache.key('Printer is broken'), 'Technical Support')
+
+    assert cache.get('v1', cache.key('  PRINTER is broken ')) == 'Technical Support'
+    assert cache.get('v2', cache.key('Printer is broken')) is None
+    assert cache.stats()['entries'] == 0
+    assert cache.get('v1', cache.key('Printer is broken')) is None
+
+
+def test_cache_keeps_the_most_recently_used_entries():
+    cache = ClassificationCache(max_entries=2)
+    for text in ['first', 'second']:
+        cache.put('v1', cache.key(text), 'Billing')
+    cache.get('v1', cache.key('first'))
+    cache.put('v1', cache.key('third'), 'Billing')
+
+    assert cache.get('v1', cache.key('second')) is None
+    assert cache.get('v1', cache.key('first')) == 'Billing'
+
+
+def test_new_rules_are_not_answered_from_the_cache():
+    issue_classifier = IssueClassifier()
+    text = 'Question about my invoice'
+    category, version = issue_classifier.classify_with_version(text)
+    assert category == 'Billing'
+    assert issue_classifier.classify_batch_with_version([text]) == [(category, version)]
+    assert issue_classifier.cache.stats()['hits'] == 1
+
+    issue_classifier.set_rules({'Technical Support': ['invoice'], 'General Inquiry': []}, version=2)
+
+    new_category, new_version = issue_classifier.classify_with_version(text)
+    assert (new_category, issue_classifier.classify_batch([text])[0]) == ('Technical Support', 'Technical Support')
+    assert new_version != version
+    assert issue_classifier.cache.stats()['version'] == new_version
+
+
+def write_rules(path, version, categories, default_category='General Inquiry'):
+    path.write_text(json.dumps({'version': version, 'default_category': default_category, 'categories': categories}))
+
+
+def test_rules_file_is_reloaded(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, 1, {'Billing': ['invoice'], 'General Inquiry': []})
+    issue_classifier = IssueClassifier(rules_path=str(path))
+    assert issue_classifier.classify_with_version('printer on fire')[0] == 'General Inquiry'
+    old_version = issue_classifier.version
+
+    write_rules(path, 2, {'Billing': ['invoice'], 'Hardware': ['printer'], 'General Inquiry': []})
+    assert issue_classifier.reload_rules()
+
+    assert issue_classifier.classify_with_version('printer on fire') == ('Hardware', issue_classifier.version)
+    assert issue_classifier.version.startswith('rules-2:') and issue_classifier.version != old_version
+    assert issue_classifier.service_groups == ['Billing', 'Hardware', 'General Inquiry']
+
+
+def test_broken_rules_file_keeps_the_old_rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, 1, {'Billing': ['invoice'], 'General Inquiry': []})
+    issue_classifier = IssueClassifier(rules_path=str(path))
+    rules = issue_classifier.rules
+
+    for broken in ['{"version": 2, "categories": ', json.dumps({'version': 2, 'categories': {'Billing': 'invoice'}}),
+                   json.dumps({'version': 2, 'default_category': 'Missing', 'categories': {'Billing': []}})]:
+        path.write_text(broken)
+        assert not issue_classifier.reload_rules()
+        assert issue_classifier.rules is rules
+    assert issue_classifier.classify_issue('my invoice') == 'Billing'
+
+
+def test_watcher_swaps_in_changed_rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, 1, {'Billing': ['invoice'], 'General Inquiry': []})
+    issue_classifier = IssueClassifier(rules_path=str(path))
+    issue_classifier.watch_rules(interval=0.02)
+    try:
+        # Let the watcher record the file as it was before changing it
+        time.sleep(0.1)
+        write_rules(path, 2, {'Billing': ['invoice', 'refund'], 'General Inquiry': []})
+        deadline = time.time() + 5
+        while issue_classifier.classify_issue('refund please') != 'Billing':
+            assert time.time() < deadline, 'rules were not reloaded'
+            time.sleep(0.02)
+    finally:
+        issue_classifier.stop_watching()
@@ -0,0 +1,71 @@
+import time
+
+from dedup import Deduplicator
+
+REPORT = (
+    'Hello team, since this morning the invoice page shows an error when I try to download the '
+    'PDF for last month. I tried two browsers and cleared the cache but it still fails every time. '
+    'Could you please look into it as our accountant needs the document by Friday. Thanks, Alex'
+)
+
+
+def test_exact_repeat_ignores_case_spacing_and_punctuation():
+    dedup = Deduplicator(near_duplicates=False)
+    dedup.add(dedup.fingerprint('Printer is broken!', 'User@Example.com'), 1)
+
+    assert dedup.find(dedup.fingerprint('  printer IS broken ', 'user@example.com')) == 1
+    assert dedup.find(dedup.fingerprint('Printer is broken', 'other@example.com')) is None
+    assert dedup.find(dedup.fingerprint('Printer is fixed', 'user@example.com')) is None
+    assert dedup.stats() == {'entries': 1, 'hits': 1, 'near_hits': 0, 'misses': 2}
+
+
+def test_near_duplicate_matches_by_simhash():
+    dedup = Deduplicator()
+    dedup.add(dedup.fingerprint(REPORT, 'alex@example.com'), 1)
+    repeat = REPORT.replace('Friday', 'Thursday')
+
+    assert dedup.find(dedup.fingerprint(repeat, 'alex@example.com')) == 1
+    assert dedup.stats()['near_hits'] == 1
+    # Near duplicates still have to come from the same sender
+    assert dedup.find(dedup.fingerprint(repeat, 'sam@example.com')) is None
+    assert dedup.find(dedup.fingerprint('Please reset my password, the login page rejects it ' * 3,
+                                        'alex@example.com')) is None
+
+    exact_only = Deduplicator(near_duplicates=False)
+    exact_only.add(exact_only.fingerprint(REPORT, 'alex@example.com'), 1)
+    assert exact_only.find(exact_only.fingerprint(repeat, 'alex@example.com')) is None
+
+
+def test_short_texts_only_match_exactly():
+    dedup = Deduplicator(min_words=10)
+    dedup.add(dedup.fingerprint('Cannot log in', 'user@example.com'), 1)
+
+    assert dedup.fingerprint('Cannot log in', 'user@example.com').simhash is None
+    assert dedup.find(dedup.fingerprint('Cannot log out', 'user@example.com')) is None
+
+
+def test_entries_expire_and_are_capped():
+    dedup = Deduplicator(ttl=0.05, max_entries=2, near_duplicates=False)
+    for value, text in enumerate(['first issue', 'second issue', 'third issue']):
+        dedup.add(dedup.fingerprint(text), value)
+
+    # The least recently matched entry made room
+    assert dedup.find(dedup.fingerprint('first issue')) is None
+    assert dedup.find(dedup.fingerprint('third issue')) == 2
+    time.sleep(0.1)
+    assert dedup.find(dedup.fingerprint('third issue')) is None
+    assert dedup.stats()['entries'] == 0
+
+
+def test_claim_and_discard():
+    dedup = Deduplicator()
+    fingerprint = dedup.fingerprint(REPORT, 'alex@example.com')
+    first, second = object(), object()
+
+    assert dedup.claim(fingerprint, first) is None
+    assert dedup.claim(fingerprint, second) is first
+    # Only the claimant's entry is dropped
+    dedup.discard(fingerprint, second)
+    assert dedup.find(fingerprint) is first
+    dedup.discard(fingerprint, first)
+    assert dedup.find(fingerprint) is None
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from events import EventLog, TICKET_CREATED
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def event_log(tmp_path):
+    log = EventLog(str(tmp_path / 'events.db'), poll_interval=0.01, max_attempts=3)
+    yield log
+    log.stop(timeout=5)
+
+
+def test_poison_event_is_dead_lettered_and_later_events_handled(event_log):
+    poison = event_log.publish(TICKET_CREATED, {'id': 1})
+    event_log.publish(TICKET_CREATED, {'id': 2})
+    attempts = []
+    handled = []
+
+    def handler(event):
+        attempts.append(event['offset'])
+        if event['offset'] == poison:
+            raise RuntimeError('template missing')
+        handled.append(event['ticket']['id'])
+
+    event_log.consume('notifications', handler)
+    wait_for(lambda: handled == [2])
+
+    assert attempts.count(poison) == 3
+    [dead] = event_log.dead_letters('notifications')
+    assert (dead['offset'], dead['ticket'], dead['error']) == (poison, {'id': 1}, 'template missing')
+
+
+def test_event_handled_after_a_transient_failure_is_not_dead_lettered(event_log):
+    event_log.publish(TICKET_CREATED, {'id': 1})
+    handled = []
+
+    def handler(event):
+        handled.append(event['offset'])
+        if len(handled) == 1:
+            raise RuntimeError('database is locked')
+
+    event_log.consume('notifications', handler)
+    wait_for(lambda: len(handled) == 2)
+    event_log.stop(timeout=5)
+
+    assert event_log.dead_letters('notifications') == []
+
+
+def test_prune_keeps_unconsumed_and_newest_events(tmp_path):
+    log = EventLog(str(tmp_path / 'events.db'), retention=60)
+    offsets = [log.publish(TICKET_CREATED, {'id': index}) for index in range(4)]
+    with log._connection() as conn:
+        conn.execute('UPDATE events SET created = created - 3600')
+        # The consumer has handled the first two events
+        conn.execute("INSERT INTO consumers (name, position) VALUES ('notifications', ?)", (offsets[1],))
+
+    assert log.prune() == 2
+    assert [event['offset'] for event in log.read(0)] == offsets[2:]
+
+    with log._connection() as conn:
+        conn.execute('UPDATE consumers SET position = ?', (offsets[-1],))
+    assert log.prune() == 1
+    # The newest event stays, so offsets keep growing
+    assert log.latest() == offsets[-1]
+    assert log.publish(TICKET_CREATED, {'id': 4}) > offsets[-1]
+
+
+def test_recent_events_are_not_pruned(tmp_path):
+    log = EventLog(str(tmp_path / 'events.db'), retention=60)
+    for index in range(3):
+        log.publish(TICKET_CREATED, {'id': index})
+
+    assert log.prune() == 0
+    assert len(log.read(0)) == 3
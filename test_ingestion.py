@@ -0,0 +1,229 @@
+import threading
+import time
+
+import pytest
+from imap_tools import AND, U, MailBoxUnencrypted
+
+from ingestion import ImapIngestor
+from pipeline import EmailPipeline
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+class Persisted:
+    """persist callback recording the UIDs stored, in order"""
+
+    def __init__(self):
+        self.uids = []
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        with self.lock:
+            self.uids.append(int(item.uid))
+        return item.uid
+
+    def __contains__(self, uid):
+        with self.lock:
+            return uid in self.uids
+
+
+def make_pipeline(persist, **options):
+    return EmailPipeline(lambda texts: [('General Inquiry', 'rules-1')] * len(texts), persist, **options)
+
+
+def make_ingestor(imap_server, pipeline, **options):
+    options = {'ack_interval': 0.05, 'retry_delay': 0.05, 'poll_interval': 0.1, **options}
+    return ImapIngestor('127.0.0.1', 'support', 'secret', pipeline, port=imap_server.port, use_ssl=False, **options)
+
+
+@pytest.fixture
+def mailbox(imap_server):
+    with MailBoxUnencrypted('127.0.0.1', imap_server.port).login('support', 'secret') as mailbox:
+        yield mailbox
+
+
+@pytest.fixture
+def running(imap_server):
+    """Stops the ingestors a test started"""
+    ingestors = []
+    yield ingestors.append
+    # Ends any IDLE, which would otherwise hold the ingestor until it times out
+    imap_server.disconnect()
+    for ingestor in ingestors:
+        ingestor.stop(timeout=5)
+
+
+def test_fetch_ignores_newest_message_below_last_uid(imap_server, mailbox):
+    for _ in range(3):
+        imap_server.deliver()
+    pipeline = make_pipeline(Persisted())
+    ingestor = make_ingestor(imap_server, pipeline)
+
+    # The server answers 4:* with UID 3, the highest one
+    assert mailbox.uids(AND(seen=False, uid=U(4, '*'))) == ['3']
+    assert ingestor._fetch(mailbox, 3) == (3, True)
+    assert pipeline.in_flight == 0
+
+    assert ingestor._fetch(mailbox, 1) == (3, True)
+    assert [2, 3] in imap_server.fetches
+    assert pipeline.in_flight == 2
+
+
+def test_fetch_skips_read_messages_and_does_not_mark_them_read(imap_server, mailbox):
+    imap_server.deliver(seen=True)
+    imap_server.deliver()
+    pipeline = make_pipeline(Persisted())
+    ingestor = make_ingestor(imap_server, pipeline)
+
+    assert ingestor._fetch(mailbox, 0) == (2, True)
+    assert all(uids == [2] for uids in imap_server.fetches)
+    assert not imap_server.seen(2)
+
+
+def test_fetch_stops_while_pipeline_is_full(imap_server, mailbox):
+    for _ in range(5):
+        imap_server.deliver()
+    pipeline = make_pipeline(Persisted(), max_in_flight=2)
+    ingestor = make_ingestor(imap_server, pipeline)
+
+    assert ingestor._fetch(mailbox, 0) == (2, False)
+    assert imap_server.fetches == [[1, 2]]
+
+
+def test_fetch_pages_through_unread_messages(imap_server, mailbox):
+    for _ in range(5):
+        imap_server.deliver()
+    pipeline = make_pipeline(Persisted())
+    ingestor = make_ingestor(imap_server, pipeline, batch_size=2)
+
+    assert ingestor._fetch(mailbox, 0) == (5, True)
+    # The round that finds nothing new gets UID 5 again for 6:*
+    assert imap_server.fetches == [[1, 2], [3, 4], [5], [5]]
+    assert pipeline.in_flight == 5
+
+
+def test_persisted_messages_are_flagged_seen_in_one_store(imap_server, mailbox):
+    for _ in range(3):
+        imap_server.deliver()
+    persisted = Persisted()
+    pipeline = make_pipeline(persisted)
+    pipeline.start()
+    ingestor = make_ingestor(imap_server, pipeline)
+    ingestor._fetch(mailbox, 0)
+    wait_for(lambda: len(pipeline.persisted()) == 3)
+
+    ingestor._acknowledge(mailbox)
+
+    assert imap_server.stores == [[1, 2, 3]]
+    assert all(imap_server.seen(uid) for uid in (1, 2, 3))
+    assert pipeline.persisted() == [] and pipeline.in_flight == 0
+
+
+def test_messages_are_marked_seen_only_after_persist(imap_server, running):
+    for _ in range(3):
+        imap_server.deliver()
+    release = threading.Event()
+    persisted = Persisted()
+
+    def persist(item):
+        if item.uid == '2':
+            release.wait(5)
+        return persisted(item)
+
+    unpersisted_stores = []
+    imap_server.on_store = lambda uids: unpersisted_stores.extend(uid for uid in uids if uid not in persisted)
+    pipeline = make_pipeline(persist, persist_workers=2)
+    pipeline.start()
+    ingestor = make_ingestor(imap_server, pipeline)
+    ingestor.start()
+    running(ingestor)
+
+    wait_for(lambda: imap_server.seen(1) and imap_server.seen(3))
+    assert not imap_server.seen(2)
+    release.set()
+    wait_for(lambda: imap_server.seen(2))
+
+    assert unpersisted_stores == []
+    assert sorted(persisted.uids) == [1, 2, 3]
+
+
+def test_failed_message_is_fetched_again(imap_server, running):
+    for _ in range(3):
+        imap_server.deliver()
+    persisted = Persisted()
+    attempts = []
+
+    def persist(item):
+        attempts.append(item.uid)
+        if item.uid == '2' and attempts.count('2') == 1:
+            raise RuntimeError('database is locked')
+        return persisted(item)
+
+    pipeline = make_pipeline(persist)
+    pipeline.start()
+    ingestor = make_ingestor(imap_server, pipeline)
+    ingestor.start()
+    running(ingestor)
+
+    wait_for(lambda: all(imap_server.seen(uid) for uid in (1, 2, 3)))
+
+    assert sorted(persisted.uids) == [1, 2, 3]
+    assert attempts.count('2') == 2
+    # last_uid was rewound below the failed message to fetch it again
+    assert sum(2 in uids for uids in imap_server.fetches) == 2
+
+
+def test_idle_picks_up_new_mail_without_polling(imap_server, running):
+    persisted = Persisted()
+    pipeline = make_pipeline(persisted)
+    pipeline.start()
+    # Polling would take a minute, so only IDLE can deliver in time
+    ingestor = make_ingestor(imap_server, pipeline, idle_timeout=60, poll_interval=60)
+    ingestor.start()
+    running(ingestor)
+    wait_for(lambda: 'IDLE' in imap_server.commands)
+
+    imap_server.deliver()
+
+    wait_for(lambda: imap_server.seen(1), timeout=3)
+    assert persisted.uids == [1]
+
+
+@pytest.mark.parametrize('imap_server', [{'idle': False}], indirect=True)
+def test_polls_when_server_has_no_idle(imap_server, running):
+    persisted = Persisted()
+    pipeline = make_pipeline(persisted)
+    pipeline.start()
+    ingestor = make_ingestor(imap_server, pipeline, poll_interval=0.1)
+    ingestor.start()
+    running(ingestor)
+    wait_for(lambda: 'SEARCH' in imap_server.commands)
+
+    imap_server.deliver()
+
+    wait_for(lambda: imap_server.seen(1), timeout=3)
+    assert 'IDLE' not in imap_server.commands
+    assert persisted.uids == [1]
+
+
+def test_reconnects_after_connection_drops(imap_server, running):
+    persisted = Persisted()
+    pipeline = make_pipeline(persisted)
+    pipeline.start()
+    ingestor = make_ingestor(imap_server, pipeline, idle_timeout=60)
+    ingestor.start()
+    running(ingestor)
+    wait_for(lambda: 'IDLE' in imap_server.commands)
+
+    imap_server.disconnect()
+    imap_server.deliver()
+
+    wait_for(lambda: imap_server.seen(1))
+    assert imap_server.logins == 2
+    assert persisted.uids == [1]
@@ -0,0 +1,83 @@
+import smtplib
+from email.message import EmailMessage
+
+import pytest
+
+from config import settings
+from mailer import DEFAULT_ISSUE_HANDLERS, SMTPConnectionPool, parse_handlers
+
+
+def message(to, subject='Ticket'):
+    msg = EmailMessage()
+    msg['From'] = 'support@example.com'
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg.set_content('Hello')
+    return msg
+
+
+@pytest.fixture
+def pool(smtp_server):
+    pool = SMTPConnectionPool('127.0.0.1', smtp_server.port, 'user', 'secret', use_tls=False, timeout=5)
+    yield pool
+    pool.close()
+
+
+def test_batches_share_one_session(smtp_server, pool):
+    assert pool.send_batch([message('a@example.com'), message('b@example.com')]) == [None, None]
+    assert pool.send_batch([message('c@example.com')]) == [None]
+
+    assert smtp_server.recipients == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert len(smtp_server.sessions) == 1
+
+
+def test_idle_session_is_replaced(smtp_server):
+    pool = SMTPConnectionPool('127.0.0.1', smtp_server.port, use_tls=False, idle_timeout=0, timeout=5)
+    try:
+        pool.send_batch([message('a@example.com')])
+        pool.send_batch([message('b@example.com')])
+    finally:
+        pool.close()
+
+    assert len(smtp_server.sessions) == 2
+
+
+def test_reconnects_after_server_drops_session(smtp_server, pool):
+    assert pool.send_batch([message('a@example.com')]) == [None]
+    smtp_server.restart()
+
+    assert pool.send_batch([message('b@example.com'), message('c@example.com')]) == [None, None]
+    assert smtp_server.recipients == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert len(smtp_server.sessions) == 2
+
+
+def test_refused_message_does_not_stop_batch(smtp_server, pool):
+    smtp_server.reject.add('missing@example.com')
+
+    results = pool.send_batch([
+        message('a@example.com'), message('missing@example.com'), message('b@example.com')
+    ])
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], smtplib.SMTPRecipientsRefused)
+    assert smtp_server.recipients == ['a@example.com', 'b@example.com']
+    # The refusal did not cost the session
+    assert len(smtp_server.sessions) == 1
+
+
+def test_unreachable_server_fails_every_message(smtp_server, pool):
+    smtp_server.stop()
+
+    results = pool.send_batch([message('a@example.com'), message('b@example.com')])
+
+    assert all(isinstance(error, OSError) for error in results)
+
+
+def test_every_category_has_a_default_handler():
+    assert sorted(DEFAULT_ISSUE_HANDLERS) == sorted(group.lower() for group in settings.SERVICE_GROUPS)
+
+
+def test_handlers_setting_is_keyed_by_category_name():
+    handlers = parse_handlers('Billing=billing@example.com, Technical Support = it@example.com')
+
+    assert handlers == {'billing': 'billing@example.com', 'technical support': 'it@example.com'}
@@ -0,0 +1,69 @@
+import logging
+import threading
+
+from models import KeywordBackend, ModelClassifier
+
+
+class FlakyBackend:
+    """Fails to load a given number of times, then answers every text with one category"""
+
+    name = 'flaky'
+    version = 'flaky-1'
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = 0
+
+    def load(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise OSError('model files missing')
+
+    def classify_batch_with_version(self, texts):
+        return [('Billing', self.version) for _ in texts]
+
+
+def test_failed_load_is_retried_after_backoff(caplog):
+    backend = FlakyBackend(failures=1)
+    classifier = ModelClassifier(backend, KeywordBackend(), batch_size=1, cache_size=0, retry_delay=60)
+
+    with caplog.at_level(logging.ERROR):
+        assert not classifier.wait_until_loaded(timeout=0.2)
+    assert classifier.classify_with_version('my password reset failed')[1] != backend.version
+    assert any(record.exc_info for record in caplog.records)
+
+    # Still backing off: no new attempt
+    assert not classifier.wait_until_loaded(timeout=0.01)
+    assert backend.attempts == 1
+
+    # Backoff over
+    classifier._retry_at = 0
+    assert classifier.wait_until_loaded(timeout=1)
+    assert backend.attempts == 2
+    assert classifier.classify_with_version('my password reset failed') == ('Billing', 'flaky-1')
+
+
+class SlowBackend(FlakyBackend):
+    """Loads once allowed to"""
+
+    def __init__(self):
+        super().__init__(failures=0)
+        self.allowed = threading.Event()
+
+    def load(self):
+        self.allowed.wait(5)
+        super().load()
+
+
+def test_cached_fallback_answers_are_not_returned_once_the_model_is_ready():
+    backend = SlowBackend()
+    classifier = ModelClassifier(backend, KeywordBackend(), batch_size=1)
+    text = 'my password reset failed'
+
+    # Answered by the keywords while the model loads, and cached under their version
+    assert classifier.classify_with_version(text)[1] != backend.version
+
+    backend.allowed.set()
+    assert classifier.wait_until_loaded(timeout=1)
+    assert classifier.classify_with_version(text) == ('Billing', 'flaky-1')
+    assert classifier.classify_batch_with_version([text]) == [('Billing', 'flaky-1')]
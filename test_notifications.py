@@ -0,0 +1,287 @@
+import logging
+import time
+
+import pytest
+
+from mailer import EmailSender
+from notifications import NotificationQueue
+from scheduling import TeamLimits
+from storage import JsonlTicketStore, SqliteTicketStore
+
+
+@pytest.fixture
+def sender(smtp_server, monkeypatch):
+    monkeypatch.setenv('EMAIL_HOST', '127.0.0.1')
+    monkeypatch.setenv('EMAIL_PORT', str(smtp_server.port))
+    monkeypatch.setenv('EMAIL_USERNAME', 'support')
+    monkeypatch.setenv('EMAIL_PASSWORD', 'secret')
+    monkeypatch.setenv('EMAIL_USE_TLS', 'false')
+    sender = EmailSender()
+    yield sender
+    sender.pool.close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JsonlTicketStore(str(tmp_path / 'tickets.json'), str(tmp_path / 'tickets.log.jsonl'), fsync=False)
+    yield store
+    store.close()
+
+
+def make_queue(sender, store, tmp_path, **options):
+    options = {'workers': 0, 'base_delay': 0.01, 'max_delay': 0.05, **options}
+    return NotificationQueue(sender, store, str(tmp_path / 'outbox.db'), **options)
+
+
+def enqueue(queue, store, to='user@example.com', kind='confirmation'):
+    ticket = store.create({'description': 'Printer is broken', 'status': 'open'})
+    outbox_id = queue.enqueue(ticket['id'], kind, (to, f"Ticket #{ticket['id']}", 'Hello', False))
+    return ticket, outbox_id
+
+
+def outbox_row(queue, outbox_id):
+    return queue._connection().execute('SELECT * FROM outbox WHERE id = ?', (outbox_id,)).fetchone()
+
+
+def wait_until_due(queue, outbox_id):
+    time.sleep(max(0.0, outbox_row(queue, outbox_id)['next_attempt'] - time.time()))
+
+
+def queue_email(queue, priority, team=None, waited=0.0):
+    outbox_id = queue.enqueue(None, 'admin', ('admin@example.com', 'Ticket', 'Hello', False), priority=priority, team=team)
+    with queue._connection() as conn:
+        conn.execute('UPDATE outbox SET created = created - ? WHERE id = ?', (waited, outbox_id))
+    return outbox_id
+
+
+def test_claims_most_urgent_first_with_aging(store, tmp_path):
+    queue = make_queue(None, store, tmp_path, batch_size=2, aging=300.0)
+    fresh_low = queue_email(queue, 'low')
+    old_low = queue_email(queue, 'low', waited=700)
+    medium = queue_email(queue, 'medium')
+    high = queue_email(queue, 'high')
+
+    claims = [[row['id'] for row in queue._claim()] for _ in range(3)]
+
+    assert claims == [[old_low, high], [medium, fresh_low], []]
+
+
+def test_team_over_its_limit_does_not_block_other_teams(store, tmp_path):
+    queue = make_queue(None, store, tmp_path, batch_size=3, limits=TeamLimits({'billing': 60}, burst=1))
+    billing = [queue_email(queue, 'high', team='Billing') for _ in range(3)]
+    support = [queue_email(queue, 'low', team='Technical Support') for _ in range(2)]
+
+    assert [row['id'] for row in queue._claim()] == [billing[0], *support]
+    # Billing's next email waits for its bucket to refill
+    assert queue._claim() == []
+    assert 0 < queue.limits.blocked()['billing'] <= 1.0
+
+
+def test_due_emails_are_claimed_and_sent_in_one_session(smtp_server, sender, store, tmp_path):
+    queue = make_queue(sender, store, tmp_path)
+    tickets = [enqueue(queue, store, to=f'user{index}@example.com')[0] for index in range(3)]
+
+    assert queue.deliver_due() == 3
+    assert queue.deliver_due() == 0
+
+    assert sorted(smtp_server.recipients) == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert len(smtp_server.sessions) == 1
+    assert queue.stats() == {'sent': 3}
+    for ticket in tickets:
+        assert store.get(ticket['id'])['notifications']['confirmation'] == {
+            'status': 'sent', 'attempts': 1, 'error': None
+        }
+
+
+def test_relay_without_credentials_is_used(smtp_server, store, tmp_path, monkeypatch):
+    monkeypatch.setenv('EMAIL_HOST', '127.0.0.1')
+    monkeypatch.setenv('EMAIL_PORT', str(smtp_server.port))
+    monkeypatch.delenv('EMAIL_USERNAME', raising=False)
+    monkeypatch.delenv('EMAIL_PASSWORD', raising=False)
+    monkeypatch.setenv('EMAIL_FROM', 'support@example.com')
+    monkeypatch.setenv('EMAIL_USE_TLS', 'false')
+    sender = EmailSender()
+    try:
+        queue = make_queue(sender, store, tmp_path)
+        ticket, _ = enqueue(queue, store)
+
+        assert queue.deliver_due() == 1
+    finally:
+        sender.pool.close()
+
+    assert smtp_server.recipients == ['user@example.com']
+    assert store.get(ticket['id'])['notifications']['confirmation']['status'] == 'sent'
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_delivery_status_keeps_ticket_revision(smtp_server, sender, tmp_path, backend):
+    if backend == 'jsonl':
+        store = JsonlTicketStore(str(tmp_path / 'tickets.json'), str(tmp_path / 'tickets.log.jsonl'), fsync=False)
+    else:
+        store = SqliteTicketStore(str(tmp_path / 'tickets.db'))
+    try:
+        smtp_server.reject.add('user@example.com')
+        queue = make_queue(sender, store, tmp_path)
+        ticket = store.create({
+            'description': 'Printer is broken', 'priority': 'high', 'category': 'Technical Support',
+            'contact_email': 'user@example.com', 'status': 'open', 'date': '2026-01-01 09:00:00'
+        })
+        outbox_id = queue.enqueue(ticket['id'], 'confirmation', ('user@example.com', 'Ticket', 'Hello', False))
+        version = store.version
+
+        queue.deliver_due()
+        smtp_server.reject.clear()
+        wait_until_due(queue, outbox_id)
+        queue.deliver_due()
+
+        stored = store.get(ticket['id'])
+        assert stored['notifications']['confirmation']['status'] == 'sent'
+        assert stored['rev'] == ticket['rev']
+        assert store.version == version
+        assert store.changed_since(version) == []
+    finally:
+        store.close()
+
+
+def test_event_handled_twice_queues_each_email_once(smtp_server, sender, store, tmp_path):
+    queue = make_queue(sender, store, tmp_path)
+    ticket = store.create({
+        'description': 'I was charged twice', 'priority': 'high', 'category': 'Billing',
+        'contact_email': 'user@example.com', 'status': 'open', 'date': '2026-01-01 09:00:00'
+    })
+
+    queue.notify_new_ticket(ticket, event_id=7)
+    queue.notify_new_ticket(ticket, event_id=7)
+    assert queue.stats() == {'pending': 3}
+
+    queue.notify_new_ticket(ticket)
+    assert queue.stats() == {'pending': 6}
+
+
+def test_claimed_email_is_reclaimed_after_lease_expires(sender, store, tmp_path):
+    queue = make_queue(sender, store, tmp_path, lease=0.1)
+    _, outbox_id = enqueue(queue, store)
+
+    # Claimed by a worker that never reports back
+    assert [row['id'] for row in queue._claim()] == [outbox_id]
+    assert queue._claim() == []
+    time.sleep(0.15)
+
+    assert queue.deliver_due() == 1
+    assert queue.stats() == {'sent': 1}
+
+
+def test_failed_email_is_retried_with_backoff(smtp_server, sender, store, tmp_path):
+    smtp_server.reject.add('user@example.com')
+    queue = make_queue(sender, store, tmp_path, base_delay=0.2, max_delay=10)
+    ticket, outbox_id = enqueue(queue, store)
+
+    started = time.time()
+    assert queue.deliver_due() == 1
+    first = outbox_row(queue, outbox_id)
+    assert (first['status'], first['attempts']) == ('pending', 1)
+    assert '550' in first['last_error']
+    # Jittered between half and all of base_delay
+    assert started + 0.1 <= first['next_attempt'] <= time.time() + 0.2
+    assert store.get(ticket['id'])['notifications']['confirmation']['status'] == 'retrying'
+    # Not due again yet
+    assert queue.deliver_due() == 0
+
+    wait_until_due(queue, outbox_id)
+    failed_again = time.time()
+    assert queue.deliver_due() == 1
+    second = outbox_row(queue, outbox_id)
+    # The delay doubled
+    assert failed_again + 0.2 <= second['next_attempt'] <= time.time() + 0.4
+
+    smtp_server.reject.clear()
+    wait_until_due(queue, outbox_id)
+    assert queue.deliver_due() == 1
+    assert outbox_row(queue, outbox_id)['status'] == 'sent'
+    assert store.get(ticket['id'])['notifications']['confirmation'] == {
+        'status': 'sent', 'attempts': 3, 'error': None
+    }
+    assert smtp_server.recipients == ['user@example.com']
+
+
+def test_email_is_dead_lettered_after_max_attempts(smtp_server, sender, store, tmp_path):
+    smtp_server.reject.add('user@example.com')
+    queue = make_queue(sender, store, tmp_path, max_attempts=2)
+    ticket, outbox_id = enqueue(queue, store)
+
+    queue.deliver_due()
+    wait_until_due(queue, outbox_id)
+    queue.deliver_due()
+    wait_until_due(queue, outbox_id)
+
+    assert queue.deliver_due() == 0
+    assert queue.stats() == {'dead': 1}
+    [dead] = queue.dead_letters()
+    assert (dead['id'], dead['ticket_id'], dead['attempts']) == (outbox_id, ticket['id'], 2)
+    assert '550' in dead['last_error']
+    status = store.get(ticket['id'])['notifications']['confirmation']
+    assert (status['status'], status['attempts']) == ('dead', 2)
+
+
+def test_requeued_dead_letter_is_sent(smtp_server, sender, store, tmp_path):
+    smtp_server.reject.add('user@example.com')
+    queue = make_queue(sender, store, tmp_path, max_attempts=1)
+    ticket, outbox_id = enqueue(queue, store)
+    queue.deliver_due()
+    assert queue.stats() == {'dead': 1}
+
+    smtp_server.reject.clear()
+    assert queue.requeue(outbox_id)
+    # Only dead letters can be requeued
+    assert not queue.requeue(outbox_id)
+
+    assert queue.deliver_due() == 1
+    assert queue.stats() == {'sent': 1}
+    assert queue.dead_letters() == []
+    assert store.get(ticket['id'])['notifications']['confirmation']['status'] == 'sent'
+
+
+def test_unreachable_server_is_retried(smtp_server, sender, store, tmp_path):
+    smtp_server.stop()
+    queue = make_queue(sender, store, tmp_path)
+    _, outbox_id = enqueue(queue, store)
+
+    assert queue.deliver_due() == 1
+    row = outbox_row(queue, outbox_id)
+    assert (row['status'], row['attempts']) == ('pending', 1)
+
+
+def test_workers_deliver_in_the_background(smtp_server, sender, store, tmp_path):
+    queue = make_queue(sender, store, tmp_path, workers=2, poll_interval=0.05)
+    queue.start()
+    try:
+        for index in range(5):
+            enqueue(queue, store, to=f'user{index}@example.com')
+        deadline = time.monotonic() + 5
+        while queue.stats() != {'sent': 5} and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        queue.stop(timeout=5)
+
+    assert queue.stats() == {'sent': 5}
+    assert len(smtp_server.recipients) == 5
+
+
+def test_worker_errors_are_logged_with_traceback(sender, store, tmp_path, caplog, monkeypatch):
+    queue = make_queue(sender, store, tmp_path, workers=1, poll_interval=0.05)
+
+    def broken(emails):
+        raise RuntimeError('mail backend exploded')
+
+    monkeypatch.setattr(sender, 'deliver', broken)
+    with caplog.at_level(logging.ERROR):
+        queue.start()
+        enqueue(queue, store)
+        deadline = time.monotonic() + 5
+        while not caplog.records and time.monotonic() < deadline:
+            time.sleep(0.02)
+        queue.stop(timeout=5)
+
+    record = caplog.records[0]
+    assert 'Notification worker error: mail backend exploded' in record.getMessage()
+    assert record.exc_info is not None
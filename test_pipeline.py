@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import EmailPipeline
+
+
+def message(text, sender='user@example.com'):
+    return SimpleNamespace(text=text, html='', from_=sender)
+
+
+def classify(texts):
+    return [('Technical Support', 'rules-1') for _ in texts]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def blocked_loop():
+    """An event loop on its own thread, busy until the test ends"""
+    loop = asyncio.new_event_loop()
+    release = threading.Event()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    loop.call_soon_threadsafe(release.wait)
+    yield loop
+    release.set()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+# The timed-out request is cancelled before the loop ever starts it
+@pytest.mark.filterwarnings('ignore:coroutine .process_email. was never awaited')
+def test_persist_timeout_fails_the_email_for_refetching(blocked_loop):
+    main = pytest.importorskip('main')
+    pipeline = EmailPipeline(classify, lambda item: main.persist_email(item, blocked_loop, 0.05))
+    pipeline.start()
+
+    pipeline.submit('7', message('The printer is broken'))
+    wait_for(lambda: not pipeline.is_pending('7'))
+
+    assert pipeline.take_failed() == {'7'}
+    assert pipeline.persisted() == []
+    assert pipeline.metrics()['stages']['persist']['failed'] == 1
+
+
+class BlockingPersist:
+    """Persists emails in order once released; records what it stored"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.stored = []
+
+    def __call__(self, item):
+        self.release.wait(5)
+        self.stored.append(item.uid)
+        return SimpleNamespace(id=len(self.stored))
+
+
+def test_emails_are_acknowledged_only_after_they_are_persisted():
+    persist = BlockingPersist()
+    pipeline = EmailPipeline(classify, persist)
+    pipeline.start()
+
+    pipeline.submit('1', message('The printer is broken'))
+    time.sleep(0.1)
+    assert pipeline.persisted() == []
+    assert pipeline.in_flight == 1
+
+    persist.release.set()
+    wait_for(lambda: pipeline.persisted() == ['1'])
+    # Stored but not yet marked read: a refetch must not submit it again
+    assert pipeline.is_pending('1')
+    pipeline.submit('1', message('The printer is broken'))
+    time.sleep(0.1)
+    assert persist.stored == ['1']
+
+    pipeline.acknowledge(['1'])
+    assert pipeline.persisted() == []
+    assert not pipeline.is_pending('1')
+
+
+def test_full_queues_hold_back_submission():
+    persist = BlockingPersist()
+    pipeline = EmailPipeline(
+        classify, persist, parse_workers=1, classify_workers=1, classify_batch=1, queue_size=1, max_in_flight=100
+    )
+    pipeline.start()
+    submitted = []
+
+    def submit_all():
+        for index in range(20):
+            pipeline.submit(str(index), message(f'Request {index}'))
+            submitted.append(index)
+
+    submitter = threading.Thread(target=submit_all, daemon=True)
+    submitter.start()
+    # Wait for the submitter to stall on the full parse queue
+    previous = -1
+    while previous != len(submitted):
+        previous = len(submitted)
+        time.sleep(0.2)
+
+    # One email per queue and one held by each stage's worker, at most
+    assert len(submitted) <= 2 * len(pipeline.stages) + 1
+    assert all(stage.queue.qsize() <= 1 for stage in pipeline.stages)
+    assert submitter.is_alive()
+
+    persist.release.set()
+    submitter.join(5)
+    wait_for(lambda: len(persist.stored) == 20)
+    assert persist.stored == [str(index) for index in range(20)]
+
+
+def test_capacity_counts_unacknowledged_emails():
+    persist = BlockingPersist()
+    pipeline = EmailPipeline(classify, persist, max_in_flight=3)
+    pipeline.start()
+
+    for index in range(3):
+        pipeline.submit(str(index), message(f'Request {index}'))
+    assert pipeline.capacity == 0
+
+    persist.release.set()
+    wait_for(lambda: len(pipeline.persisted()) == 3)
+    # Persisted emails still count until the server has them marked read
+    assert pipeline.capacity == 0
+    pipeline.acknowledge(['0', '1'])
+    assert pipeline.capacity == 2
@@ -0,0 +1,43 @@
+from scheduling import TeamLimits, TokenBucket, effective_rank, parse_rates, priority_rank
+
+
+def test_waiting_raises_priority_one_level_per_aging_period():
+    high, medium, low = (priority_rank(priority) for priority in ('high', 'medium', 'low'))
+    assert (high, medium, low) == (0, 1, 2)
+    assert priority_rank('HIGH') == high and priority_rank(None) == medium and priority_rank('urgent') == medium
+
+    queued = [('low', low, 700.0), ('high', high, 0.0), ('medium', medium, 100.0), ('old medium', medium, 250.0)]
+    order = sorted(queued, key=lambda item: effective_rank(item[1], item[2], aging=300.0))
+    assert [name for name, _, _ in order] == ['low', 'high', 'old medium', 'medium']
+
+    # No aging: strict priority however long something waited
+    order = sorted(queued, key=lambda item: effective_rank(item[1], item[2], aging=0))
+    assert [name for name, _, _ in order] == ['high', 'medium', 'old medium', 'low']
+
+
+def test_token_bucket_allows_bursts_then_the_rate():
+    bucket = TokenBucket(rate=2.0, burst=3)
+    now = bucket.updated
+
+    assert [bucket.take(now) for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay(now) == 0.5
+    assert not bucket.take(now + 0.25)
+    assert bucket.take(now + 0.5)
+    # Idle time refills no more than the burst
+    assert [bucket.take(now + 60) for _ in range(4)] == [True, True, True, False]
+
+
+def test_team_limits_throttle_each_team_on_its_own():
+    limits = TeamLimits(parse_rates('Billing=60, security=120,'), default_rate=0, burst=2)
+
+    assert [limits.take('billing') for _ in range(3)] == [True, True, False]
+    assert limits.take('Security') and limits.take('security')
+    # Teams without a rate of their own, and no team at all, are unlimited
+    assert all(limits.take('Technical Support') for _ in range(100))
+    assert all(limits.take(None) for _ in range(100))
+
+    blocked = limits.blocked()
+    assert set(blocked) == {'billing', 'security'}
+    assert 0 < blocked['billing'] <= 1.0 and 0 < blocked['security'] <= 0.5
+    assert limits.blocked(['Technical Support']) == {}
+    assert limits.stats()['throttled'] == 1
@@ -0,0 +1,75 @@
+import itertools
+import random
+import time
+
+from service_handler import ServiceRequestHandler
+
+
+def wait_for_eviction(handler, live):
+    deadline = time.time() + 5
+    while len(handler) > live and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(handler) == live
+
+
+def test_repeats_are_counted_on_the_original(tmp_path):
+    handler = ServiceRequestHandler(max_requests=2, archive_path=str(tmp_path / 'archive.db'), evict_batch=1)
+    original = handler.create_request('Printer is broken', 'Technical Support', 'email')
+
+    assert handler.record_duplicate(original.id).duplicates == 1
+    assert handler.record_duplicate(original.id).to_dict()['duplicates'] == 2
+    assert handler.get_request(original.id).last_duplicate is not None
+
+    # Repeats of a request that moved to the archive are counted there
+    for index in range(2):
+        handler.create_request(f'Request {index}', 'Billing', 'web')
+    wait_for_eviction(handler, 2)
+    assert handler.record_duplicate(original.id).duplicates == 3
+    assert handler.get_request(original.id).duplicates == 3
+    assert handler.record_duplicate(999) is None
+
+
+def test_recent_matches_a_full_scan():
+    rng = random.Random(11)
+    handler = ServiceRequestHandler()
+    # Several chunks per query, so the scan resumes where each chunk ended
+    handler.SCAN_CHUNK = 7
+    for index in range(100):
+        handler.create_request(
+            f'Request {index}', rng.choice(['Billing', 'Technical Support']), rng.choice(['web', 'email']),
+            priority=rng.choice(['low', 'high'])
+        )
+    newest_first = sorted(handler.requests.values(), key=lambda request: request.id, reverse=True)
+
+    for status, category, priority in itertools.product([None, 'open', 'resolved'], [None, 'Billing'], [None, 'high']):
+        for limit, before_id, after_id in [(10, None, None), (100, 60, None), (5, None, 80), (50, 90, 20)]:
+            expected = [
+                request for request in newest_first
+                if (before_id is None or request.id < before_id) and (after_id is None or request.id > after_id)
+                and all(value is None or getattr(request, field) == value
+                        for field, value in [('status', status), ('category', category), ('priority', priority)])
+            ][:limit]
+            page = handler.recent(limit, before_id, after_id, status=status, category=category, priority=priority)
+            assert page == expected, (status, category, priority, limit, before_id, after_id)
+
+
+def test_oldest_requests_move_to_the_archive(tmp_path):
+    archive_path = str(tmp_path / 'archive.db')
+    handler = ServiceRequestHandler(max_requests=4, archive_path=archive_path, evict_batch=1)
+    for index in range(10):
+        handler.create_request(f'Request {index}', 'Billing' if index % 2 else 'Technical Support', 'web')
+    wait_for_eviction(handler, 4)
+
+    assert [request.id for request in handler.recent(20)] == [10, 9, 8, 7]
+    assert [request.id for request in handler.recent(20, category='Billing')] == [10, 8]
+    assert handler.stats() == {'live': 4, 'evicted': 6, 'next_id': 11}
+    archived = handler.get_request(2)
+    assert 2 not in handler.requests
+    assert (archived.text, archived.category, archived.source) == ('Request 1', 'Billing', 'web')
+
+    # The live requests are archived on close and the newest come back
+    handler.close()
+    handler = ServiceRequestHandler(max_requests=4, archive_path=archive_path, evict_batch=1)
+    assert [request.id for request in handler.recent(20)] == [10, 9]
+    assert handler.create_request('Request 10', 'Billing', 'web').id == 11
+    assert handler.get_request(7).text == 'Request 6'
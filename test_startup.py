@@ -0,0 +1,122 @@
+import json
+import os
+import signal
+import threading
+
+import pytest
+
+from startup import Deferred, ProcessStart
+
+fork_only = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+
+
+def in_child(func):
+    """Run func in a forked child and return what it returned, via a pipe"""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # A child stuck on a lock it inherited fails instead of hanging
+            signal.alarm(5)
+            os.close(read_end)
+            result = func()
+            os.write(write_end, json.dumps(result).encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        result = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+def test_deferred_builds_once_on_first_use():
+    calls = []
+    started = threading.Event()
+
+    def factory():
+        calls.append(1)
+        started.wait(1)
+        return {'name': 'store'}
+
+    deferred = Deferred('test-store', factory)
+    assert not deferred.is_built
+
+    deferred.warm_up()
+    # A request arriving during the warm-up waits for it instead of building again
+    waiting = [threading.Thread(target=deferred.build) for _ in range(4)]
+    for thread in waiting:
+        thread.start()
+    started.set()
+    for thread in waiting:
+        thread.join()
+
+    assert deferred.is_built and len(calls) == 1
+    assert deferred.get('name') == 'store'
+
+
+@fork_only
+def test_forked_child_builds_its_own_copy():
+    deferred = Deferred('test-pid', lambda: {'pid': os.getpid()})
+    assert deferred.get('pid') == os.getpid()
+
+    child = in_child(lambda: [deferred.is_built, deferred.get('pid')])
+
+    assert child[0] is False
+    assert child[1] != os.getpid()
+    assert deferred.get('pid') == os.getpid()
+
+
+@fork_only
+def test_fork_during_a_build_does_not_block_the_child():
+    building, release = threading.Event(), threading.Event()
+    parent = os.getpid()
+
+    def factory():
+        if os.getpid() == parent:
+            building.set()
+            release.wait(5)
+        return {'pid': os.getpid()}
+
+    deferred = Deferred('test-slow', factory)
+    deferred.warm_up()
+    building.wait(5)
+    try:
+        # The parent's build holds the lock; the child must not wait for it
+        child = in_child(lambda: deferred.get('pid'))
+    finally:
+        release.set()
+
+    assert child != os.getpid()
+    assert deferred.get('pid') == os.getpid()
+
+
+@fork_only
+def test_hooks_run_once_in_each_process():
+    process_start = ProcessStart()
+    runs = []
+
+    @process_start.register
+    def first():
+        runs.append(('first', os.getpid()))
+
+    @process_start.register
+    def second():
+        runs.append(('second', os.getpid()))
+
+    process_start()
+    process_start()
+    assert runs == [('first', os.getpid()), ('second', os.getpid())]
+
+    def serve_twice():
+        process_start()
+        process_start()
+        return [[name, pid] for name, pid in runs]
+
+    child = in_child(serve_twice)
+
+    # The child inherited the parent's runs and ran every hook once more itself
+    assert child[:2] == [['first', os.getpid()], ['second', os.getpid()]]
+    assert [name for name, _ in child[2:]] == ['first', 'second']
+    assert all(pid != os.getpid() for _, pid in child[2:])
+    assert len(runs) == 2
@@ -0,0 +1,299 @@
+import collections
+import itertools
+import json
+import math
+import os
+import random
+
+import pytest
+
+from storage import RESOLVE_PERCENTILES, JsonlTicketStore, SqliteTicketStore, resolve_seconds
+
+
+def open_backend(backend, tmp_path):
+    if backend == 'jsonl':
+        return JsonlTicketStore(str(tmp_path / 'tickets.json'), str(tmp_path / 'tickets.log.jsonl'), fsync=False)
+    return SqliteTicketStore(str(tmp_path / 'tickets.db'))
+
+
+@pytest.fixture(params=['jsonl', 'sqlite'])
+def store(request, tmp_path):
+    store = open_backend(request.param, tmp_path)
+    yield store
+    store.close()
+
+
+def ticket(description='Printer is broken', category='Technical Support', priority='high', status='open',
+           date='2026-01-01 09:00:00', **fields):
+    return dict(description=description, category=category, priority=priority, status=status, date=date,
+                contact_email='user@example.com', **fields)
+
+
+def test_recent_is_newest_first_and_clamps_limit(store):
+    created = [store.create(ticket(f'Request {index}')) for index in range(3)]
+
+    assert [item['id'] for item in store.recent(2)] == [created[2]['id'], created[1]['id']]
+    assert store.recent(0) == []
+    assert store.recent(-1) == []
+
+
+def test_search_ranks_while_tickets_are_added(store):
+    store.create(ticket('Printer jammed on floor 2'))
+    first = store.search('printer')
+
+    store.create(ticket('Printer printer out of toner'))
+
+    assert [item['description'] for item in first] == ['Printer jammed on floor 2']
+    assert [item['description'] for item in store.search('printer')] == [
+        'Printer printer out of toner', 'Printer jammed on floor 2'
+    ]
+
+
+SEARCH_WORDS = ['printer', 'toner', 'invoice', 'refund', 'login', 'password', 'network', 'slow', 'broken', 'screen']
+
+
+def test_search_ranks_like_fts5(tmp_path):
+    rng = random.Random(7)
+    stores = [open_backend('jsonl', tmp_path), open_backend('sqlite', tmp_path)]
+    try:
+        for _ in range(80):
+            description = ' '.join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(1, 8)))
+            status = rng.choice(['open', 'resolved'])
+            for store in stores:
+                store.create(ticket(description, status=status))
+        for ticket_id in rng.sample(range(1, 81), 10):
+            changes = {'description': 'printer ' * rng.randint(1, 3) + 'moved'}
+            for store in stores:
+                store.update(ticket_id, changes)
+
+        jsonl, sqlite = stores
+        for word in SEARCH_WORDS:
+            # One word and one searched field: both score with the same BM25
+            # term weight, so the order must match exactly
+            for options in [{}, {'limit': 5}, {'status': 'open', 'limit': 3}]:
+                expected = [item['id'] for item in sqlite.search(word, **options)]
+                assert [item['id'] for item in jsonl.search(word, **options)] == expected, (word, options)
+        for words in itertools.combinations(SEARCH_WORDS[:5], 2):
+            # The two weigh rare words differently, but must match the same tickets
+            query = ' '.join(words)
+            assert (sorted(item['id'] for item in jsonl.search(query, limit=None))
+                    == sorted(item['id'] for item in sqlite.search(query, limit=None))), query
+    finally:
+        for store in stores:
+            store.close()
+
+
+def open_jsonl(tmp_path, **options):
+    return JsonlTicketStore(str(tmp_path / 'tickets.json'), str(tmp_path / 'tickets.log.jsonl'), fsync=False, **options)
+
+
+def test_log_is_replayed_on_restart(tmp_path):
+    store = open_jsonl(tmp_path)
+    created = store.create(ticket())
+    store.update(created['id'], {'status': 'resolved', 'resolved_date': '2026-01-01 10:00:00'})
+    version = store.version
+    store.close()
+
+    store = open_jsonl(tmp_path)
+    try:
+        assert store.get(created['id'])['status'] == 'resolved'
+        assert store.version == version
+        assert store.create(ticket())['id'] == created['id'] + 1
+    finally:
+        store.close()
+
+
+def test_torn_final_line_is_cut_off(tmp_path):
+    store = open_jsonl(tmp_path)
+    created = store.create(ticket())
+    store.close()
+    log_path = tmp_path / 'tickets.log.jsonl'
+    intact = log_path.read_bytes()
+    with open(log_path, 'ab') as f:
+        # A crash in the middle of an append
+        f.write(b'{"op": "create", "ticket": {"id": 2, "descr')
+
+    store = open_jsonl(tmp_path)
+    try:
+        assert log_path.read_bytes() == intact
+        assert [item['id'] for item in store.all()] == [created['id']]
+        store.create(ticket('Second'))
+    finally:
+        store.close()
+
+    store = open_jsonl(tmp_path)
+    try:
+        assert [item['description'] for item in store.all()] == ['Printer is broken', 'Second']
+    finally:
+        store.close()
+
+
+def test_compaction_folds_log_into_snapshot(tmp_path):
+    store = open_jsonl(tmp_path, compact_every=3)
+    for index in range(3):
+        store.create(ticket(f'Request {index}'))
+    # The third record started a compaction in the background
+    store._compaction.join(5)
+    store.create(ticket('Request 3'))
+    store.update(1, {'status': 'resolved', 'resolved_date': '2026-01-01 10:00:00'})
+    store.close()
+
+    assert not (tmp_path / 'tickets.log.jsonl.compacting').exists()
+    assert len(json.loads((tmp_path / 'tickets.json').read_text())) == 3
+    assert len((tmp_path / 'tickets.log.jsonl').read_text().splitlines()) == 2
+
+    store = open_jsonl(tmp_path)
+    try:
+        assert [item['description'] for item in store.all()] == [f'Request {index}' for index in range(4)]
+        assert store.get(1)['status'] == 'resolved'
+        store.compact()
+        assert len(json.loads((tmp_path / 'tickets.json').read_text())) == 4
+        assert (tmp_path / 'tickets.log.jsonl').read_text() == ''
+    finally:
+        store.close()
+
+
+def test_interrupted_compaction_is_finished_on_restart(tmp_path):
+    store = open_jsonl(tmp_path)
+    store.create(ticket('First'))
+    store.close()
+    # Crash after the log was rotated but before the snapshot was written
+    os.replace(tmp_path / 'tickets.log.jsonl', tmp_path / 'tickets.log.jsonl.compacting')
+
+    store = open_jsonl(tmp_path)
+    try:
+        store.create(ticket('Second'))
+        store._compaction.join(5)
+        assert [item['description'] for item in store.all()] == ['First', 'Second']
+        assert not (tmp_path / 'tickets.log.jsonl.compacting').exists()
+        assert [item['description'] for item in json.loads((tmp_path / 'tickets.json').read_text())] == ['First']
+    finally:
+        store.close()
+
+
+def brute_force_find(tickets, newest_first=False, limit=None, after_id=None, before_id=None, **filters):
+    matches = [
+        item for item in tickets
+        if all(value is None or item.get(field) == value for field, value in filters.items())
+        and (after_id is None or item['id'] > after_id) and (before_id is None or item['id'] < before_id)
+    ]
+    if newest_first:
+        matches.reverse()
+    return matches[:limit]
+
+
+def test_find_matches_a_full_scan(store):
+    rng = random.Random(3)
+    for index in range(60):
+        store.create(ticket(
+            f'Request {index}', category=rng.choice(['Billing', 'Technical Support']),
+            priority=rng.choice(['low', 'high'])
+        ))
+    for ticket_id in rng.sample(range(1, 61), 20):
+        # Moves the ticket between the status and category indexes
+        store.update(ticket_id, {'status': 'resolved', 'category': rng.choice(['Billing', 'Account Management'])})
+    tickets = store.all()
+
+    for status, category, priority in itertools.product([None, 'open', 'resolved'], [None, 'Billing'], [None, 'high']):
+        for after_id, before_id, newest_first, limit in [
+            (None, None, False, None), (10, None, False, 5), (None, 50, True, 7), (20, 40, True, None)
+        ]:
+            options = dict(status=status, category=category, priority=priority, after_id=after_id,
+                           before_id=before_id, newest_first=newest_first, limit=limit)
+            assert store.find(**options) == brute_force_find(tickets, **options), options
+
+
+def test_find_pages_with_a_cursor(store):
+    for index in range(7):
+        store.create(ticket(f'Request {index}', category='Billing' if index % 2 else 'Technical Support'))
+
+    pages, cursor = [], None
+    while True:
+        page = store.find(category='Technical Support', before_id=cursor, newest_first=True, limit=2)
+        if not page:
+            break
+        pages.append([item['id'] for item in page])
+        cursor = page[-1]['id']
+
+    assert pages == [[7, 5], [3, 1]]
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_changed_since_returns_changes_in_revision_order(tmp_path, backend):
+    store = open_backend(backend, tmp_path)
+    for index in range(3):
+        store.create(ticket(f'Request {index}'))
+    version = store.version
+    store.update(1, {'status': 'resolved', 'resolved_date': '2026-01-01 10:00:00'})
+    store.create(ticket('Request 3'))
+    store.update(2, {'priority': 'low'})
+
+    assert [item['id'] for item in store.changed_since(version)] == [1, 4, 2]
+    assert [item['id'] for item in store.changed_since(version, limit=2)] == [1, 4]
+    assert store.changed_since(store.version) == []
+    if backend == 'jsonl':
+        # The snapshot is in id order; reloading must restore revision order
+        store.compact()
+    store.close()
+
+    store = open_backend(backend, tmp_path)
+    try:
+        changed = store.changed_since(version)
+        assert [item['id'] for item in changed] == [1, 4, 2]
+        assert [item['rev'] for item in changed] == sorted(item['rev'] for item in changed)
+        assert store.changed_since(changed[0]['rev']) == changed[1:]
+    finally:
+        store.close()
+
+
+def expected_stats(tickets):
+    """stats() computed from scratch"""
+    def counts(field):
+        return dict(collections.Counter(item.get(field) or 'unknown' for item in tickets))
+
+    seconds = sorted(s for s in map(resolve_seconds, tickets) if s is not None)
+    time_to_resolve = {'count': len(seconds)}
+    if seconds:
+        time_to_resolve['avg_hours'] = round(sum(seconds) / len(seconds) / 3600, 2)
+        for percentile in RESOLVE_PERCENTILES:
+            rank = max(math.ceil(percentile / 100 * len(seconds)) - 1, 0)
+            time_to_resolve[f'p{percentile}_hours'] = round(seconds[rank] / 3600, 2)
+    return {
+        'total': len(tickets),
+        'by_status': counts('status'),
+        'by_category': counts('category'),
+        'by_priority': counts('priority'),
+        'daily': dict(sorted(collections.Counter(item['date'][:10] for item in tickets).items())),
+        'time_to_resolve': time_to_resolve
+    }
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_stats_match_a_recount_after_changes_and_reload(tmp_path, backend):
+    rng = random.Random(5)
+    store = open_backend(backend, tmp_path)
+    for index in range(40):
+        store.create(ticket(
+            f'Request {index}', category=rng.choice(['Billing', 'Technical Support']),
+            priority=rng.choice(['low', 'high']), date=f'2026-01-{rng.randint(1, 3):02d} 09:00:00'
+        ))
+    for ticket_id in rng.sample(range(1, 41), 15):
+        stored = store.get(ticket_id)
+        store.update(ticket_id, {
+            'status': 'resolved', 'resolved_date': f"{stored['date'][:10]} {rng.randint(10, 23)}:00:00"
+        })
+    assert store.stats() == expected_stats(store.all())
+
+    # A changed resolve time moves the percentiles
+    resolved = next(item for item in store.all() if item['status'] == 'resolved')
+    store.update(resolved['id'], {'resolved_date': '2026-01-09 09:00:00'})
+    assert store.stats() == expected_stats(store.all())
+    if backend == 'jsonl':
+        store.compact()
+    store.close()
+
+    store = open_backend(backend, tmp_path)
+    try:
+        assert store.stats() == expected_stats(store.all())
+    finally:
+        store.close()